@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:36:08 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import os
+import heapq
+import threading
+from publishtimer import schedule_cache
+
+
+AGGREGATES_ENABLED = os.environ.get('AGGREGATES_ENABLED',
+                                    'false').lower() == 'true'
+AGGREGATES_VERIFY = os.environ.get('AGGREGATES_VERIFY',
+                                   'false').lower() == 'true'
+AGGREGATES_BACKEND = os.environ.get('AGGREGATES_BACKEND', 'memory')
+AGGREGATES_DIR = os.environ.get('AGGREGATES_DIR',
+                                os.path.join('cache', 'aggregates'))
+SCHEDULE_LIMIT = 50
+DAY_MAP = {0:'mon', 1:'tue', 2:'wed', 3:'thu', 4:'fri', 5:'sat', 6:'sun'}
+
+STORE = None
+STORE_LOCK = threading.Lock()
+
+
+def new_aggregate(twitter_id):
+    """Returns empty aggregate of tweets of given user
+
+        Aggregate: {'twitter_id': <twitter_id>,
+                    'newest_id': <id of newest tweet folded, 0 if none>,
+                    'count': <number of tweets folded>,
+                    'es_count': <number of tweets of the user in ES when they were last fetched into it>,
+                    'max_engagement': <highest engagement folded>,
+                    'slots': {'<day>:<hour>:<minute>': [<tweets>, <total engagement>, <max engagement>]},
+                    'candidates': {'<day>': [[<engagement>, <id>, <hour>, <minute>], ...]}}
+
+        Candidates of a day are its SCHEDULE_LIMIT tweets ranked highest by compute_times - the only tweets its schedule can hold -
+        kept as a min-heap so that a new tweet is folded in O(log SCHEDULE_LIMIT).
+        Tweets are folded once: later changes to their engagement counts do not reach the aggregate
+    """
+    return {'twitter_id': twitter_id,
+            'newest_id': 0,
+            'count': 0,
+            'es_count': 0,
+            'max_engagement': 0,
+            'slots': {},
+            'candidates': {}}
+
+
+def fold(aggregate, ids, day, hour, minute, engagement):
+    """Folds tweets given as columns into aggregate in place, skipping repeated tweets and those not newer than its newest_id
+
+        Runs in O(number of tweets given): updates count, max_engagement and slot statistics and offers each tweet to the candidates of its day
+        :Returns: [int] number of tweets folded
+    """
+    folded = 0
+    newest_id = aggregate['newest_id']
+    seen = set()
+    for i, d, h, m, e in zip(ids, day, hour, minute, engagement):
+        i, d, h, m, e = long(i), int(d), int(h), int(m), float(e)
+        if i <= aggregate['newest_id'] or i in seen or not 0 <= d < 7:
+            continue
+        seen.add(i)
+        folded += 1
+        newest_id = max(newest_id, i)
+        aggregate['max_engagement'] = max(aggregate['max_engagement'], e)
+        slot = str(d) + ':' + str(h) + ':' + str(m)
+        stats = aggregate['slots'].get(slot)
+        if stats is None:
+            aggregate['slots'][slot] = [1, e, e]
+        else:
+            stats[0] += 1
+            stats[1] += e
+            stats[2] = max(stats[2], e)
+        heap = aggregate['candidates'].setdefault(str(d), [])
+        if len(heap) < SCHEDULE_LIMIT:
+            heapq.heappush(heap, [e, i, h, m])
+        elif [e, i] > heap[0][:2]:
+            heapq.heapreplace(heap, [e, i, h, m])
+    aggregate['newest_id'] = newest_id
+    aggregate['count'] += folded
+    return folded
+
+
+def derive_schedule(aggregate):
+    """Returns schedule of the user in the form of compute_times response, derived from candidates of aggregate in O(7 * SCHEDULE_LIMIT)
+
+        compute_times ranks tweets of a day on engagement normalized by a positive per-user constant, which keeps their order,
+        breaking ties in favour of newer tweets; if no tweet has any engagement its scores are undefined and the schedule is empty.
+    """
+    out_dict = {'authUid': unicode(aggregate['twitter_id']) + u'-tw',
+                'completeSchedule': [],
+                'source': 'internal'}
+    if not aggregate['max_engagement']:
+        return out_dict
+    for d in range(7):
+        heap = aggregate['candidates'].get(str(d))
+        if heap:
+            ranked = sorted(heap, key=lambda c: (c[0], c[1]), reverse=True)
+            out_dict['completeSchedule'].append(
+                {'day': DAY_MAP[d],
+                 'times': ['{}:{}'.format(h, m) for e, i, h, m in ranked]})
+    return out_dict
+
+
+def slot_statistics(aggregate):
+    """Returns running engagement statistics of aggregate per (weekday, hour, minute): {(day, hour, minute): {'tweets', 'mean', 'max'}}
+    """
+    ret = {}
+    for slot, (count, total, highest) in aggregate['slots'].items():
+        ret[tuple(int(v) for v in slot.split(':'))] = \
+            {'tweets': count, 'mean': total / count, 'max': highest}
+    return ret
+
+
+def create_store(backend=None):
+    """Returns a new store of aggregates for given backend name: 'memory' or 'disk' (one JSON file per user in AGGREGATES_DIR)
+        :param backend: :default: environment variable AGGREGATES_BACKEND or 'memory'
+    """
+    backend = backend or AGGREGATES_BACKEND
+    if backend == 'memory':
+        return schedule_cache.MemoryStore(name='aggregates')
+    if backend == 'disk':
+        return schedule_cache.DiskStore(directory=AGGREGATES_DIR, 
+                                        name='aggregates')
+    raise ValueError("Unknown AGGREGATES_BACKEND: " + str(backend))
+
+
+def get_store():
+    """Returns the singleton store of aggregates, creating it on first call
+    """
+    global STORE
+    with STORE_LOCK:
+        if STORE is None:
+            STORE = create_store()
+        return STORE
+
+
+def set_store(store):
+    """Replaces the singleton store; None reverts to AGGREGATES_BACKEND on next use
+    """
+    global STORE
+    with STORE_LOCK:
+        STORE = store
+
+
+def get_aggregate(twitter_id):
+    """Returns stored aggregate of given user, None if absent
+    """
+    return get_store().get(unicode(twitter_id))
+
+
+def put_aggregate(aggregate):
+    """Stores given aggregate, replacing the previous one of its user
+    """
+    get_store().set(unicode(aggregate['twitter_id']), aggregate)
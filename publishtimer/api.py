@@ -9,14 +9,24 @@ import os
 import logging
 import traceback
 import sys
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, make_response, url_for
 from publishtimer.core import work_once as worker_function
+from publishtimer.core import work_batch as batch_worker_function
+from publishtimer.core import parse_args
+from publishtimer import metrics
+from publishtimer import elasticsearch_util as es
+from publishtimer import twitter_data as td
+from publishtimer import jobs
+from publishtimer import rate_limit
+from publishtimer import compute_pool
 from logging.handlers import RotatingFileHandler
 from werkzeug.exceptions import Aborter
 from publishtimer.custom_exceptions import WriteScheduleFailedError
 
 
 ERROR_MAPPINGS = {512: WriteScheduleFailedError}
+PUBLISH_SCHEDULE_ASYNC = os.environ.get('PUBLISH_SCHEDULE_ASYNC', 
+                                        'false').lower() == 'true'
 
 abort = Aborter(extra=ERROR_MAPPINGS)
 
@@ -30,6 +40,21 @@ def index():
     return "pong"
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """API to monitor the service
+
+    Returns snapshot of counters, gauges and stage timers of metrics.REGISTRY
+    along with last known health of ES, stats of credentials caches and
+    state of Twitter rate limits per credential and endpoint
+    """
+    snapshot = metrics.REGISTRY.snapshot()
+    snapshot['es_health'] = es.get_es_health()
+    snapshot['caches'] = td.get_cache_stats()
+    snapshot['rate_limits'] = rate_limit.LIMITER.snapshot()
+    return make_response(jsonify(snapshot), 200)
+
+
 @app.route('/api/v1.0/publishschedule', methods=['POST'])
 def publish_schedule():
     """API to trigger the publishtimer for desired authUid
@@ -40,9 +65,15 @@ def publish_schedule():
     :Returns: JSON Response containing:
             1. JSONified response recieved from save_schedule API
             2. schedule computed by publishtimer
+        In async mode, returns 202 right away with the id of the job queued
+        to compute the schedule in the local worker pool, and URL to poll
+        its status and result at (see publish_schedule_job)
 
     :Response format: {'response_from_save_schedule_api': <jsonifird response>,
                        'schedule_prepared': <computed_schedule>}
+    :Async response format: {'job_id': <job_id>,
+                             'status': 'queued',
+                             'status_url': <URL of job status>}
 
     :Request_URL: <base_url>/api/v1.0/publishschedule
 
@@ -74,10 +105,42 @@ def publish_schedule():
             :description:   When True, Data if fetched from Twitter API, will
                             be saved to elasticsearch for future use.
 
+        :param max_tweets: [optional]
+            :type:          int
+            :description:   Number of most recent tweets in elasticsearch to
+                            compute the schedule from.
+            :default:       environment variable ES_MAX_TWEETS if set, else
+                            all tweets
+
+        :param use_cache: [optional]
+            :type:          bool
+            :description:   When True, schedule computed earlier is returned
+                            if tweets of given authUid in elasticsearch did not
+                            change since.
+            :default:       True
+
+        :param async: [optional]
+            :type:          bool
+            :description:   When True, respond with 202 and a job id right
+                            away instead of waiting for the schedule.
+            :default:       environment variable PUBLISH_SCHEDULE_ASYNC or
+                            False
+
+        :param refresh: [optional]
+            :type:          bool
+            :description:   When True and data exists in elasticsearch, only
+                            tweets newer than the newest one stored are
+                            fetched from Twitter API and added to it.
+            :default:       False
+
     :Request_format: {'authUid': u'<authUid>',
                       'use_es': <(True/False)>,
                       'use_tw': <(True/False)>,
-                      'save_on_fly': <(True/False)>}
+                      'save_on_fly': <(True/False)>,
+                      'max_tweets': <int>,
+                      'use_cache': <(True/False)>,
+                      'refresh': <(True/False)>,
+                      'async': <(True/False)>}
     """
     if not request.json:
         abort(400, description="aborting because empty request.json")
@@ -93,7 +156,22 @@ def publish_schedule():
     if 'save_on_fly' in request.json and \
             type(request.json['save_on_fly']) is not bool:
         abort(400, description="Aborting: save_on_fly is not bool")
-    results, write_response = worker_function(**request.json)
+    for flag in ['use_cache', 'refresh', 'async']:
+        if flag in request.json and type(request.json[flag]) is not bool:
+            abort(400, description="Aborting: " + flag + " is not bool")
+    if 'max_tweets' in request.json and \
+            type(request.json['max_tweets']) not in [int, long]:
+        abort(400, description="Aborting: max_tweets is not int")
+    params = dict(request.json)
+    if params.pop('async', PUBLISH_SCHEDULE_ASYNC):
+        job_id = jobs.get_manager().submit(publish_job, params)
+        status_url = url_for('publish_schedule_job', job_id=job_id)
+        response = make_response(jsonify({'job_id': job_id,
+                                          'status': 'queued',
+                                          'status_url': status_url}), 202)
+        response.headers['Location'] = status_url
+        return response
+    results, write_response = worker_function(**params)
     if write_response.status_code == 200:
         return make_response(jsonify(results), 200)
     else:
@@ -101,6 +179,98 @@ def publish_schedule():
                       'computed_schedule': results})
 
 
+def publish_job(params):
+    """Job queued by publish_schedule in async mode: calls the worker_function with given params and returns the schedule prepared
+        Raises WriteScheduleFailedError if save_schedule API returns failure response
+    """
+    results, write_response = worker_function(**params)
+    if write_response.status_code != 200:
+        raise WriteScheduleFailedError(upstream_response=write_response,
+                                       computed_schedule=results)
+    return results
+
+
+@app.route('/api/v1.0/publishschedule/jobs/<job_id>', methods=['GET'])
+def publish_schedule_job(job_id):
+    """API to get status and result of a job queued by publish_schedule in async mode
+
+    :Returns: JSON Response containing the job:
+        {'job_id': <job_id>,
+         'status': <queued/running/succeeded/failed>,
+         'submitted_at': <epoch seconds>,
+         'started_at': <epoch seconds or null>,
+         'finished_at': <epoch seconds or null>,
+         'result': <computed_schedule, when succeeded>,
+         'error': <error, when failed>,
+         'description': <description of error, when failed>,
+         'computed_schedule': <computed_schedule, when failed in writing it>}
+        404 if job id is unknown or its result expired (JOB_RESULT_TTL)
+
+    :Request_URL: <base_url>/api/v1.0/publishschedule/jobs/<job_id>
+
+    :Method: GET
+    """
+    job = jobs.get_manager().get(job_id)
+    if job is None:
+        abort(404, description="No job with id " + job_id)
+    return make_response(jsonify(job), 200)
+
+
+@app.route('/api/v1.0/publishschedule/batch', methods=['POST'])
+def publish_schedule_batch():
+    """API to trigger the publishtimer for many authUids in one request
+
+    Calls the batch_worker_function imported from core module with received
+    params as args and returns its per-authUid results. Failure for some
+    authUids does not fail the request.
+
+    :Returns: JSON Response containing list of results, one per authUid in
+              order of request
+
+    :Response format: {'results': [{'authUid': <authUid>,
+                                    'status': <'success'/'failure'>,
+                                    'schedule_prepared': <computed_schedule>,
+                                    'status_code': <save_schedule API status>,
+                                    'error': <reason of failure>}, ...]}
+
+    :Request_URL: <base_url>/api/v1.0/publishschedule/batch
+
+    :Method: POST
+
+    :Request_type: JSON
+
+    :Request_params:
+
+        :param authUids:
+            :type:          list of unicode
+            :decription:    authUids whose schedules are to be computed
+
+        :param use_es, use_tw, save_on_fly: [optional]
+            Same as of /api/v1.0/publishschedule
+
+    :Request_format: {'authUids': [u'<authUid>', ...],
+                      'use_es': <(True/False)>,
+                      'use_tw': <(True/False)>,
+                      'save_on_fly': <(True/False)>}
+    """
+    if not request.json:
+        abort(400, description="aborting because empty request.json")
+    if 'authUids' not in request.json:
+        abort(400, description="aborting because authUids not in request")
+    if type(request.json['authUids']) is not list or \
+            any(type(authUid) not in [unicode, long, int, str]
+                for authUid in request.json['authUids']):
+        abort(400, description="Aborting: authUids is not list of " +
+                               "unicode/long/int/str")
+    for flag in ['use_es', 'use_tw', 'save_on_fly']:
+        if flag in request.json and type(request.json[flag]) is not bool:
+            abort(400, description="Aborting: " + flag + " is not bool")
+    params = dict((k, v) for k, v in request.json.items()
+                  if k in ['use_es', 'use_tw', 'save_on_fly'])
+    results = batch_worker_function(request.json['authUids'], **params)
+    return make_response(jsonify({'results': results}), 200)
+
+
 @app.errorhandler(400)
 def bad_request(error):
     """Handle 400 error to JSONify the response
@@ -160,8 +330,11 @@ def unhandled_error(error):
             getattr(error, 'code', 0))
 
 
-def initiate():
+def initiate(compute_workers=None):
     '''Initiates the required parameters for the server and starts it
+
+        :param compute_workers: [int] number of worker processes of compute_pool computing schedules, started before the server,
+            0 to compute in the threads serving requests :default: environment variable COMPUTE_WORKERS or 0
     '''
     host = os.environ['SERVER_NAME'].split(':')[0]
     port = int(os.environ['SERVER_NAME'].split(':')[1])
@@ -184,8 +357,12 @@ def initiate():
     for error in [i for i in range(400, 600) if i not in [400, 404, 500, 512]]:
         app.error_handler_spec[None][error] = unhandled_error
     application.logger.addHandler(handler)
-    application.run(host=host, port=port)
+    compute_pool.start(compute_workers)
+    try:
+        application.run(host=host, port=port)
+    finally:
+        compute_pool.stop()
 
 
 if __name__ == "__main__":
-    initiate()
+    initiate(compute_workers=parse_args().compute_workers)
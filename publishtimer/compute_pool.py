@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 00:41:05 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import os
+import threading
+import multiprocessing
+from publishtimer import metrics
+
+
+COMPUTE_WORKERS = int(os.environ.get('COMPUTE_WORKERS', 0))
+
+POOL = None
+POOL_LOCK = threading.Lock()
+
+
+def start(workers=None):
+    """Starts the singleton pool of worker processes computing schedules, unless started already or workers is 0
+
+        To be called on startup before threads are started, as worker processes are forked from the caller
+        :param workers: [int] :default: environment variable COMPUTE_WORKERS or 0
+        :Returns: the multiprocessing.Pool, None if workers is 0
+    """
+    global POOL
+    workers = COMPUTE_WORKERS if workers is None else workers
+    with POOL_LOCK:
+        if POOL is None and workers:
+            POOL = multiprocessing.Pool(workers)
+            metrics.REGISTRY.set_gauge('compute_pool.workers', workers)
+        return POOL
+
+
+def stop():
+    """Waits for computations in process and stops the worker processes of the pool if started
+    """
+    global POOL
+    with POOL_LOCK:
+        pool, POOL = POOL, None
+    if pool is not None:
+        pool.close()
+        pool.join()
+        metrics.REGISTRY.set_gauge('compute_pool.workers', 0)
+
+
+def started():
+    """Returns True if the pool is started
+    """
+    return POOL is not None
+
+
+def apply(function, args):
+    """Calls function(*args) in a worker process of the pool if started, else in the calling thread, and returns its result
+
+        The calling thread waits without holding the GIL, so that as many threads as worker processes keep all of them busy.
+        function must be defined at module level and args picklable
+    """
+    pool = POOL
+    if pool is None:
+        return function(*args)
+    metrics.REGISTRY.increment('compute_pool.tasks')
+    return pool.apply(function, args)
+
+
+def map(function, iterable):
+    """Returns [function(item) for item in iterable], computed in the worker processes of the pool if started, else in the calling thread
+    """
+    pool = POOL
+    if pool is None:
+        return [function(item) for item in iterable]
+    items = list(iterable)
+    metrics.REGISTRY.increment('compute_pool.tasks', len(items))
+    return pool.map(function, items)
@@ -7,19 +7,33 @@ Created on Mon Mar 28 13:06:02 2016
 
 import os
 import json
-import time
-import datetime
-import requests
-import pandas as pd
-import boto.sqs
-from dateutil import parser
+import argparse
+import itertools
+from multiprocessing.pool import ThreadPool
+from publishtimer import helpers
+from publishtimer import http_util
+from publishtimer import metrics
+from publishtimer import pipeline
+from publishtimer import compute_pool
+from publishtimer import aggregates
+from publishtimer import schedule_cache
+from publishtimer import tweet_columns
 from publishtimer import twitter_data as td
 from publishtimer import elasticsearch_util as es
 from elasticsearch.exceptions import ConnectionError
 
 
+np = helpers.LazyModule('numpy')
+pd = helpers.LazyModule('pandas')
+
+ES_MAX_TWEETS = int(os.environ.get('ES_MAX_TWEETS', 0))
+ES_PAGE_SIZE = int(os.environ.get('ES_PAGE_SIZE', 1000))
+ES_MAX_RESULT_WINDOW = 10000
+TIMELINE_REFRESH_COUNT = int(os.environ.get('TIMELINE_REFRESH_COUNT', 3200))
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 100))
+BATCH_WRITE_CONCURRENCY = int(os.environ.get('BATCH_WRITE_CONCURRENCY', 8))
 DAY_MAP = {0:'mon', 1:'tue', 2:'wed', 3:'thu', 4:'fri', 5:'sat', 6:'sun'}
-DEFAULT_SCHEDULE = [    '18:00', '10:45', '17:15', '11:40', '22:10', 
+DEFAULT_SCHEDULE = (    '18:00', '10:45', '17:15', '11:40', '22:10', 
                         '09:50', '20:20', '08:55', '21:15', '19:25',
                         '12:00', '23:05', '07:05', '16:10', '13:35', 
                         '06:50', '14:55', '05:20', '15:30', '00:30',
@@ -28,130 +42,731 @@ DEFAULT_SCHEDULE = [    '18:00', '10:45', '17:15', '11:40', '22:10',
                         '18:35', '02:15', '15:05', '04:45', '13:15', 
                         '03:25', '16:40', '14:20', '23:35', '12:25',
                         '19:45', '21:30', '08:15', '20:55', '09:10', 
-                        '22:45', '11:50', '17:25', '10:00', '18:55']
+                        '22:45', '11:50', '17:25', '10:00', '18:55')
+SCHEDULE_LENGTH = 50
+DEFAULT_SCHEDULE_TABLE = tuple((DAY_MAP[d], DEFAULT_SCHEDULE) for d in range(7))
 
     
 def get_data_on_fly(authUid, save=True, **kwargs):
     """Get twitter timeline for given user on fly (w/o ES)
         Raises ValueError if credentials for given authUid not available with Crowdfire
+
+        :param block: [bool] wait for Twitter rate limit capacity; when False, raises rate_limit.RateLimitExceeded instead :default: True
+
+        Tweets come normalized by request_timeline, with created_at already parsed
     """
     ret = {'twitter_id': authUid, 'data': []}
-    tw = td.TwitterUser()
+    tw = td.TwitterUser(block=kwargs.pop('block', True))
     tweets = tw.request_timeline(authUid, save_to_es=save, **kwargs)
-    ret['data'] = [{'created_at':   str(datetime.datetime.strptime(\
-                                            t.get('created_at', ''), 
-                                            "%a %b %d %H:%M:%S +0000 %Y"))
-                                        if isinstance(t.get('created_at', ''), 
-                                                      str)
-                                        else str(t.get('created_at', None)),
+    ret['data'] = [{'created_at':   str(t.get('created_at', None)),
                         'favorite_count': t['favorite_count'], \
                         'retweet_count': t['retweet_count'], \
                         'id': t['id']   } for t in tweets]
     return ret
 
 
-def get_data_from_es(authUid):
-    """Get twitter timeline for given user from ES
-    
-        1. Run elasticsearch query to fetch tweets of given authUid with size 1:
-        2. Get the count from its result to COUNT
-        3. Run same query with size = COUNT
-        4. Return data from hits field of the resultset with sanity_check
+def get_columns_on_fly(authUid, save=True, **kwargs):
+    """Get twitter timeline for given user on fly (w/o ES) as TweetColumns, appending each page as it arrives
+        Raises ValueError if credentials for given authUid not available with Crowdfire
+
+        The next page is requested while this one is saved to ES and appended, and only these pages are held besides the columns
+        Params same as of get_data_on_fly
+    """
+    columns = tweet_columns.TweetColumns()
+    tw = td.TwitterUser(block=kwargs.pop('block', True))
+    for page in tw.iter_timeline(authUid, save_to_es=save, **kwargs):
+        columns.extend_data(page)
+    return {'twitter_id': authUid, 'data': columns}
+
+
+def tweet_search_body(authUid, size=1, before_id=None, after_id=None):
+    """Returns the body of elasticsearch query fetching tweets of given authUid, most recent first
 
         Query: { "filter" : { "term" : { "user.id" : <authUid> } },
                         	"fields" : [ 'id', 
                                          'created_at', 
                                          'retweet_count', 
                                          'favorite_count'],
+                            "sort" : [ { "id" : "desc" } ],
                         	"size" : <SIZE> }
 
+        :param before_id: [long] when given, only tweets with id lower than it are matched
+            :default: None
+        :param after_id: [long] when given, only tweets with id higher than it are matched
+            :default: None
     """
-    search_body =   { 
-                        "filter" :
-                            { 
-                                "term" :
-                                    {
-                                        "user.id" : authUid
-                                    }
-                            },
-                        "fields" : 
-                            [
-                                'id', 
-                                'created_at', 
-                                'retweet_count',
-                                'favorite_count'
-                            ],
-                        "size" : 1
+    search_filter = {
+                        "term" :
+                            {
+                                "user.id" : authUid
+                            }
                     }
-    res = es.get_es_client().search(index='_all', \
-                                    doc_type='tweet', \
-                                    body=search_body )
-    cnt = res['hits']['total']
-    if not cnt:
-        return {'twitter_id': authUid, 'data': []}
-    else:
-        data = []
-        search_body["size"] = cnt
-        res = es.get_es_client().search(index='_all', \
-                                        doc_type='tweet', \
-                                        body=search_body )
-        for i in range(len(res['hits']['hits'])):
-            for k in res['hits']['hits'][i]['fields'].keys():
-                res['hits']['hits'][i]['fields'][k] \
-                = res['hits']['hits'][i]['fields'][k][0]
-            data.append(res['hits']['hits'][i]['fields'])
-        return {'twitter_id': authUid, 'data': data}
-            
+    id_range = {}
+    if before_id is not None:
+        id_range["lt"] = before_id
+    if after_id is not None:
+        id_range["gt"] = after_id
+    if id_range:
+        search_filter = {
+                            "bool" :
+                                {
+                                    "must" : 
+                                        [
+                                            search_filter,
+                                            {
+                                                "range" :
+                                                    {
+                                                        "id" : id_range
+                                                    }
+                                            }
+                                        ]
+                                }
+                        }
+    return  { 
+                "filter" : search_filter,
+                "fields" : 
+                    [
+                        'id', 
+                        'created_at', 
+                        'retweet_count',
+                        'favorite_count'
+                    ],
+                "sort" : 
+                    [
+                        {
+                            "id" : "desc"
+                        }
+                    ],
+                "size" : size
+            }
+
+
+def hits_to_data(hits):
+    """Returns list of data_points from hits of an elasticsearch response by unwrapping their single-valued fields
+    """
+    data = []
+    for hit in hits:
+        for k in hit['fields'].keys():
+            hit['fields'][k] = hit['fields'][k][0]
+        data.append(hit['fields'])
+    return data
+
+
+def iter_pages_from_es(authUid, max_tweets=None, page_size=None, after_id=None, 
+                       before_id=None):
+    """Yields pages of data_points of tweets of given user from ES, most recent first, as they arrive
+    
+        1. Run elasticsearch query for the most recent page_size tweets of given authUid, over the tweet indices only, routed to the user's shard
+        2. Yield list of data_points from hits field of the resultset
+        3. Stop if the page holds all tweets matched by the query or max_tweets data_points are yielded
+        4. Run same query restricted to tweets older than the last one yielded and repeat from 2
+
+        Tweet ids grow with time, so paging on id needs neither a count query nor a scroll context on the server,
+        and no response is larger than page_size.
+
+        Query: tweet_search_body(authUid, size=<PAGE_SIZE>, before_id=<ID_OF_LAST_TWEET_YIELDED>)
+
+        :param max_tweets: [int] number of most recent tweets to yield at most
+            :default: environment variable ES_MAX_TWEETS if set, else all tweets
+        :param page_size: [int] number of tweets fetched per request
+            :default: environment variable ES_PAGE_SIZE or 1000
+        :param after_id: [long] when given, only tweets newer than it are yielded
+            :default: None
+        :param before_id: [long] when given, only tweets older than it are yielded
+            :default: None
+    """
+    max_tweets = max_tweets or ES_MAX_TWEETS
+    page_size = page_size or ES_PAGE_SIZE
+    yielded = 0
+    while True:
+        size = min(page_size, max_tweets - yielded) if max_tweets \
+                else page_size
+        res = es.get_es_client().search(body=tweet_search_body(authUid, 
+                                                               size, 
+                                                               before_id, 
+                                                               after_id), 
+                                        **es.get_tweet_search_params(authUid))
+        hits = res['hits']['hits']
+        if hits:
+            before_id = hits[-1]['sort'][0]
+            yield hits_to_data(hits)
+        yielded += len(hits)
+        if len(hits) < size or len(hits) >= res['hits']['total'] or \
+                yielded == max_tweets:
+            return
+
+
+def iter_data_from_es(authUid, max_tweets=None, page_size=None, after_id=None):
+    """Yields data_points of tweets of given user from ES one by one, most recent first, from pages of iter_pages_from_es
+
+        Params same as of iter_pages_from_es
+    """
+    for page in iter_pages_from_es(authUid, max_tweets, page_size, after_id):
+        for data_point in page:
+            yield data_point
+
+
+def get_data_from_es(authUid, max_tweets=None):
+    """Get twitter timeline for given user from ES
+    
+        1. Collect data_points yielded by iter_data_from_es(authUid, max_tweets)
+        2. Return them in response
+
+        :param max_tweets: [int] number of most recent tweets to get at most
+            :default: environment variable ES_MAX_TWEETS if set, else all tweets
+    """
+    return {'twitter_id': authUid, 
+            'data': list(iter_data_from_es(authUid, max_tweets))}
+
+
+def get_columns_from_es(authUid, max_tweets=None, after_id=None):
+    """Get twitter timeline for given user from ES as TweetColumns, the compact form used for scheduling
+    
+        1. Append each page yielded by iter_pages_from_es(authUid, max_tweets, after_id=after_id) to TweetColumns, dropping its data_points
+        2. Return them in response: {'twitter_id': authUid, 'data': <TweetColumns>}
+
+        Params same as of iter_pages_from_es
+    """
+    columns = tweet_columns.TweetColumns()
+    for page in iter_pages_from_es(authUid, max_tweets, after_id=after_id):
+        columns.extend_data(page)
+    return {'twitter_id': authUid, 'data': columns}
+
+
+def get_data_from_es_batch(authUids):
+    """Get twitter timelines for given users from ES with a single multi-search request
+
+        1. Create a header and query body pair with size = ES_MAX_TWEETS (at most ES_MAX_RESULT_WINDOW) for each authUid
+        2. Run all queries in one elasticsearch msearch request
+        3. For an authUid with more tweets than fit in its response, append the older ones paged by iter_pages_from_es from its last tweet,
+            so that the batch gets as many tweets as get_columns_from_es
+        4. Return one entry per authUid in given order: data_dict as from get_columns_from_es, or the exception describing the error ES responded with for that query
+
+    """
+    size = min(ES_MAX_TWEETS or ES_MAX_RESULT_WINDOW, ES_MAX_RESULT_WINDOW)
+    body = []
+    for authUid in authUids:
+        params = es.get_tweet_search_params(authUid)
+        params['type'] = params.pop('doc_type')
+        body.append(params)
+        body.append(tweet_search_body(authUid, size=size))
+    res = es.get_es_client().msearch(body=body)
+    ret = []
+    for authUid, response in zip(authUids, res['responses']):
+        if 'error' in response:
+            ret.append(RuntimeError("Elasticsearch query failed for authUid " + 
+                                    str(authUid) + ": " + 
+                                    str(response['error'])))
+        else:
+            hits = response['hits']['hits']
+            columns = tweet_columns.TweetColumns.from_data(hits_to_data(hits))
+            if len(hits) == size and response['hits']['total'] > size and \
+                    ES_MAX_TWEETS != size:
+                metrics.REGISTRY.increment('es.batch_paged')
+                for page in iter_pages_from_es(authUid, 
+                                               ES_MAX_TWEETS and 
+                                                ES_MAX_TWEETS - size, 
+                                               before_id=hits[-1]['sort'][0]):
+                    columns.extend_data(page)
+            ret.append({'twitter_id': authUid, 'data': columns})
+    return ret
+
+
+def get_es_watermark(authUid):
+    """Returns watermark of tweets of given user in ES, to tell whether they changed: {'newest_id', 'newest_created_at', 'count'}, None if ES has none
+
+        Query: tweet_search_body(authUid, size=1)
+    """
+    res = es.get_es_client().search(body=tweet_search_body(authUid, 1), 
+                                    **es.get_tweet_search_params(authUid))
+    if not res['hits']['hits']:
+        return None
+    newest = hits_to_data(res['hits']['hits'])[0]
+    return {'newest_id': newest['id'], 
+            'newest_created_at': newest['created_at'], 
+            'count': res['hits']['total']}
+
+
+def parse_authUid(authUid):
+    """Check and correct if required the format of given authUid: '<user_id>-tw' is converted to long user_id
+    """
+    if isinstance(authUid, str):
+        authUid = authUid.decode('utf-8')
+    if isinstance(authUid, unicode) and authUid.endswith(u'-tw'):
+        authUid = long(authUid[:-3])
+    return authUid
+
+
+def make_data_frame(data_dict):
+    """Transform data_dict from get_columns_from_es/get_columns_on_fly/get_data_from_es/get_data_on_fly to a form consumable by *compute_times*
+
+        1. If data of data_dict is a list of data_points, fill TweetColumns from it, parsing created_at of all of them at once
+           (see tweet_columns.parse_times); data_points without a valid created_at are dropped
+        2. Create pandas dataframe from the typed arrays of the TweetColumns, with engagement = retweet_count + favorite_count * 100, and return in response
+
+        data_dict is left unchanged
+    """
+    return {'twitter_id': data_dict['twitter_id'], \
+            'data_frame': tweet_columns.as_columns(data_dict['data'])
+                            .to_data_frame()}
+
+
+def get_newer_data(authUid, since_id, save=True, **kwargs):
+    """Get tweets of given user newer than since_id from Twitter API, most recent first: the incremental part of get_data_on_fly
+
+        Pages backward from the newest tweet with max_id while keeping since_id, so only tweets not yet stored are transferred
+        :param count: [int] number of newer tweets to fetch at most
+            :default: environment variable TIMELINE_REFRESH_COUNT or 3200 (all that user_timeline API serves)
+        Raises ValueError if credentials for given authUid not available with Crowdfire
+    """
+    kwargs['since_id'] = since_id
+    kwargs.setdefault('count', TIMELINE_REFRESH_COUNT)
+    return get_data_on_fly(authUid, save=save, **kwargs)['data']
+
+
+def merge_data(newer, older, max_tweets=None):
+    """Merge data_points fetched from Twitter API into data_points from ES, both most recent first
+
+        Drops repeated tweet ids and keeps the max_tweets most recent data_points if max_tweets given
+    """
+    seen = set(d['id'] for d in older)
+    fresh = []
+    for data_point in sorted(newer, key=lambda d: d['id'], reverse=True):
+        if data_point['id'] not in seen:
+            seen.add(data_point['id'])
+            fresh.append(data_point)
+    merged = fresh + older
+    return merged[:max_tweets] if max_tweets else merged
+
 
 def prepare_data(authUid, 
                  use_es=True, 
                  use_tw=True, 
                  save_on_fly=True, 
+                 max_tweets=None, 
+                 refresh=False, 
+                 newer_data=None, 
                  **kwargs):
     """Retreive twitter data from ES or Twitter-API and transform to a form consumable by *compute_times*
 
+        1. data_dict = prepare_columns(authUid, use_es, use_tw, save_on_fly, max_tweets, refresh, newer_data, **kwargs)
+        2. Transform data_dict into pandas dataframe with make_data_frame and return in response
+
+        Params same as of prepare_columns
+    """
+    return make_data_frame(prepare_columns(authUid, use_es, use_tw, 
+                                           save_on_fly, max_tweets, refresh, 
+                                           newer_data, **kwargs))
+
+
+def prepare_columns(authUid, 
+                    use_es=True, 
+                    use_tw=True, 
+                    save_on_fly=True, 
+                    max_tweets=None, 
+                    refresh=False, 
+                    newer_data=None, 
+                    **kwargs):
+    """Retreive twitter data from ES or Twitter-API as data_dict of TweetColumns, compact to hold and to ship to compute_pool
+
         1. Check and correct if required the format of given authUid
         2. data_dict = empty response
         3. If use_es True:
-            3.1. data_dict = get_data_from_es(authUid)
+            3.1. data_dict = get_columns_from_es(authUid, max_tweets)
         4. If data_dict empty and use_tw True:
-            4.1. data_dict = get_data_on_fly(authUid, save=save_on_fly, **kwargs)
-        5. If data_dict not empty:
-            5.1. For each data_point:
-                5.1.1. Parse created_at field from data_dict into day, hour and minute and add to data_point entry in the data_dict
-        6. Create pandas dataframe from data_dict and return in response
+            4.1. data_dict = get_columns_on_fly(authUid, save=save_on_fly, **kwargs)
+        5. Else if refresh and use_tw True:
+            5.1. Fetch only tweets newer than the newest one in data_dict with get_newer_data, unless already given as newer_data
+            5.2. Merge them into data_dict
+        6. Return data_dict
+
+        :param refresh: [bool] incremental refresh of the data in ES from Twitter API :default: False
+        :param newer_data: [TweetColumns/list] data_points newer than the data in ES, already fetched with get_newer_data :default: None
     
     """
-    if isinstance(authUid, str):
-        authUid = authUid.decode('utf-8')
-    if isinstance(authUid, unicode) and authUid.endswith(u'-tw'):
-        authUid = long(authUid[:-3])
+    authUid = parse_authUid(authUid)
     data_dict = {'twitter_id': authUid, 'data': []}
     if use_es:
         try:
-            data_dict = get_data_from_es(authUid)
+            data_dict = get_columns_from_es(authUid, max_tweets)
         except ConnectionError as ce:
             print "Elasticsearch unreachable at ", os.environ['ES_HOST']
             print "ConnectionError: Info from ES:", ce.info
             print "Will try hitting Twitter API if permitted...\n"
     if use_tw and not data_dict['data']:
-        data_dict = get_data_on_fly(authUid, save=save_on_fly, **kwargs)
-    if data_dict['data']:
-        for i in range(len(data_dict['data'])):
-            d = parser.parse(data_dict['data'][i].pop('created_at'))
-            data_dict['data'][i]['day'] = d.weekday()
-            data_dict['data'][i]['hour'] = d.hour
-            data_dict['data'][i]['minute'] = d.minute
-            data_dict['data'][i]['engagement'] \
-            = data_dict['data'][i].get('retweet_count', 0) \
-            + data_dict['data'][i].get('favorite_count', 0) * 100
-    return {'twitter_id': data_dict['twitter_id'], \
-            'data_frame': pd.DataFrame(data_dict['data'])}
+        data_dict = get_columns_on_fly(authUid, save=save_on_fly, **kwargs)
+    elif use_tw and refresh:
+        if newer_data is None:
+            newer_data = get_newer_data(authUid, 
+                                        data_dict['data'].newest_id(), 
+                                        save_on_fly, 
+                                        **kwargs)
+        data_dict['data'] = data_dict['data'].merge(
+                                tweet_columns.as_columns(newer_data), 
+                                max_tweets)
+    return data_dict
+
+
+def prepare_schedule(authUid, 
+                     use_es=True, 
+                     use_tw=True, 
+                     save_on_fly=True, 
+                     max_tweets=None, 
+                     use_cache=True, 
+                     refresh=False, 
+                     use_aggregates=None, 
+                     verify=None, 
+                     **kwargs):
+    """Compute schedule for given authUid, reusing the one cached from unchanged data in ES, else the user's aggregate
+
+        1. Fetch everything the schedule is computed from with prepare_inputs
+        2. Compute the schedule from it with compute_schedule
+        3. Return the schedule
+
+        Latency of preparing data (with the watermark check) and of computing is recorded in metrics.REGISTRY as stage.prepare and stage.compute
+        Params same as of prepare_inputs
+    """
+    return compute_schedule(prepare_inputs(authUid, use_es, use_tw, 
+                                           save_on_fly, max_tweets, 
+                                           use_cache, refresh, 
+                                           use_aggregates, verify, **kwargs))
+
+
+def prepare_inputs(authUid, 
+                   use_es=True, 
+                   use_tw=True, 
+                   save_on_fly=True, 
+                   max_tweets=None, 
+                   use_cache=True, 
+                   refresh=False, 
+                   use_aggregates=None, 
+                   verify=None, 
+                   **kwargs):
+    """Fetch stage of prepare_schedule: everything the schedule of given authUid is computed from, without computing it
+
+        1. Check and correct if required the format of given authUid
+        2. If use_es True and use_cache or use_aggregates True:
+            2.1. watermark = get_es_watermark(authUid)
+            2.2. If refresh and use_tw True, fetch tweets newer than the watermark with get_newer_data
+            2.3. If use_cache, no newer tweets and a schedule computed from data with the same watermark is cached, return it as inputs['schedule']
+        3. If use_aggregates, ES has tweets and no max_tweets applies, fetch only tweets not yet folded into the user's aggregate with get_aggregate_data,
+           rebuilding it if ES gained older tweets
+        4. Else prepare_columns (merging the newer tweets if any)
+
+        Latency is recorded in metrics.REGISTRY as stage.prepare
+        :Returns: [dict] inputs of compute_schedule:
+            {'authUid', 'max_tweets', 'watermark', 'newer_data', 'use_cache', 'save_on_fly', 'verify', 'incremental',
+             'schedule': <cached schedule, else None>,
+             'aggregate', 'data_dict': <when incremental>, 'data': <data_dict of TweetColumns for compute_columns, otherwise>}
+        :param use_cache: [bool] :default: True
+        :param use_aggregates: [bool] :default: environment variable AGGREGATES_ENABLED or False
+        :param verify: [bool] also recompute from all tweets and check the aggregate against it :default: environment variable AGGREGATES_VERIFY or False
+        Other params same as of prepare_columns
+    """
+    authUid = parse_authUid(authUid)
+    max_tweets = max_tweets or ES_MAX_TWEETS
+    if use_aggregates is None:
+        use_aggregates = aggregates.AGGREGATES_ENABLED
+    if verify is None:
+        verify = aggregates.AGGREGATES_VERIFY
+    inputs = {'authUid': authUid, 
+              'max_tweets': max_tweets, 
+              'watermark': None, 
+              'newer_data': None, 
+              'use_cache': use_cache, 
+              'save_on_fly': save_on_fly, 
+              'verify': verify, 
+              'incremental': False, 
+              'schedule': None}
+    with metrics.REGISTRY.timed('stage.prepare'):
+        if use_es and (use_cache or use_aggregates):
+            try:
+                inputs['watermark'] = get_es_watermark(authUid)
+            except ConnectionError as ce:
+                print "Elasticsearch unreachable at ", os.environ['ES_HOST']
+                print "ConnectionError: Info from ES:", ce.info
+            if inputs['watermark'] and refresh and use_tw:
+                inputs['newer_data'] = tweet_columns.TweetColumns.from_data(
+                                get_newer_data(authUid, 
+                                               inputs['watermark']['newest_id'], 
+                                               save_on_fly, 
+                                               **kwargs))
+            if use_cache and inputs['watermark'] and not inputs['newer_data']:
+                inputs['schedule'] = schedule_cache.get_schedule(
+                                        authUid, 
+                                        max_tweets, 
+                                        inputs['watermark'])
+                if inputs['schedule'] is not None:
+                    return inputs
+        inputs['incremental'] = bool(use_aggregates and inputs['watermark'] 
+                                     and not max_tweets)
+        if inputs['incremental']:
+            inputs['aggregate'], inputs['data_dict'] = get_aggregate_data(
+                                                        authUid, 
+                                                        inputs['newer_data'], 
+                                                        inputs['watermark'], 
+                                                        save_on_fly)
+        else:
+            inputs['data'] = prepare_columns(authUid, use_es, use_tw, 
+                                             save_on_fly, max_tweets, refresh, 
+                                             inputs['newer_data'], **kwargs)
+    return inputs
+
+
+def compute_schedule(inputs):
+    """Compute stage of prepare_schedule: the schedule from inputs given by prepare_inputs
+
+        1. If a cached schedule was found, return it
+        2. If incremental, fold the new tweets into the aggregate and derive the schedule with compute_times_from_aggregate,
+           verifying it with verify_aggregate if verify, and store the aggregate
+        3. Else compute_columns, in a worker process of compute_pool if started
+        4. If use_cache, watermark available and no newer tweets fetched, cache the schedule with it
+
+        A schedule computed with newer tweets is not cached: their watermark is known only once ES indexes them,
+        so the next call recomputes once and caches from there.
+        Latency is recorded in metrics.REGISTRY as stage.compute
+    """
+    if inputs['schedule'] is not None:
+        return inputs['schedule']
+    with metrics.REGISTRY.timed('stage.compute'):
+        if inputs['incremental']:
+            aggregate = inputs['aggregate']
+            schedule = compute_times_from_aggregate(aggregate, 
+                                                    inputs['data_dict'])
+            if inputs['verify']:
+                aggregate, schedule = verify_aggregate(aggregate, schedule, 
+                                                       inputs['newer_data'], 
+                                                       inputs['save_on_fly'])
+            aggregates.put_aggregate(aggregate)
+        else:
+            schedule = compute_columns(inputs['data'])
+    if inputs['use_cache'] and inputs['watermark'] and \
+            not inputs['newer_data']:
+        schedule_cache.put_schedule(inputs['authUid'], inputs['max_tweets'], 
+                                    inputs['watermark'], schedule)
+    return schedule
+
+
+def get_aggregate_data(authUid, newer_data=None, watermark=None, saved=False):
+    """Get the stored aggregate of given user and the data_points not folded into it yet
+
+        1. Load aggregate of authUid, or start an empty one
+        2. Fetch from ES only tweets newer than the newest one folded into it with get_columns_from_es(authUid, after_id=<newest_id>)
+        3. If the count of tweets in ES of watermark grew by more than the tweets just fetched since the aggregate last synced with ES,
+           tweets older than its newest one were added to ES (e.g. backfilled): start an empty aggregate and fetch all tweets from ES,
+           counting aggregates.rebuilds in metrics.REGISTRY
+        4. Record the number of tweets in ES folded into the aggregate as its es_count
+        5. Merge newer_data fetched from Twitter API into them, adding those not in ES yet to es_count if saved
+        :Returns: (aggregate, data_dict)
+        :param saved: [bool] newer_data was saved to ES, so that its tweets are found there from the next call on :default: False
+    """
+    aggregate = aggregates.get_aggregate(authUid) or \
+                    aggregates.new_aggregate(authUid)
+    es_count = aggregate.get('es_count', 0)
+    data_dict = get_columns_from_es(authUid, 
+                                    after_id=aggregate['newest_id'] or None)
+    if watermark and aggregate['newest_id'] and \
+            watermark['count'] > es_count + len(data_dict['data']):
+        metrics.REGISTRY.increment('aggregates.rebuilds')
+        aggregate = aggregates.new_aggregate(authUid)
+        es_count = 0
+        data_dict = get_columns_from_es(authUid)
+    aggregate['es_count'] = es_count + len(data_dict['data'])
+    if newer_data:
+        merged = data_dict['data'].merge(tweet_columns.as_columns(newer_data))
+        if saved:
+            aggregate['es_count'] += len(merged) - len(data_dict['data'])
+        data_dict['data'] = merged
+    return aggregate, data_dict
+
+
+def fold_data_frame(aggregate, df):
+    """Fold tweets of data_frame from make_data_frame into aggregate
+    """
+    if not df.empty:
+        aggregates.fold(aggregate, df['id'].values, df['day'].values, 
+                        df['hour'].values, df['minute'].values, 
+                        df['engagement'].values)
+
+
+def compute_times_from_aggregate(aggregate, data_dict):
+    """Fold data_points of data_dict into aggregate in O(number of data_points) and derive the schedule from it as compute_times would from all tweets folded
+    """
+    fold_data_frame(aggregate, make_data_frame(data_dict)['data_frame'])
+    return aggregates.derive_schedule(aggregate)
+
+
+def verify_aggregate(aggregate, schedule, newer_data=None, saved=False):
+    """Verification mode of aggregates: check schedule derived from aggregate against compute_times from all tweets of its user
+
+        1. Get all tweets of the user from ES and merge newer_data into them
+        2. Compute schedule from them with compute_times
+        3. If it differs, count aggregates.mismatches in metrics.REGISTRY and rebuild the aggregate from these tweets, else count aggregates.verified
+        :Returns: (aggregate, schedule) to be used: given ones if verified, rebuilt aggregate and recomputed schedule otherwise
+        :param saved: [bool] newer_data was saved to ES, as in get_aggregate_data :default: False
+    """
+    authUid = aggregate['twitter_id']
+    data_dict = get_columns_from_es(authUid)
+    es_count = len(data_dict['data'])
+    if newer_data:
+        data_dict['data'] = data_dict['data'].merge(
+                                tweet_columns.as_columns(newer_data))
+        if saved:
+            es_count = len(data_dict['data'])
+    data = make_data_frame(data_dict)
+    expected = compute_times(data)
+    if expected == schedule:
+        metrics.REGISTRY.increment('aggregates.verified')
+        return aggregate, schedule
+    metrics.REGISTRY.increment('aggregates.mismatches')
+    print "Aggregate of authUid", authUid, "diverged from its tweets,", \
+            "rebuilding it from", len(data['data_frame']), "tweets"
+    rebuilt = aggregates.new_aggregate(authUid)
+    rebuilt['es_count'] = es_count
+    fold_data_frame(rebuilt, data['data_frame'])
+    return rebuilt, expected
+
+
+def rank_daily_times_batch(group, n_groups, day, hour, minute, engagement, 
+                           limit=50):
+    """Computes the daily schedules of many users from column arrays of their concatenated tweet data in a single pass
+
+        1. Normalize each engagement score value X as: X = X/(Xmax - Xmin), with Xmax and Xmin taken over the group (user) of X
+        2. Drop tweets whose normalized score is undefined (all-zero engagement) or whose day is out of range
+        3. Sort all tweets at once on (group, day, normalized engagement descending); the sort is stable so ties keep their order of appearance as with rank(method='first')
+        4. Rank each tweet within its day by its offset from the start of its (group, day) segment in the sorted order
+        5. Keep the tweets ranked 1 through limit and format their times segment by segment
+
+        :Returns: [list] value for the completeSchedule field of a schedule for each of group ids 0 through n_groups - 1
+        :param group: [array] group id in range(n_groups) of each tweet
+    """
+    schedules = [[] for _ in range(n_groups)]
+    group = np.asarray(group, dtype=int)
+    engagement = np.asarray(engagement, dtype=float)
+    if not len(engagement):
+        return schedules
+    low = np.empty(n_groups)
+    low.fill(np.inf)
+    high = np.empty(n_groups)
+    high.fill(-np.inf)
+    np.fmin.at(low, group, engagement)
+    np.fmax.at(high, group, engagement)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = engagement / (high - low)[group]
+    day = np.asarray(day, dtype=float)
+    valid = ~np.isnan(score) & (day >= 0) & (day < 7)
+    score = score[valid]
+    group = group[valid]
+    day = day[valid].astype(int)
+    hour = np.asarray(hour, dtype=float)[valid].astype(int)
+    minute = np.asarray(minute, dtype=float)[valid].astype(int)
+    if not len(day):
+        return schedules
+    order = np.lexsort((-score, day, group))
+    segment = group[order] * 7 + day[order]
+    starts = np.flatnonzero(np.r_[True, segment[1:] != segment[:-1]])
+    rank = np.arange(len(segment)) - \
+        np.repeat(starts, np.diff(np.r_[starts, len(segment)]))
+    keep = rank < limit
+    order = order[keep]
+    segment = segment[keep]
+    times = ['{}:{}'.format(h, m) for h, m in zip(hour[order].tolist(), 
+                                                  minute[order].tolist())]
+    bounds = np.r_[np.flatnonzero(np.r_[True, segment[1:] != segment[:-1]]), 
+                   len(segment)].tolist()
+    for i in range(len(bounds) - 1):
+        g, d = divmod(int(segment[bounds[i]]), 7)
+        schedules[g].append({'day': DAY_MAP[d], 
+                             'times': times[bounds[i]:bounds[i + 1]]})
+    return schedules
+
+
+def rank_daily_times(day, hour, minute, engagement, limit=50):
+    """Computes the daily schedule of one user from column arrays of tweet data in a single pass
+
+        :Returns: [list] value for the completeSchedule field of a schedule
+        Same as rank_daily_times_batch with all tweets in one group
+    """
+    return rank_daily_times_batch(np.zeros(len(engagement), dtype=int), 1, 
+                                  day, hour, minute, engagement, limit)[0]
 
 
 def compute_times(data_dict):
     """Compute the list of best times from given data
     
+            1. If no data is available to compute any schedule give empty response
+            2. Rank the times of each day on normalized engagement score with rank_daily_times in one pass over the data_frame columns
+            3. Return Response
+
+    """
+    out_dict = {'authUid': unicode(data_dict['twitter_id']) + u'-tw', 
+                'completeSchedule': [],
+                'source': 'internal'}
+    df = data_dict['data_frame']
+    if df.empty:
+        """If no data is available to compute any schedule
+        """
+        return out_dict
+    out_dict['completeSchedule'] = rank_daily_times(df['day'].values, 
+                                                    df['hour'].values, 
+                                                    df['minute'].values, 
+                                                    df['engagement'].values)
+    return out_dict
+
+
+def compute_times_batch(data_dicts):
+    """Compute the lists of best times for many users from their data in one vectorized pass
+
+        1. Concatenate the columns of all non-empty data_frames, tagging each row with the position of its data_dict
+        2. Rank the times of all users at once with rank_daily_times_batch
+        3. Return one response as of compute_times per data_dict in given order
+
+    """
+    frames = [d['data_frame'] for d in data_dicts]
+    sizes = [0 if df.empty else len(df) for df in frames]
+    filled = [df for df in frames if not df.empty]
+    column = lambda name: np.concatenate([df[name].values for df in filled]) \
+                            if filled else np.empty(0)
+    schedules = rank_daily_times_batch(
+                    np.repeat(np.arange(len(frames)), sizes), len(frames), 
+                    column('day'), column('hour'), column('minute'), 
+                    column('engagement'))
+    return [{'authUid': unicode(d['twitter_id']) + u'-tw', 
+             'completeSchedule': schedule, 
+             'source': 'internal'} 
+            for d, schedule in zip(data_dicts, schedules)]
+
+
+def compute_columns(data_dict):
+    """Compute the list of best times from given data_dict of TweetColumns (or list of data_points) as compute_times(make_data_frame(data_dict))
+
+        If compute_pool is started, the typed arrays of the TweetColumns - not a DataFrame - are shipped to one of its worker processes,
+        which computes the schedule with compute_packed, so that pandas work of many users runs on as many cores
+    """
+    columns = tweet_columns.as_columns(data_dict['data'])
+    if not compute_pool.started():
+        return compute_times(make_data_frame({'twitter_id': 
+                                                data_dict['twitter_id'], 
+                                              'data': columns}))
+    return compute_pool.apply(compute_packed, 
+                              ((data_dict['twitter_id'], columns.pack()),))
+
+
+def compute_packed(packed_data):
+    """Compute the list of best times from (twitter_id, <arrays packed with TweetColumns.pack>); run in worker processes of compute_pool
+    """
+    twitter_id, packed = packed_data
+    return compute_times(make_data_frame(
+                {'twitter_id': twitter_id, 
+                 'data': tweet_columns.TweetColumns.unpack(packed)}))
+
+
+def compute_times_by_slicing(data_dict):
+    """Compute the list of best times from given data by slicing the data_frame day-wise
+
+        Reference implementation of compute_times, kept to verify and benchmark the single-pass engine against.
+        Note that it normalizes the engagement column of given data_frame in place.
+    
             1. If no data is available to compute any schedule give empty response
             2. Normalize each engagement score value X as: X = X/(Xmax - Xmin)
             3. Slice the data_frame into 7 dataframes, 1 for each day of week
@@ -212,26 +827,33 @@ def compute_times(data_dict):
 def fill_incomplete_schedule(incomplete_schedule):
     """Fills in given incomplete schedule with values from default schedule
 
-        1. For each day of week:
-            1.1 Create entries for missing days using default schedule
-        2. For each day in schedule:
-            2.1 Create entries for missing times in existing day-entries using default schedule
+        1. For each day of week missing in schedule:
+            1.1 Create its entry with a new list of the times of DEFAULT_SCHEDULE_TABLE
+        2. For each day in schedule with less than SCHEDULE_LENGTH times:
+            2.1 Append the default times it misses, in order of DEFAULT_SCHEDULE, until it has SCHEDULE_LENGTH
         
+        Runs in time linear in the size of the schedule: days and times present are looked up in sets.
+        Default times are kept in tuples, so filled schedules never share lists with DEFAULT_SCHEDULE or with each other
     """
     schedule = incomplete_schedule
-    for day in DAY_MAP.values():
+    days = set(item['day'] for item in schedule['completeSchedule'])
+    for day, times in DEFAULT_SCHEDULE_TABLE:
         """Create entries for missing days from default schedule
         """
-        if day not in [item['day'] for item in schedule['completeSchedule']]:
-            schedule['completeSchedule'].append({   'day': day, 
-                                                    'times': DEFAULT_SCHEDULE})
+        if day not in days:
+            schedule['completeSchedule'].append({'day': day, 
+                                                 'times': list(times)})
     for item in schedule['completeSchedule']:
         """Create entries for missing times in existing day-entries from default schedule
         """
-        available_len = len(item['times'])
-        if available_len < 50:
-            item['times']+=[t for t in DEFAULT_SCHEDULE 
-                                if t not in item['times']][:50-available_len]
+        missing = SCHEDULE_LENGTH - len(item['times'])
+        if missing > 0:
+            present = set(item['times'])
+            item['times'] = item['times'] + \
+                                list(itertools.islice(
+                                        (t for t in DEFAULT_SCHEDULE 
+                                            if t not in present), 
+                                        missing))
     return schedule
 
 
@@ -240,52 +862,248 @@ def write_schedule(schedule):
     
         1. Fill in given schedule to complete it - fill_incomplete_schedule(schedule)
         2. Create target URL using environment variable SAVE_SCHEDULE_URL and authUid
-        3. Call save_schedule_api with PUT method
+        3. Call save_schedule_api with PUT method over the pooled session of http_util, retried on 5xx
         4. respond with union of completed_schedule and response from save_schedule_api
 
     """
     complete_schedule = fill_incomplete_schedule(schedule)
     request_url = os.environ.get('SAVE_SCHEDULE_URL', '') + \
                     complete_schedule['authUid']
-    response = requests.put(url= request_url, json=complete_schedule)
+    response = http_util.put(request_url, json=complete_schedule)
     return complete_schedule, response
 
 
-def work_once_with_sqs():
-    """Compute & write schedule for one authUid picked from SQS queue
+def work_once_with_sqs(queue=None):
+    """Compute & write schedule for each authUid of one batch of messages (up to 10) picked from SQS queue
 
+        Messages are processed concurrently by a QueueConsumer and deleted from the queue when their schedule is written
+        :param queue: boto SQS queue or queue_worker.LocalQueue :default: queue named by environment variable CALCULATION_QUEUE_NAME
     """
-    queue = boto.connect_sqs().get_queue(os.environ['CALCULATION_QUEUE_NAME'])
-    results = queue.get_messages()        
-    for msg in results:
-        write_schedule(
-            compute_times(
-                prepare_data(
-                    json.loads(
-                        msg.get_body())['authUid'])))
+    from publishtimer import queue_worker
+    consumer = queue_worker.QueueConsumer(queue or 
+                                          queue_worker.connect_queue())
+    consumer.poll_once()
+    consumer.stop()
+    return consumer.processed_count
 
 
 def work_once(**params):
     """Compute & write schedule for one authUid supplied in params
         
-        1. Prepare_data
-        2. Compute_schedule 
-        3. Write_schedule
-        4. Return response of write_schedule
+        1. Prepare_schedule: prepare_data & compute_times, unless cached for unchanged data
+        2. Write_schedule
+        3. Return response of write_schedule
+
+        Latency of each stage is recorded in metrics.REGISTRY as stage.prepare, stage.compute and stage.write
+    """
+    schedule = prepare_schedule(**params)
+    with metrics.REGISTRY.timed('stage.write'):
+        return write_schedule(schedule)
+
+
+def work_batch(authUids, 
+               use_es=True, 
+               use_tw=True, 
+               save_on_fly=True, 
+               chunk_size=None, 
+               max_workers=None, 
+               **kwargs):
+    """Compute & write schedules for many authUids, reporting status per authUid without failing the whole batch
+
+        Chunks of chunk_size authUids pass through a pipeline.Pipeline of 3 stages, so that one chunk is written while the next
+        is computed and the one after is fetched:
+            1. fetch: data of all authUids of the chunk with one ES multi-search, and on fly for authUids without data in ES - fetch_chunk
+            2. compute: schedules of the chunk in one vectorized pass, or in the worker processes of compute_pool if started - compute_chunk
+            3. write: schedules with concurrent calls to write_schedule - write_chunk
+        Return list of results in order of authUids. If a stage fails for a whole chunk, its authUids not yet reported fail with that error
+
+        Calls to Twitter and save_schedule API of all chunks in process share one pool of max_workers threads.
+        Throughput and occupancy of each stage are recorded in metrics.REGISTRY as gauges batch.<stage>.*
+        :Returns: [list] of dicts:
+            {'authUid': <authUid as received>,
+             'status': <'success'/'failure'>,
+             'schedule_prepared': <complete schedule, when computed>,
+             'status_code': <status code from save_schedule API, when called>,
+             'error': <reason of failure, on failure>}
+        :param chunk_size: [int] #authUids per ES multi-search
+            :default: environment variable BATCH_CHUNK_SIZE or 100
+        :param max_workers: [int] maximum concurrent calls to Twitter or save_schedule API
+            :default: environment variable BATCH_WRITE_CONCURRENCY or 8
+        :param use_es, use_tw, save_on_fly, **kwargs: same as of prepare_data
+    """
+    chunk_size = chunk_size or BATCH_CHUNK_SIZE
+    pool = ThreadPool(max_workers or BATCH_WRITE_CONCURRENCY)
+    results = [{'authUid': authUid, 'status': 'failure'} 
+                for authUid in authUids]
+
+    def collector(chunk):
+        def collect(result, error):
+            if error is not None:
+                for entry in chunk:
+                    entry.setdefault('error', type(error).__name__ + ': ' + 
+                                              str(error))
+        return collect
+
+    chunks = pipeline.Pipeline(
+                [('fetch', lambda chunk: fetch_chunk(chunk, pool, use_es, 
+                                                     use_tw, save_on_fly, 
+                                                     **kwargs), 1), 
+                 ('compute', compute_chunk, 1), 
+                 ('write', lambda chunk: write_chunk(chunk, pool), 1)], 
+                queue_size=1, 
+                name='batch')
+    try:
+        for start in range(0, len(results), chunk_size):
+            chunk = results[start:start + chunk_size]
+            chunks.submit(chunk, collector(chunk))
+    finally:
+        chunks.close()
+        pool.close()
+        pool.join()
+    return results
+
+
+def fetch_chunk(results, pool, use_es, use_tw, save_on_fly, **kwargs):
+    """Fetch stage of work_batch: data of the authUids of given results with one ES multi-search, and on fly over given pool of threads
+
+        Failures are recorded in the result of their authUid
+        :Returns: [list] of (result, data_dict of TweetColumns) for the results whose data is prepared
+    """
+    entries = []
+    for result in results:
+        try:
+            entries.append((result, {'twitter_id': 
+                                        parse_authUid(result['authUid']), 
+                                     'data': []}))
+        except ValueError as ve:
+            result['error'] = 'Invalid authUid: ' + str(ve)
+    if use_es and entries:
+        try:
+            fetched = get_data_from_es_batch([data_dict['twitter_id'] 
+                                                for _, data_dict in entries])
+            entries = [(result, fetched_dict) for (result, _), fetched_dict 
+                        in zip(entries, fetched)]
+        except ConnectionError as ce:
+            print "Elasticsearch unreachable at ", os.environ['ES_HOST']
+            print "ConnectionError: Info from ES:", ce.info
+            print "Will try hitting Twitter API if permitted...\n"
+
+    def prepare(entry):
+        result, data_dict = entry
+        try:
+            if isinstance(data_dict, Exception):
+                if not use_tw:
+                    raise data_dict
+                data_dict = {'twitter_id': parse_authUid(result['authUid']), 
+                             'data': []}
+            if use_tw and not data_dict['data']:
+                data_dict = get_columns_on_fly(data_dict['twitter_id'], 
+                                               save=save_on_fly, 
+                                               **kwargs)
+            return {'twitter_id': data_dict['twitter_id'], 
+                    'data': tweet_columns.as_columns(data_dict['data'])}
+        except Exception as ex:
+            result['error'] = type(ex).__name__ + ': ' + str(ex)
+
+    return [(result, data) for (result, _), data in 
+                zip(entries, pool.map(prepare, entries)) 
+            if data is not None]
+
+
+def compute_chunk(prepared):
+    """Compute stage of work_batch: schedules of (result, data_dict) pairs given by fetch_chunk
+
+        In one vectorized pass with compute_times_batch, or with compute_packed per user in the worker processes of compute_pool if started
+        :Returns: [list] of (result, schedule)
+    """
+    if compute_pool.started():
+        schedules = compute_pool.map(compute_packed, 
+                                     [(data_dict['twitter_id'], 
+                                       data_dict['data'].pack()) 
+                                      for _, data_dict in prepared])
+    else:
+        schedules = compute_times_batch([make_data_frame(data_dict) 
+                                         for _, data_dict in prepared])
+    return zip([result for result, _ in prepared], schedules)
+
+
+def write_chunk(computed, pool):
+    """Write stage of work_batch: (result, schedule) pairs given by compute_chunk with concurrent calls to write_schedule over given pool of threads
+
+        Records status, status_code, schedule_prepared and error in each result
+    """
+    def write(item):
+        result, schedule = item
+        try:
+            result['schedule_prepared'], response = write_schedule(schedule)
+            result['status_code'] = response.status_code
+            if response.status_code == 200:
+                result['status'] = 'success'
+            else:
+                result['error'] = 'save_schedule API failed with reason: ' + \
+                                    str(response.reason)
+        except Exception as ex:
+            result['schedule_prepared'] = schedule
+            result['error'] = type(ex).__name__ + ': ' + str(ex)
+
+    pool.map(write, computed)
+
+
+def work(interval=None, 
+         concurrency=None, 
+         queue=None, 
+         pipelined=None, 
+         compute_workers=None):
+    """Contineously comsume SQS queue and work on each authUid from it with a QueueConsumer
 
+        1. Keep one connection to the queue
+        2. Long-poll it for batches of up to 10 messages, right away while it has messages, backing off exponentially up to interval seconds while it is empty
+        3. Process messages in a pool of threads, extending visibility timeout of slow ones and taking fewer at a time while ES or save_schedule API slow down;
+           if pipelined, through a pipeline of fetch, compute and write stages with pools of their own - queue_worker.create_pipeline
+        4. Delete processed messages in batches
+        :param interval: [float] longest sleep between polls of an empty queue :default: environment variable WORKER_MAX_BACKOFF or 60
+        :param concurrency: [int] :default: environment variable WORKER_CONCURRENCY or 4; if pipelined, number of messages the pipeline holds
+        :param queue: boto SQS queue or queue_worker.LocalQueue :default: queue named by environment variable CALCULATION_QUEUE_NAME
+        :param pipelined: [bool] :default: environment variable PIPELINE_ENABLED or True
+        :param compute_workers: [int] number of worker processes of compute_pool computing schedules, 0 to compute in the threads
+            processing messages; if pipelined, the compute stage gets at least as many threads
+            :default: environment variable COMPUTE_WORKERS or 0
     """
-    data = prepare_data(**params)
-    schedule = compute_times(data)
-    return write_schedule(schedule)
+    from publishtimer import queue_worker
+    if pipelined is None:
+        pipelined = pipeline.PIPELINE_ENABLED
+    compute_pool.start(compute_workers)
+    stages = queue_worker.create_pipeline(
+                compute_workers=max(compute_workers or 
+                                    compute_pool.COMPUTE_WORKERS, 
+                                    pipeline.PIPELINE_COMPUTE_WORKERS)) \
+                if pipelined else None
+    consumer = queue_worker.QueueConsumer(queue or 
+                                          queue_worker.connect_queue(), 
+                                          concurrency=concurrency, 
+                                          max_backoff=interval, 
+                                          pipeline=stages)
+    try:
+        consumer.run()
+    finally:
+        consumer.stop()
+        if stages:
+            stages.close()
+        compute_pool.stop()
 
 
-def work(interval=30):
-    """Contineously comsume SQS queue and work on each authUid from it with interval of 30 seconds
+def parse_args(args=None):
+    """Parses command line options of the worker and the server: --compute-workers N
+        :default: options of sys.argv
     """
-    while True:    
-        work_once_with_sqs()
-        time.sleep(interval)
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--compute-workers', type=int, default=None, 
+                            help='number of worker processes computing '
+                                 'schedules, 0 to compute in threads '
+                                 '(default: environment variable '
+                                 'COMPUTE_WORKERS or 0)')
+    return arg_parser.parse_args(args)
 
 
 if __name__=='__main__':
-    work()
\ No newline at end of file
+    work(compute_workers=parse_args().compute_workers)
\ No newline at end of file
@@ -6,37 +6,181 @@ Created on Tue Mar 29 14:44:23 2016
 """
 
 import os
+import time
 import datetime
+import threading
 from elasticsearch_dsl.connections import connections
 from elasticsearch_dsl import DocType, Date, String
 from elasticsearch.connection.http_urllib3 import   ConnectionTimeout
+from elasticsearch.exceptions import TransportError
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch.helpers import streaming_bulk
 
 
-CLIENT  = connections.create_connection(hosts=[os.environ['ES_HOST']], 
-                                        timeout=int(os.environ['ES_TIMEOUT']))
+TWEET_INDEX_PREFIX = 'tweets-index-'
+TWEET_INDEX_WEEKS = int(os.environ.get('TWEET_INDEX_WEEKS', 0))
+ES_USER_ROUTING = os.environ.get('ES_USER_ROUTING', 'false').lower() in \
+                    ['1', 'true', 'yes']
+ES_ROUTING_SINCE = os.environ.get('ES_ROUTING_SINCE', '')
+ES_BULK_MAX_DOCS = int(os.environ.get('ES_BULK_MAX_DOCS', 500))
+ES_BULK_MAX_BYTES = int(os.environ.get('ES_BULK_MAX_BYTES', 5 * 1024 * 1024))
+ES_BULK_MAX_SECONDS = float(os.environ.get('ES_BULK_MAX_SECONDS', 5))
+SERIALIZER = JSONSerializer()
+
+ES_MAXSIZE = int(os.environ.get('ES_MAXSIZE', 10))
+ES_DEAD_TIMEOUT = int(os.environ.get('ES_DEAD_TIMEOUT', 60))
+ES_SNIFF = os.environ.get('ES_SNIFF', 'false').lower() in ['1', 'true', 'yes']
+ES_SNIFFER_TIMEOUT = int(os.environ.get('ES_SNIFFER_TIMEOUT', 300))
+ES_PING_INTERVAL = int(os.environ.get('ES_PING_INTERVAL', 30))
+
+
+def create_es_client():
+    """Creates the default Elasticsearch-client connection with settings from environment variables
+
+        ES_HOST, ES_TIMEOUT: host and default request timeout
+        ES_MAXSIZE: connections per node kept alive in the pool of the client
+        ES_DEAD_TIMEOUT: seconds for which the pool keeps a failed node out of rotation
+        ES_SNIFF, ES_SNIFFER_TIMEOUT: discover nodes of the cluster on start, on connection failure and every ES_SNIFFER_TIMEOUT seconds
+    """
+    return connections.create_connection(
+                hosts=[os.environ['ES_HOST']], 
+                timeout=int(os.environ['ES_TIMEOUT']), 
+                maxsize=ES_MAXSIZE, 
+                dead_timeout=ES_DEAD_TIMEOUT, 
+                retry_on_timeout=True, 
+                sniff_on_start=ES_SNIFF, 
+                sniff_on_connection_fail=ES_SNIFF, 
+                sniffer_timeout=ES_SNIFFER_TIMEOUT if ES_SNIFF else None)
+
+
+CLIENT = None
+HEALTH = {'alive': None, 'checked_at': 0}
+HEALTH_CHECK_LOCK = threading.Lock()
+
+
+def ping_es():
+    """:Returns: True if ES server responds to ping of the singleton Elasticsearch-client, False otherwise
+    """
+    try:
+        return CLIENT.ping()
+    except TransportError:
+        return False
+
+
+def check_es_health(retry=True):
+    """Pings ES with the singleton Elasticsearch-client and records the result in HEALTH; the client is created anew if ping fails and retry
+    """
+    global CLIENT
+    try:
+        alive = ping_es()
+        if not alive and retry:
+            CLIENT = create_es_client()
+            alive = ping_es()
+        HEALTH.update({'alive': alive, 'checked_at': time.time()})
+    finally:
+        HEALTH_CHECK_LOCK.release()
+
 
 def get_es_client(enforce_new=False, retry=True):
     """Returns the singleton Elasticsearch-client object connected to ES server specified by environment variable ES_HOST with default timeout specified by environment variable ES_TIMEOUT
+
+        The client is created on first call, not on import of this module. It is not pinged on each call: failed nodes are handled by its connection pool, 
+        and liveness is checked by check_es_health in a background thread once every ES_PING_INTERVAL seconds
     """
     global CLIENT
     if enforce_new or not CLIENT:
-        CLIENT = \
-        connections.create_connection(hosts=[os.environ['ES_HOST']], 
-                                      timeout=os.environ['ES_TIMEOUT'])
-    if CLIENT.ping():
-        return CLIENT
-    elif retry:
-        return get_es_client(enforce_new=True, retry=False)
-    else:
-        return CLIENT    
+        CLIENT = create_es_client()
+    elif time.time() - HEALTH['checked_at'] >= ES_PING_INTERVAL and \
+            HEALTH_CHECK_LOCK.acquire(False):
+        checker = threading.Thread(target=check_es_health, args=(retry,))
+        checker.daemon = True
+        checker.start()
+    return CLIENT
+
+
+def get_es_health():
+    """Returns state of the singleton Elasticsearch-client for monitoring: result and time of last liveness check, and number of live and dead nodes in its pool
+    """
+    if not CLIENT:
+        return {'alive': None, 
+                'checked_at': HEALTH['checked_at'], 
+                'live_connections': 0, 
+                'dead_connections': 0}
+    pool = CLIENT.transport.connection_pool
+    dead = getattr(pool, 'dead', None)
+    return {'alive': HEALTH['alive'], 
+            'checked_at': HEALTH['checked_at'], 
+            'live_connections': len(pool.connections), 
+            'dead_connections': dead.qsize() if dead else 0}
     
 
-def get_tweet_index():
-    """Generates ES index name for tweet object from current time as tweet-index-<YEAR>-<#WEEK>
+def get_tweet_index(date=None):
+    """Generates ES index name for tweet object from given date or current time as tweet-index-<YEAR>-<#WEEK>
+    """
+    if not date:
+        date = datetime.datetime.now()
+    return TWEET_INDEX_PREFIX + \
+        '-'.join([str(l) for l in list(datetime.date.isocalendar(date))][:2])
+
+
+def get_tweet_indices(weeks=None):
+    """Returns ES index expression covering the indices generated by get_tweet_index
+        
+        :param weeks: [int] When given, only the indices of that many most recent weeks (including current one) are covered
+            :default: environment variable TWEET_INDEX_WEEKS if set, else all weeks (pattern tweets-index-*)
     """
-    return 'tweets-index-' + \
-        '-'.join([str(l) for l in list(datetime.date.isocalendar(
-                                        datetime.datetime.now()))][:2])
+    weeks = weeks or TWEET_INDEX_WEEKS
+    if not weeks:
+        return TWEET_INDEX_PREFIX + '*'
+    now = datetime.datetime.now()
+    return ','.join(get_tweet_index(now - datetime.timedelta(weeks=week)) 
+                        for week in range(weeks))
+
+
+def get_routing(user_id):
+    """Returns the ES routing value for tweets of given user, or None unless environment variable ES_USER_ROUTING enables user-based routing
+    """
+    if ES_USER_ROUTING:
+        return str(user_id)
+    return None
+
+
+def index_week(index):
+    """Returns (year, week) of given index name generated by get_tweet_index, or of a '<YEAR>-<#WEEK>' string
+    """
+    return tuple(int(v) for v in index.split('-')[-2:])
+
+
+def is_routed(indices):
+    """Returns True if all tweets in given index expression of get_tweet_indices were saved with routing of get_routing, so that routed searches find all of them
+
+        That is when ES_USER_ROUTING is enabled and either ES_ROUTING_SINCE is not set (all indices written or reindexed with routing)
+        or all given indices are of weeks from ES_ROUTING_SINCE on. A pattern covering all weeks is routed only without ES_ROUTING_SINCE
+    """
+    if not ES_USER_ROUTING:
+        return False
+    if not ES_ROUTING_SINCE:
+        return True
+    if '*' in indices:
+        return False
+    since = index_week(ES_ROUTING_SINCE)
+    return all(index_week(index) >= since for index in indices.split(','))
+
+
+def get_tweet_search_params(user_id, weeks=None):
+    """Returns params for searching tweets of given user: the tweet indices of get_tweet_indices(weeks), doc_type tweet and routing of the user
+        if all these indices are routed (see is_routed); else they are searched on all shards
+
+        Indices missing for some of the weeks are ignored
+    """
+    params = {'index': get_tweet_indices(weeks), 
+              'doc_type': 'tweet', 
+              'ignore_unavailable': True}
+    routing = get_routing(user_id)
+    if routing is not None and is_routed(params['index']):
+        params['routing'] = routing
+    return params
+
 
 class Tweet(DocType):
     """DocType for saving a tweet in ES
@@ -45,14 +189,112 @@ class Tweet(DocType):
     outdated = String()
         
 
-    def save(self, **kwargs):
-        """Saves this document to given index into the ES
+    def stamp(self):
+        """Marks this document as saved now and not outdated
         """
         self.saved_at = datetime.datetime.now()        
         self.outdated = "No"
+
+
+    def save(self, **kwargs):
+        """Saves this document to given index into the ES
+        """
+        self.stamp()
+        kwargs.setdefault('using', get_es_client())
         try:
             return super(Tweet, self).save(**kwargs)
         except ConnectionTimeout as ct:
             raw_input("ConnectionTimeout with Elasticsearch." + str(ct) +\
             "\nFix it and then continue.")
             self.save(**kwargs)
+
+
+    def to_action(self):
+        """Returns this document stamped as by save in the form of an action for BulkWriter
+        """
+        self.stamp()
+        return self.to_dict(include_meta=True)
+
+
+class BulkWriter(object):
+    """Buffers documents and indexes them into ES with bulk requests
+
+        The buffer is flushed when it holds max_docs documents or max_bytes bytes of serialized sources, 
+        max_seconds after its first document was added, or on explicit call to flush.
+        After each flush, callback is called with the number of documents indexed and the list of per-document failures.
+    """
+    def __init__(self, 
+                 max_docs=None, 
+                 max_bytes=None, 
+                 max_seconds=None, 
+                 callback=None):
+        """Create a BulkWriter with given thresholds for flushing
+        
+            :param max_docs: [int] :default: environment variable ES_BULK_MAX_DOCS or 500
+            :param max_bytes: [int] :default: environment variable ES_BULK_MAX_BYTES or 5 MB
+            :param max_seconds: [float] :default: environment variable ES_BULK_MAX_SECONDS or 5
+            :param callback: [callable] callback(indexed_count, failures) :default: None
+        """
+        self.max_docs = max_docs or ES_BULK_MAX_DOCS
+        self.max_bytes = max_bytes or ES_BULK_MAX_BYTES
+        self.max_seconds = max_seconds or ES_BULK_MAX_SECONDS
+        self.callback = callback
+        self.lock = threading.RLock()
+        self.timer = None
+        self.actions = []
+        self.buffered_bytes = 0
+        self.indexed_count = 0
+        self.failed_count = 0
+
+
+    def add(self, action):
+        """Buffers given action (dict with _index, _type, _id, optional _routing, and _source) and flushes if a threshold is reached
+        """
+        action = dict(action)
+        action['_source'] = SERIALIZER.dumps(action['_source'])
+        with self.lock:
+            self.actions.append(action)
+            self.buffered_bytes += len(action['_source'])
+            if len(self.actions) >= self.max_docs or \
+                    self.buffered_bytes >= self.max_bytes:
+                self.flush()
+            elif not self.timer:
+                self.timer = threading.Timer(self.max_seconds, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+
+    def flush(self):
+        """Indexes all buffered actions with one bulk request
+        
+            :Returns: (indexed_count, failures) of this flush, where failures is a list of {'_id': <id>, 'status': <status>, 'error': <error>}
+        """
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            actions, self.actions, self.buffered_bytes = self.actions, [], 0
+            if not actions:
+                return 0, []
+            failures = []
+            try:
+                for ok, item in streaming_bulk(get_es_client(), 
+                                               actions, 
+                                               chunk_size=len(actions), 
+                                               max_chunk_bytes=2**31, 
+                                               raise_on_error=False):
+                    if not ok:
+                        info = item.values()[0]
+                        failures.append({'_id': info.get('_id'), 
+                                         'status': info.get('status'), 
+                                         'error': info.get('error')})
+            except TransportError as te:
+                failures = [{'_id': action.get('_id'), 
+                             'status': te.status_code, 
+                             'error': str(te)} for action in actions]
+            indexed_count = len(actions) - len(failures)
+            self.indexed_count += indexed_count
+            self.failed_count += len(failures)
+            if self.callback:
+                self.callback(indexed_count, failures)
+            return indexed_count, failures
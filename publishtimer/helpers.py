@@ -6,6 +6,13 @@ Created on Mon Mar 28 12:51:03 2016
 """
 
 import os
+import sys
+import time
+import Queue
+import datetime
+import importlib
+import threading
+from collections import OrderedDict
 from base64 import b64decode
 from Crypto.Cipher import AES
 from Crypto.Hash import MD5
@@ -62,18 +69,164 @@ def unpad(s):
     return s[:-ord(s[len(s)-1:])]
 
 
+class LazyModule(object):
+    """Stand-in for a module which is imported on first access to any of its attributes
+
+        Lets modules defer heavy imports to the code paths which need them while keeping module-level names like np or pd
+    """
+    def __init__(self, name):
+        self.__dict__['name'] = name
+        self.__dict__['module'] = None
+
+    def __getattr__(self, attr):
+        if self.__dict__['module'] is None:
+            self.__dict__['module'] = importlib.import_module(self.name)
+        return getattr(self.__dict__['module'], attr)
+
+    def __repr__(self):
+        return "<LazyModule '" + self.name + "'>"
+
+
+class TTLCache(object):
+    """Thread-safe in-process cache whose entries expire ttl seconds after being set, evicting the least recently used entry beyond maxsize
+
+        Counts hits, misses and evictions for monitoring
+    """
+    def __init__(self, maxsize=1024, ttl=900):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Returns value cached for key and marks it recently used, default if absent or expired
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return default
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """Caches value for key for ttl seconds, evicting least recently used entries beyond maxsize
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time() + self.ttl)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Removes key from cache; Returns True if it was cached
+        """
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+    def clear(self):
+        """Removes all entries, keeping the counters
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Returns {'hits', 'misses', 'evictions', 'size'} of this cache
+        """
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self.entries)}
+
+
 def purge_key_deep(a_dict, key):
     """Removes given key from all nested levels of a_dict
     """
-    try:
-        a_dict.pop(key)
-    except KeyError:
-        pass
+    return purge_keys_deep(a_dict, (key,))
+
+
+def purge_keys_deep(a_dict, keys):
+    """Removes all given keys from all nested levels of a_dict in place, with one traversal
+    """
     for k in a_dict.keys():
-        if isinstance(a_dict[k], dict):
-            a_dict[k] = purge_key_deep(a_dict[k], key)
+        if k in keys:
+            del a_dict[k]
+        elif isinstance(a_dict[k], dict):
+            purge_keys_deep(a_dict[k], keys)
     return a_dict
+
+
+MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6, 
+          'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+
+def parse_twitter_time(time_str):
+    """Parses created_at of Twitter API, e.g. 'Fri Apr 01 10:05:00 +0000 2016', into a naive UTC datetime
+
+        Slices the fixed-width fields instead of matching with strptime; other formats fall back to strptime, which raises ValueError
+    """
+    try:
+        if len(time_str) == 30 and time_str[19:26] == ' +0000 ':
+            return datetime.datetime(int(time_str[26:]), 
+                                     MONTHS[time_str[4:7]], 
+                                     int(time_str[8:10]), 
+                                     int(time_str[11:13]), 
+                                     int(time_str[14:16]), 
+                                     int(time_str[17:19]))
+    except (KeyError, ValueError):
+        pass
+    return datetime.datetime.strptime(time_str, "%a %b %d %H:%M:%S +0000 %Y")
         
 
+def prefetch(iterable, size=1):
+    """Yields items of iterable while a background thread produces up to size items ahead, so that producing the next item overlaps consuming this one
+
+        Exceptions raised by iterable are re-raised to the consumer. When the consumer stops early (closes the generator),
+        the producer stops after the item it is producing
+    """
+    queue = Queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception:
+            put((done, sys.exc_info()))
+            return
+        put((done, None))
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if item is done:
+                if error:
+                    raise error[0], error[1], error[2]
+                return
+            yield item
+    finally:
+        stop.set()
+
+
 if __name__=="__main__":
     setup_env()
\ No newline at end of file
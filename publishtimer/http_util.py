@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:05:12 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 10))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+
+def create_session(pool_connections=None, pool_maxsize=None, max_retries=None,
+                   backoff_factor=None):
+    """Returns a new requests.Session keeping alive pooled connections to each host
+
+        Connection errors are retried by urllib3 up to max_retries times with exponential backoff
+        :param pool_connections: [int] number of hosts to keep pools for :default: environment variable HTTP_POOL_CONNECTIONS or 10
+        :param pool_maxsize: [int] connections kept alive per host :default: environment variable HTTP_POOL_MAXSIZE or 20
+        :param max_retries: [int] :default: environment variable HTTP_MAX_RETRIES or 3
+        :param backoff_factor: [float] sleep between retries is backoff_factor * 2^(retry number - 1) seconds :default: environment variable HTTP_BACKOFF_FACTOR or 0.5
+    """
+    retry = Retry(total=HTTP_MAX_RETRIES if max_retries is None
+                        else max_retries,
+                  backoff_factor=HTTP_BACKOFF_FACTOR if backoff_factor is None
+                                    else backoff_factor)
+    adapter = HTTPAdapter(pool_connections=pool_connections or
+                                            HTTP_POOL_CONNECTIONS,
+                          pool_maxsize=pool_maxsize or HTTP_POOL_MAXSIZE,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(enforce_new=False):
+    """Returns the singleton session shared by all outbound calls to Crowdfire and Twitter APIs, creating it on first call or if enforce_new
+    """
+    global SESSION
+    with SESSION_LOCK:
+        if enforce_new or not SESSION:
+            if SESSION:
+                SESSION.close()
+            SESSION = create_session()
+        return SESSION
+
+
+def request(method, url, **kwargs):
+    """Sends request with the shared session, retrying on 5xx response
+
+        1. Default timeout to HTTP_TIMEOUT seconds
+        2. Send request; connection errors are retried by the session
+        3. On status 500, 502, 503 or 504 sleep HTTP_BACKOFF_FACTOR * 2^attempt seconds and resend, up to HTTP_MAX_RETRIES times
+        4. Return the last response, so callers see the final 5xx status rather than an exception
+    """
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    session = get_session()
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        response = session.request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or \
+                attempt == HTTP_MAX_RETRIES:
+            return response
+        response.close()
+        time.sleep(HTTP_BACKOFF_FACTOR * (2 ** attempt))
+
+
+def get(url, **kwargs):
+    """GET request with the shared session - see request
+    """
+    return request('GET', url, **kwargs)
+
+
+def put(url, **kwargs):
+    """PUT request with the shared session - see request
+    """
+    return request('PUT', url, **kwargs)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:41:17 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import os
+import time
+import uuid
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+from publishtimer import metrics
+
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))
+
+MANAGER = None
+MANAGER_LOCK = threading.Lock()
+
+
+class JobManager(object):
+    '''Class to run functions in a local pool of worker threads as jobs whose status and result are looked up by job id
+
+        Job: {'job_id', 'status': 'queued'/'running'/'succeeded'/'failed', 'submitted_at', 'started_at', 'finished_at',
+              'result': <return value> on success, 'error', 'description', 'computed_schedule' on failure}
+        Finished jobs are forgotten ttl seconds after they finish
+    '''
+    def __init__(self, workers=None, ttl=None, logger_name="JobManagerLogger"):
+        """Create a manager with given number of worker threads
+            :param workers: [int] :default: environment variable JOB_WORKERS or 4
+            :param ttl: [int] seconds for which results of finished jobs are kept :default: environment variable JOB_RESULT_TTL or 3600
+        """
+        self.workers = workers or JOB_WORKERS
+        self.ttl = JOB_RESULT_TTL if ttl is None else ttl
+        self.logger = logging.getLogger(logger_name)
+        self.pool = ThreadPool(self.workers)
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+
+    def submit(self, function, *args, **kwargs):
+        """Queues function(*args, **kwargs) as a new job
+            :Returns: [str] job id
+        """
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.purge()
+            self.jobs[job_id] = {'job_id': job_id,
+                                 'status': 'queued',
+                                 'submitted_at': time.time(),
+                                 'started_at': None,
+                                 'finished_at': None}
+            self.report()
+        self.pool.apply_async(self.run, (job_id, function, args, kwargs))
+        return job_id
+
+
+    def run(self, job_id, function, args, kwargs):
+        """Runs one job in a worker thread, recording its result or the exception it raised
+        """
+        with self.lock:
+            self.jobs[job_id]['status'] = 'running'
+            self.jobs[job_id]['started_at'] = time.time()
+            self.report()
+        update = {}
+        try:
+            with metrics.REGISTRY.timed('jobs.run'):
+                update['result'] = function(*args, **kwargs)
+            update['status'] = 'succeeded'
+        except Exception as ex:
+            self.logger.error("Job " + job_id + " failed: " +
+                              type(ex).__name__ + ": " + str(ex),
+                              exc_info=True)
+            update['status'] = 'failed'
+            update['error'] = type(ex).__name__ + ": " + str(ex)
+            update['description'] = getattr(ex, 'description', str(ex))
+            if hasattr(ex, 'computed_schedule'):
+                update['computed_schedule'] = ex.computed_schedule
+        update['finished_at'] = time.time()
+        with self.lock:
+            self.jobs[job_id].update(update)
+            self.report()
+        metrics.REGISTRY.increment('jobs.' + update['status'])
+
+
+    def get(self, job_id):
+        """Returns copy of job of given id, None if unknown or forgotten
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+
+    def purge(self):
+        """Forgets jobs finished more than ttl seconds ago; to be called holding self.lock
+        """
+        expiry = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                        if job['finished_at'] and job['finished_at'] < expiry]:
+            del self.jobs[job_id]
+
+
+    def report(self):
+        """Records number of queued and running jobs as gauges in metrics.REGISTRY; to be called holding self.lock
+        """
+        statuses = [job['status'] for job in self.jobs.values()]
+        metrics.REGISTRY.set_gauge('jobs.queued', statuses.count('queued'))
+        metrics.REGISTRY.set_gauge('jobs.running', statuses.count('running'))
+
+
+    def close(self):
+        """Waits for submitted jobs to finish and stops the worker threads
+        """
+        self.pool.close()
+        self.pool.join()
+
+
+
+def get_manager():
+    """Returns the singleton JobManager, creating it on first call
+    """
+    global MANAGER
+    with MANAGER_LOCK:
+        if MANAGER is None:
+            MANAGER = JobManager()
+        return MANAGER
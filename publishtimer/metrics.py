@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:42:30 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+
+EWMA_WEIGHT = 0.2
+
+
+class Metrics(object):
+    '''Thread-safe registry of counters, gauges and timers for monitoring
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+
+    def increment(self, name, value=1):
+        """Adds value to counter of given name
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def set_gauge(self, name, value):
+        """Sets gauge of given name to value
+        """
+        with self.lock:
+            self.gauges[name] = value
+
+
+    def observe(self, name, seconds):
+        """Records one duration of given name: count, total, max, last and exponentially weighted moving average
+        """
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = {'count': 1, 'total': seconds,
+                                     'max': seconds, 'last': seconds,
+                                     'ewma': seconds}
+            else:
+                timer['count'] += 1
+                timer['total'] += seconds
+                timer['max'] = max(timer['max'], seconds)
+                timer['last'] = seconds
+                timer['ewma'] += EWMA_WEIGHT * (seconds - timer['ewma'])
+
+
+    @contextmanager
+    def timed(self, name):
+        """Context manager recording the duration of its block with observe, also when the block raises
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+
+    def ewma(self, name, default=0.0):
+        """:Returns: moving average of durations recorded for given name, default if none recorded
+        """
+        with self.lock:
+            timer = self.timers.get(name)
+            return timer['ewma'] if timer else default
+
+
+    def snapshot(self):
+        """:Returns: copy of all metrics as {'counters': {}, 'gauges': {}, 'timers': {}}
+        """
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'gauges': dict(self.gauges),
+                    'timers': dict((name, dict(timer)) for name, timer
+                                        in self.timers.items())}
+
+
+    def reset(self):
+        """Clears all metrics
+        """
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+
+
+REGISTRY = Metrics()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:52:37 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import os
+import time
+import Queue
+import logging
+import threading
+from publishtimer import metrics
+
+
+PIPELINE_ENABLED = os.environ.get('PIPELINE_ENABLED',
+                                  'true').lower() == 'true'
+PIPELINE_FETCH_WORKERS = int(os.environ.get('PIPELINE_FETCH_WORKERS', 4))
+PIPELINE_COMPUTE_WORKERS = int(os.environ.get('PIPELINE_COMPUTE_WORKERS', 2))
+PIPELINE_WRITE_WORKERS = int(os.environ.get('PIPELINE_WRITE_WORKERS', 4))
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 8))
+STOP = object()
+
+
+class Stage(object):
+    '''One stage of a Pipeline: a bounded queue of items and the worker threads applying function to them
+    '''
+    def __init__(self, name, function, workers, queue_size):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = Queue.Queue(queue_size)
+        self.running = workers
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.threads = []
+
+
+    def state(self, elapsed):
+        """Returns {'workers', 'busy', 'queued', 'queue_size', 'processed', 'failed', 'throughput', 'utilization'} of this stage
+            after elapsed seconds: throughput in items per second, utilization as fraction of worker time spent on items
+        """
+        elapsed = max(elapsed, 1e-9)
+        return {'workers': self.workers,
+                'busy': self.busy,
+                'queued': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'processed': self.processed,
+                'failed': self.failed,
+                'throughput': round(self.processed / elapsed, 3),
+                'utilization': round(self.busy_seconds /
+                                     (elapsed * self.workers), 3)}
+
+
+
+class Pipeline(object):
+    '''Class to pass items through a sequence of stages, each run by its own pool of worker threads, connected by bounded queues
+
+        Output of a stage is the input of the next, so that stages of different items overlap: one item is written while the next is computed
+        and the one after is fetched. A stage blocks on putting into the full queue of the next one, so a slow stage holds back
+        the ones before it down to submit, instead of piling items up in memory.
+        Per stage, latency is recorded in metrics.REGISTRY as <name>.<stage>, items as <name>.<stage>.processed / .failed,
+        and occupancy, throughput and utilization as gauges by report.
+    '''
+    def __init__(self, stages, queue_size=None, name='pipeline',
+                 logger_name="PipelineLogger"):
+        """Start worker threads of given stages
+
+            :param stages: [list] of (name, function, workers): function called with each item, returning the item for the next stage
+            :param queue_size: [int] capacity of the queue in front of each stage
+                :default: environment variable PIPELINE_QUEUE_SIZE or 8
+            :param name: [str] prefix of metrics :default: 'pipeline'
+        """
+        queue_size = queue_size or PIPELINE_QUEUE_SIZE
+        self.name = name
+        self.stages = [Stage(stage_name, function, workers, queue_size)
+                        for stage_name, function, workers in stages]
+        self.logger = logging.getLogger(logger_name)
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self.work, args=(index,))
+                thread.daemon = True
+                thread.start()
+                stage.threads.append(thread)
+
+
+    def capacity(self):
+        """Returns number of items the pipeline holds at most: queued or in process in any stage
+        """
+        return sum(stage.workers + stage.queue.maxsize
+                    for stage in self.stages)
+
+
+    def submit(self, item, callback=None):
+        """Queues item into the first stage, blocking while its queue is full
+
+            :param callback: [callable] called in a worker thread as callback(result, error) when item leaves the pipeline:
+                with the return value of the last stage and error None, or with result None and the exception raised by a stage,
+                which ends the item. Failures are logged if no callback is given
+        """
+        self.put(0, (item, callback))
+
+
+    def put(self, index, entry):
+        """Puts entry into queue of stage at index, blocking while it is full
+        """
+        stage = self.stages[index]
+        stage.queue.put(entry)
+        metrics.REGISTRY.set_gauge(self.name + '.' + stage.name + '.queued',
+                                   stage.queue.qsize())
+
+
+    def work(self, index):
+        """Runs in each worker thread of stage at index: applies its function to items until STOP, then stops the next stage after the last worker
+        """
+        stage = self.stages[index]
+        prefix = self.name + '.' + stage.name
+        while True:
+            entry = stage.queue.get()
+            if entry is STOP:
+                break
+            item, callback = entry
+            with self.lock:
+                stage.busy += 1
+            metrics.REGISTRY.set_gauge(prefix + '.queued', stage.queue.qsize())
+            start = time.time()
+            try:
+                result, error = stage.function(item), None
+            except Exception as ex:
+                result, error = None, ex
+            elapsed = time.time() - start
+            metrics.REGISTRY.observe(prefix, elapsed)
+            metrics.REGISTRY.increment(prefix + ('.processed' if error is None
+                                                 else '.failed'))
+            with self.lock:
+                stage.busy -= 1
+                stage.busy_seconds += elapsed
+                if error is None:
+                    stage.processed += 1
+                else:
+                    stage.failed += 1
+            if error is None and index + 1 < len(self.stages):
+                self.put(index + 1, (result, callback))
+            else:
+                self.finish(stage, callback, result, error)
+        with self.lock:
+            stage.running -= 1
+            last = not stage.running
+        if last and index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].workers):
+                self.stages[index + 1].queue.put(STOP)
+
+
+    def finish(self, stage, callback, result, error):
+        """Hands result or error of an item leaving the pipeline at given stage to its callback
+        """
+        if callback is None:
+            if error is not None:
+                self.logger.error("Item failed in stage " + stage.name +
+                                  ": " + type(error).__name__ + ": " +
+                                  str(error), exc_info=True)
+            return
+        try:
+            callback(result, error)
+        except Exception as ex:
+            self.logger.error("Callback failed: " + type(ex).__name__ +
+                              ": " + str(ex), exc_info=True)
+
+
+    def snapshot(self):
+        """Returns state of each stage since the pipeline started: {<stage name>: {'workers', 'busy', 'queued', 'queue_size', 'processed', 'failed', 'throughput', 'utilization'}}
+        """
+        elapsed = time.time() - self.started_at
+        with self.lock:
+            return dict((stage.name, stage.state(elapsed))
+                        for stage in self.stages)
+
+
+    def report(self):
+        """Records queued, busy, throughput and utilization of each stage as gauges <name>.<stage>.<key> in metrics.REGISTRY
+            :Returns: snapshot
+        """
+        snapshot = self.snapshot()
+        for stage_name, state in snapshot.items():
+            for key in ['queued', 'busy', 'throughput', 'utilization']:
+                metrics.REGISTRY.set_gauge(self.name + '.' + stage_name +
+                                           '.' + key, state[key])
+        return snapshot
+
+
+    def close(self):
+        """Waits for submitted items to pass through all stages, stops the worker threads and reports
+        """
+        for _ in range(self.stages[0].workers):
+            self.stages[0].queue.put(STOP)
+        for stage in self.stages:
+            for thread in stage.threads:
+                thread.join()
+        return self.report()
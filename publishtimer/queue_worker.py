@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:20:11 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from publishtimer import helpers
+from publishtimer import core
+from publishtimer import metrics
+from publishtimer import pipeline
+from publishtimer import rate_limit
+from publishtimer.custom_exceptions import WriteScheduleFailedError
+
+
+boto = helpers.LazyModule('boto')
+
+SQS_BATCH_SIZE = 10
+SQS_WAIT_TIME_SECONDS = int(os.environ.get('SQS_WAIT_TIME_SECONDS', 20))
+SQS_VISIBILITY_TIMEOUT = int(os.environ.get('SQS_VISIBILITY_TIMEOUT', 300))
+SQS_MAX_VISIBILITY_TIMEOUT = 12 * 60 * 60
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 4))
+WORKER_MIN_BACKOFF = float(os.environ.get('WORKER_MIN_BACKOFF', 1))
+WORKER_MAX_BACKOFF = float(os.environ.get('WORKER_MAX_BACKOFF', 60))
+WORKER_MAX_STAGE_LATENCY = float(os.environ.get('WORKER_MAX_STAGE_LATENCY', 10))
+QUEUE_DEPTH_INTERVAL = int(os.environ.get('QUEUE_DEPTH_INTERVAL', 30))
+BACKPRESSURE_STAGES = ['stage.prepare', 'stage.write']
+
+
+def connect_queue(name=None):
+    """Returns the boto SQS queue of given name
+        :param name: :default: environment variable CALCULATION_QUEUE_NAME
+    """
+    return boto.connect_sqs().get_queue(
+                name or os.environ['CALCULATION_QUEUE_NAME'])
+
+
+def process_message(params):
+    """Default handler of QueueConsumer: computes & writes schedule for the authUid in given message body
+        Raises WriteScheduleFailedError if save_schedule API returns failure response
+        Raises rate_limit.RateLimitExceeded instead of waiting for Twitter rate limit, so that the message is retried once capacity returns
+    """
+    schedule, response = core.work_once(authUid=params['authUid'], 
+                                        block=False)
+    if response.status_code != 200:
+        raise WriteScheduleFailedError(upstream_response=response,
+                                       computed_schedule=schedule)
+    return schedule
+
+
+def prepare_message(params):
+    """Fetch stage of the pipeline of create_pipeline: inputs of the schedule of the authUid in given message body, by core.prepare_inputs
+
+        Raises rate_limit.RateLimitExceeded instead of waiting for Twitter rate limit, as process_message
+    """
+    return core.prepare_inputs(authUid=params['authUid'], block=False)
+
+
+def write_message(schedule):
+    """Write stage of the pipeline of create_pipeline: writes given schedule with core.write_schedule, timed as stage.write
+
+        Raises WriteScheduleFailedError if save_schedule API returns failure response
+    """
+    with metrics.REGISTRY.timed('stage.write'):
+        schedule, response = core.write_schedule(schedule)
+    if response.status_code != 200:
+        raise WriteScheduleFailedError(upstream_response=response,
+                                       computed_schedule=schedule)
+    return schedule
+
+
+def create_pipeline(fetch_workers=None, 
+                    compute_workers=None, 
+                    write_workers=None, 
+                    queue_size=None):
+    """Returns pipeline.Pipeline doing the work of process_message in 3 stages with pools of their own, for QueueConsumer:
+        fetch (prepare_message), compute (core.compute_schedule) and write (write_message)
+
+        :param fetch_workers: [int] :default: environment variable PIPELINE_FETCH_WORKERS or 4
+        :param compute_workers: [int] :default: environment variable PIPELINE_COMPUTE_WORKERS or 2
+        :param write_workers: [int] :default: environment variable PIPELINE_WRITE_WORKERS or 4
+        :param queue_size: [int] :default: environment variable PIPELINE_QUEUE_SIZE or 8
+    """
+    return pipeline.Pipeline(
+            [('fetch', prepare_message, 
+                fetch_workers or pipeline.PIPELINE_FETCH_WORKERS), 
+             ('compute', core.compute_schedule, 
+                compute_workers or pipeline.PIPELINE_COMPUTE_WORKERS), 
+             ('write', write_message, 
+                write_workers or pipeline.PIPELINE_WRITE_WORKERS)], 
+            queue_size=queue_size)
+
+
+class QueueConsumer(object):
+    '''Class to consume messages of an SQS queue with a pool of worker threads
+
+        Polling adapts to the queue: it drains the queue without pause while messages arrive and backs off exponentially while it is empty.
+        Backpressure: the number of messages taken in process at a time is halved while the moving average latency of a downstream stage
+        of core.work_once (ES fetch in stage.prepare, save_schedule API in stage.write) exceeds max_stage_latency, and grows back by one
+        per message otherwise.
+        Given a pipeline.Pipeline, messages are handed to it instead of handler, and settled when they leave it.
+        Queue depth, messages in flight, capacity and per-stage latencies are recorded in metrics.REGISTRY.
+    '''
+    def __init__(self,
+                 queue,
+                 handler=process_message,
+                 concurrency=None,
+                 visibility_timeout=None,
+                 wait_time_seconds=None,
+                 min_backoff=None,
+                 max_backoff=None,
+                 max_stage_latency=None,
+                 pipeline=None,
+                 logger_name="QueueConsumerLogger"):
+        """Create a consumer of given queue
+
+            :param queue: boto SQS queue, or any object with the same get_messages, delete_message_batch, change_message_visibility_batch and count methods such as LocalQueue
+            :param handler: [callable] called with JSON-decoded body of each message; the message is deleted when it returns and left for redelivery when it raises
+                :default: process_message
+            :param concurrency: [int] maximum number of messages processed at a time
+                :default: capacity of pipeline if given, else environment variable WORKER_CONCURRENCY or 4
+            :param visibility_timeout: [int] seconds for which a received message stays hidden from other consumers; extended for messages still in process
+                :default: environment variable SQS_VISIBILITY_TIMEOUT or 300
+            :param wait_time_seconds: [int] long polling wait of each receive request
+                :default: environment variable SQS_WAIT_TIME_SECONDS or 20
+            :param min_backoff, max_backoff: [float] seconds to sleep after the first and after many consecutive polls that received nothing
+                :default: environment variables WORKER_MIN_BACKOFF or 1, WORKER_MAX_BACKOFF or 60
+            :param max_stage_latency: [float] seconds of moving average latency of a downstream stage above which backpressure applies
+                :default: environment variable WORKER_MAX_STAGE_LATENCY or 10
+            :param pipeline: [pipeline.Pipeline] taking JSON-decoded message bodies, such as of create_pipeline, to process messages
+                in stages instead of calling handler; the message is deleted when it leaves the last stage and left for redelivery
+                when a stage raises. Not closed by stop :default: None
+        """
+        self.queue = queue
+        self.handler = handler
+        self.pipeline = pipeline
+        self.concurrency = concurrency or \
+                            (pipeline.capacity() if pipeline 
+                             else WORKER_CONCURRENCY)
+        self.capacity = self.concurrency
+        self.visibility_timeout = visibility_timeout or SQS_VISIBILITY_TIMEOUT
+        self.wait_time_seconds = SQS_WAIT_TIME_SECONDS \
+                                    if wait_time_seconds is None \
+                                    else wait_time_seconds
+        self.min_backoff = WORKER_MIN_BACKOFF if min_backoff is None \
+                                else min_backoff
+        self.max_backoff = WORKER_MAX_BACKOFF if max_backoff is None \
+                                else max_backoff
+        self.max_stage_latency = max_stage_latency or WORKER_MAX_STAGE_LATENCY
+        self.last_decrease = 0
+        self.logger = logging.getLogger(logger_name)
+        self.pool = ThreadPool(self.concurrency)
+        self.lock = threading.Condition()
+        self.stopped = threading.Event()
+        self.in_flight = {}
+        self.to_delete = []
+        self.processed_count = 0
+        self.failed_count = 0
+        metrics.REGISTRY.set_gauge('worker.capacity', self.capacity)
+        metrics.REGISTRY.set_gauge('worker.in_flight', 0)
+        self.heartbeat = threading.Thread(target=self.monitor)
+        self.heartbeat.daemon = True
+        self.heartbeat.start()
+
+
+    def poll_once(self):
+        """Receives up to 10 messages, at most as many as there is capacity for, and hands them to the pool
+            :Returns: [int] number of messages received
+        """
+        with self.lock:
+            while len(self.in_flight) >= self.capacity and \
+                    not self.stopped.is_set():
+                self.lock.wait(1)
+            free = self.capacity - len(self.in_flight)
+        if self.stopped.is_set():
+            return 0
+        with metrics.REGISTRY.timed('queue.receive'):
+            messages = self.queue.get_messages(
+                            num_messages=min(SQS_BATCH_SIZE, free),
+                            visibility_timeout=self.visibility_timeout,
+                            wait_time_seconds=self.wait_time_seconds)
+        released = []
+        with self.lock:
+            for message in messages:
+                if self.stopped.is_set():
+                    released.append(message)
+                else:
+                    self.in_flight[message.id] = (message, time.time())
+                    self.pool.apply_async(self.process, (message,))
+            metrics.REGISTRY.set_gauge('worker.in_flight', len(self.in_flight))
+        if released:
+            self.queue.change_message_visibility_batch(
+                [(message, 0) for message in released])
+        metrics.REGISTRY.increment('queue.received', 
+                                   len(messages) - len(released))
+        return len(messages) - len(released)
+
+
+    def process(self, message):
+        """Runs handler on one message, or submits it to pipeline, and settles it with complete; malformed messages are deleted without processing
+        """
+        try:
+            params = json.loads(message.get_body())
+        except ValueError as ve:
+            self.logger.error("Dropping malformed message " +
+                              str(message.id) + ": " + str(ve))
+            self.complete(message)
+            return
+        if self.pipeline:
+            start = time.time()
+
+            def callback(result, error):
+                metrics.REGISTRY.observe('worker.message', time.time() - start)
+                self.complete(message, error)
+
+            self.pipeline.submit(params, callback)
+            return
+        error = None
+        try:
+            with metrics.REGISTRY.timed('worker.message'):
+                self.handler(params)
+        except Exception as ex:
+            error = ex
+        self.complete(message, error)
+
+
+    def complete(self, message, error=None):
+        """Queues processed message for deletion if error is None, else leaves it for redelivery
+
+            A message whose processing raised rate_limit.RateLimitExceeded is hidden until its retry_after passes, so it is redelivered once Twitter allows
+        """
+        succeeded = error is None
+        retry_after = None
+        if isinstance(error, rate_limit.RateLimitExceeded):
+            retry_after = min(int(math.ceil(error.retry_after)), 
+                              SQS_MAX_VISIBILITY_TIMEOUT)
+            self.logger.info("Message " + str(message.id) + 
+                             " deferred: " + str(error))
+        elif error is not None:
+            self.logger.error("Message " + str(message.id) +
+                              " failed and is left for redelivery: " +
+                              type(error).__name__ + ": " + str(error),
+                              exc_info=True)
+        with self.lock:
+            self.in_flight.pop(message.id, None)
+            if succeeded:
+                self.processed_count += 1
+                self.to_delete.append(message)
+            else:
+                self.failed_count += 1
+            flush = len(self.to_delete) >= SQS_BATCH_SIZE or \
+                        not self.in_flight
+            self.adjust_capacity()
+            metrics.REGISTRY.set_gauge('worker.in_flight', len(self.in_flight))
+            self.lock.notify_all()
+        metrics.REGISTRY.increment('worker.processed' if succeeded 
+                                    else 'worker.failed')
+        if retry_after is not None:
+            metrics.REGISTRY.increment('worker.deferred')
+            self.queue.change_message_visibility_batch([(message, 
+                                                         retry_after)])
+        if flush:
+            self.flush_deletes()
+
+
+    def adjust_capacity(self):
+        """Halves capacity, at most once per max_stage_latency seconds, while a downstream stage is slower than max_stage_latency; else grows it by one up to concurrency
+            To be called holding self.lock
+        """
+        latency = max(metrics.REGISTRY.ewma(stage) 
+                        for stage in BACKPRESSURE_STAGES)
+        now = time.time()
+        if latency > self.max_stage_latency:
+            if now - self.last_decrease >= self.max_stage_latency:
+                self.capacity = max(1, self.capacity // 2)
+                self.last_decrease = now
+        elif self.capacity < self.concurrency:
+            self.capacity += 1
+        metrics.REGISTRY.set_gauge('worker.capacity', self.capacity)
+
+
+    def flush_deletes(self):
+        """Deletes processed messages from the queue in batches of 10
+        """
+        with self.lock:
+            messages, self.to_delete = self.to_delete, []
+        for start in range(0, len(messages), SQS_BATCH_SIZE):
+            self.queue.delete_message_batch(
+                messages[start:start + SQS_BATCH_SIZE])
+
+
+    def extend_visibility(self):
+        """Extends visibility timeout of messages in process for more than half of it
+        """
+        now = time.time()
+        with self.lock:
+            slow = [message for message, received_at in
+                        self.in_flight.values()
+                    if now - received_at > self.visibility_timeout / 2.0]
+            for message in slow:
+                self.in_flight[message.id] = (message, now)
+        for start in range(0, len(slow), SQS_BATCH_SIZE):
+            self.queue.change_message_visibility_batch(
+                [(message, self.visibility_timeout)
+                    for message in slow[start:start + SQS_BATCH_SIZE]])
+
+
+    def monitor(self):
+        """Runs in background: extends visibility of slow messages, and records queue depth, reports pipeline and logs metrics every QUEUE_DEPTH_INTERVAL seconds
+        """
+        last_report = 0
+        tick = max(min(self.visibility_timeout / 4.0, QUEUE_DEPTH_INTERVAL), 
+                   0.01)
+        while not self.stopped.wait(tick):
+            self.extend_visibility()
+            if time.time() - last_report >= QUEUE_DEPTH_INTERVAL:
+                last_report = time.time()
+                try:
+                    metrics.REGISTRY.set_gauge('queue.depth', 
+                                               self.queue.count())
+                except Exception as ex:
+                    self.logger.warning("Queue depth unavailable: " + str(ex))
+                if self.pipeline:
+                    self.logger.info("pipeline: " + 
+                                     json.dumps(self.pipeline.report()))
+                self.logger.info("metrics: " + 
+                                 json.dumps(metrics.REGISTRY.snapshot()))
+
+
+    def run(self):
+        """Consumes the queue until stop is called
+
+            Polls again right away after a poll that received messages; after consecutive polls that received nothing, 
+            sleeps min_backoff seconds, doubling up to max_backoff
+        """
+        backoff = 0
+        while not self.stopped.is_set():
+            if self.poll_once():
+                backoff = 0
+            elif not self.stopped.is_set():
+                metrics.REGISTRY.increment('queue.empty_polls')
+                backoff = min(max(backoff * 2, self.min_backoff), 
+                              self.max_backoff)
+                metrics.REGISTRY.set_gauge('worker.backoff', backoff)
+                self.stopped.wait(backoff)
+
+
+    def stop(self):
+        """Stops polling, waits for messages in process and deletes the processed ones
+        """
+        with self.lock:
+            self.stopped.set()
+            self.lock.notify_all()
+            while self.in_flight:
+                self.lock.wait(1)
+        self.pool.close()
+        self.pool.join()
+        self.flush_deletes()
+
+
+class LocalMessage(object):
+    '''Message of LocalQueue
+    '''
+    def __init__(self, queue, body):
+        self.queue = queue
+        self.id = uuid.uuid4().hex
+        self.receipt_handle = None
+        self.body = body
+
+
+    def get_body(self):
+        return self.body
+
+
+    def change_visibility(self, visibility_timeout):
+        return self.queue.change_message_visibility_batch(
+                    [(self, visibility_timeout)])
+
+
+class LocalQueue(object):
+    '''In-memory stand-in for a boto SQS queue, for running QueueConsumer locally and in tests
+    '''
+    def __init__(self, visibility_timeout=30):
+        self.visibility_timeout = visibility_timeout
+        self.messages = OrderedDict()
+        self.hidden_until = {}
+        self.condition = threading.Condition()
+        self.receive_requests = 0
+        self.delete_requests = 0
+        self.visibility_requests = 0
+
+
+    def new_message(self, body=''):
+        return LocalMessage(self, body)
+
+
+    def write(self, message):
+        with self.condition:
+            self.messages[message.id] = message
+            self.condition.notify_all()
+        return message
+
+
+    def get_messages(self,
+                     num_messages=1,
+                     visibility_timeout=None,
+                     wait_time_seconds=None,
+                     **kwargs):
+        deadline = time.time() + (wait_time_seconds or 0)
+        with self.condition:
+            self.receive_requests += 1
+            while True:
+                now = time.time()
+                ready = [message for message in self.messages.values()
+                            if self.hidden_until.get(message.id, 0) <= now]
+                if ready or now >= deadline:
+                    break
+                self.condition.wait(min(deadline - now, 0.05))
+            ready = ready[:num_messages]
+            for message in ready:
+                message.receipt_handle = uuid.uuid4().hex
+                self.hidden_until[message.id] = now + \
+                    (visibility_timeout or self.visibility_timeout)
+            return ready
+
+
+    def delete_message_batch(self, messages):
+        with self.condition:
+            self.delete_requests += 1
+            for message in messages:
+                self.messages.pop(message.id, None)
+                self.hidden_until.pop(message.id, None)
+        return True
+
+
+    def change_message_visibility_batch(self, messages):
+        with self.condition:
+            self.visibility_requests += 1
+            for message, visibility_timeout in messages:
+                if message.id in self.messages:
+                    self.hidden_until[message.id] = time.time() + \
+                                                        visibility_timeout
+        return True
+
+
+    def count(self):
+        """:Returns: number of messages available for receiving
+        """
+        now = time.time()
+        with self.condition:
+            return len([message_id for message_id in self.messages
+                            if self.hidden_until.get(message_id, 0) <= now])
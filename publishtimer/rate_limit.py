@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:30:44 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import os
+import time
+import threading
+from publishtimer import metrics
+
+
+WINDOW_SECONDS = 15 * 60
+TIMELINE_ENDPOINT = 'statuses/user_timeline'
+FOLLOWER_IDS_ENDPOINT = 'followers/ids'
+ENDPOINT_LIMITS = {TIMELINE_ENDPOINT: 180, FOLLOWER_IDS_ENDPOINT: 15}
+DEFAULT_LIMIT = 15
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT',
+                                           WINDOW_SECONDS + 60))
+
+
+class RateLimitExceeded(Exception):
+    """Exception to be raised when a request may not be sent now without exceeding the rate limit of its credential and endpoint.
+        retry_after: seconds after which capacity is expected
+    """
+    def __init__(self, key, retry_after):
+        self.key = key
+        self.retry_after = retry_after
+        super(RateLimitExceeded, self).__init__(
+            "Rate limit of " + str(key[1]) + " reached for " + str(key[0]) +
+            "; retry after " + str(round(retry_after, 1)) + " seconds")
+
+
+class TokenBucket(object):
+    '''Token bucket of one (credential, endpoint): capacity requests per window seconds, refilled continuously
+
+        Synced with Twitter's view from x-rate-limit-remaining / x-rate-limit-reset headers of each response:
+        when no requests remain, no token is handed out until the window resets.
+        Not thread-safe by itself; RateLimiter guards it.
+    '''
+    def __init__(self, capacity, window=WINDOW_SECONDS):
+        self.capacity = float(capacity)
+        self.window = float(window)
+        self.tokens = float(capacity)
+        self.updated_at = time.time()
+        self.blocked_until = 0
+
+
+    def refill(self, now):
+        """Adds tokens accrued since last refill, up to capacity
+        """
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated_at) * self.capacity / self.window)
+        self.updated_at = now
+
+
+    def take(self, now=None):
+        """Takes a token if available
+            :Returns: [float] 0 if taken, else seconds until one is expected
+        """
+        now = now or time.time()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.blocked_until:
+            self.blocked_until = 0
+            self.tokens = self.capacity
+            self.updated_at = now
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) * self.window / self.capacity
+
+
+    def sync(self, remaining, reset, now=None):
+        """Adopts remaining requests and epoch of window reset reported by Twitter
+        """
+        now = now or time.time()
+        self.refill(now)
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+            if remaining <= 0 and reset:
+                self.blocked_until = max(self.blocked_until, float(reset))
+
+
+    def block(self, until):
+        """Hands out no token before epoch until, e.g. after Twitter answered 429
+        """
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, until)
+
+
+    def state(self, now=None):
+        """Returns {'tokens', 'capacity', 'retry_after'} of this bucket
+        """
+        now = now or time.time()
+        tokens = min(self.capacity, self.tokens +
+                     (now - self.updated_at) * self.capacity / self.window)
+        if now < self.blocked_until:
+            retry_after = self.blocked_until - now
+            tokens = 0
+        elif self.blocked_until:
+            retry_after = 0
+            tokens = self.capacity
+        else:
+            retry_after = 0 if tokens >= 1 else \
+                            (1 - tokens) * self.window / self.capacity
+        return {'tokens': round(tokens, 2),
+                'capacity': self.capacity,
+                'retry_after': round(retry_after, 2)}
+
+
+
+class RateLimiter(object):
+    '''Thread-safe registry of token buckets keyed by (credential, endpoint), shared by all TwitterUser objects of the process
+    '''
+    def __init__(self, limits=None, window=WINDOW_SECONDS):
+        self.limits = limits or ENDPOINT_LIMITS
+        self.window = window
+        self.condition = threading.Condition()
+        self.buckets = {}
+
+
+    def bucket(self, key):
+        """Returns bucket of given key, creating it full; to be called holding self.condition
+        """
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(self.limits.get(key[1],
+                                                            DEFAULT_LIMIT),
+                                            self.window)
+        return self.buckets[key]
+
+
+    def acquire(self, credential, endpoint, block=True, max_wait=None):
+        """Takes capacity for one request of credential to endpoint
+
+            :param block: [bool] when True, waits for capacity unless expected later than max_wait seconds;
+                when False, never waits. Raises RateLimitExceeded with retry_after if not waiting
+            :param max_wait: [float] :default: environment variable RATE_LIMIT_MAX_WAIT or window + 60 seconds
+        """
+        key = (credential, endpoint)
+        max_wait = RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        with self.condition:
+            while True:
+                wait = self.bucket(key).take()
+                if not wait:
+                    return
+                if not block or wait > max_wait:
+                    metrics.REGISTRY.increment('rate_limit.rejected')
+                    raise RateLimitExceeded(key, wait)
+                metrics.REGISTRY.increment('rate_limit.waits')
+                self.condition.wait(wait)
+
+
+    def update(self, credential, endpoint, headers):
+        """Syncs bucket of credential and endpoint with x-rate-limit-remaining and x-rate-limit-reset of given response headers
+        """
+        if not headers:
+            return
+        remaining = headers.get('x-rate-limit-remaining')
+        reset = headers.get('x-rate-limit-reset')
+        with self.condition:
+            self.bucket((credential, endpoint)).sync(
+                None if remaining is None else int(remaining),
+                None if reset is None else float(reset))
+
+
+    def penalize(self, credential, endpoint, retry_after=None):
+        """Blocks credential and endpoint after Twitter rejected a request as rate limited
+
+            :param retry_after: [int/str] epoch of window reset from x-rate-limit-reset :default: a window from now
+        """
+        try:
+            until = float(retry_after)
+        except (TypeError, ValueError):
+            until = 0
+        if until < time.time():
+            until = time.time() + self.window
+        with self.condition:
+            self.bucket((credential, endpoint)).block(until)
+        metrics.REGISTRY.increment('rate_limit.exceeded')
+
+
+    def snapshot(self):
+        """Returns state of each bucket for monitoring: {'<credential> <endpoint>': {'tokens', 'capacity', 'retry_after'}}
+        """
+        now = time.time()
+        with self.condition:
+            return dict((str(key[0]) + ' ' + key[1], bucket.state(now))
+                        for key, bucket in self.buckets.items())
+
+
+
+LIMITER = RateLimiter()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:12:51 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import os
+import json
+import copy
+import errno
+import threading
+from collections import OrderedDict
+from publishtimer import metrics
+
+
+SCHEDULE_CACHE_BACKEND = os.environ.get('SCHEDULE_CACHE_BACKEND', 'memory')
+SCHEDULE_CACHE_SIZE = int(os.environ.get('SCHEDULE_CACHE_SIZE', 10000))
+SCHEDULE_CACHE_DIR = os.environ.get('SCHEDULE_CACHE_DIR',
+                                    os.path.join('cache', 'schedules'))
+
+STORE = None
+STORE_LOCK = threading.Lock()
+
+
+class MemoryStore(object):
+    '''In-process store of cache entries evicting the least recently used beyond maxsize
+
+        Evictions are counted in metrics.REGISTRY as <name>.evictions
+    '''
+    def __init__(self, maxsize=None, name='schedule_cache'):
+        self.maxsize = maxsize or SCHEDULE_CACHE_SIZE
+        self.name = name
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+
+    def get(self, key):
+        """Returns copy of entry stored for key, None if absent
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            self.entries[key] = entry
+            return copy.deepcopy(entry)
+
+
+    def set(self, key, entry):
+        """Stores copy of entry for key, evicting least recently used entries beyond maxsize
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = copy.deepcopy(entry)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                metrics.REGISTRY.increment(self.name + '.evictions')
+
+
+    def delete(self, key):
+        """Removes entry of key if stored
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+    def size(self):
+        """Returns number of entries stored
+        """
+        return len(self.entries)
+
+
+
+class DiskStore(object):
+    '''Store of cache entries as one JSON file per key in a directory, surviving restarts and shared by processes on the host
+
+        Reading an entry touches its file, so that eviction beyond maxsize removes the least recently used files
+    '''
+    def __init__(self, directory=None, maxsize=None, name='schedule_cache'):
+        self.directory = directory or SCHEDULE_CACHE_DIR
+        self.maxsize = maxsize or SCHEDULE_CACHE_SIZE
+        self.name = name
+        self.lock = threading.Lock()
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+
+    def path(self, key):
+        """Returns path of the file storing entry of key
+        """
+        return os.path.join(self.directory,
+                            ''.join(c if c.isalnum() or c in '-_.' else '_'
+                                    for c in key) + '.json')
+
+
+    def get(self, key):
+        """Returns entry stored for key, None if absent or unreadable
+        """
+        path = self.path(key)
+        try:
+            with open(path) as fp:
+                entry = json.load(fp)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return entry
+
+
+    def set(self, key, entry):
+        """Writes entry for key atomically, evicting least recently used files beyond maxsize
+        """
+        path = self.path(key)
+        temp_path = path + '.' + str(os.getpid()) + '.' + \
+                        str(threading.current_thread().ident) + '.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump(entry, fp)
+        os.rename(temp_path, path)
+        with self.lock:
+            files = [os.path.join(self.directory, name)
+                        for name in os.listdir(self.directory)
+                        if name.endswith('.json')]
+            if len(files) <= self.maxsize:
+                return
+            files.sort(key=lambda f: os.stat(f).st_mtime)
+            for stale in files[:len(files) - self.maxsize]:
+                self.remove(stale)
+                metrics.REGISTRY.increment(self.name + '.evictions')
+
+
+    def remove(self, path):
+        """Removes file at path, ignoring if already removed
+        """
+        try:
+            os.remove(path)
+        except OSError as oe:
+            if oe.errno != errno.ENOENT:
+                raise
+
+
+    def delete(self, key):
+        """Removes entry of key if stored
+        """
+        self.remove(self.path(key))
+
+
+    def size(self):
+        """Returns number of entries stored
+        """
+        return len([name for name in os.listdir(self.directory)
+                        if name.endswith('.json')])
+
+
+
+def create_store(backend=None):
+    """Returns a new store for given backend name: 'memory' (MemoryStore), 'disk' (DiskStore) or 'none' (None, disabling the cache)
+        :param backend: :default: environment variable SCHEDULE_CACHE_BACKEND or 'memory'
+    """
+    backend = backend or SCHEDULE_CACHE_BACKEND
+    if backend == 'memory':
+        return MemoryStore()
+    if backend == 'disk':
+        return DiskStore()
+    if backend == 'none':
+        return None
+    raise ValueError("Unknown SCHEDULE_CACHE_BACKEND: " + str(backend))
+
+
+def get_store():
+    """Returns the singleton store of computed schedules, creating it on first call
+    """
+    global STORE
+    with STORE_LOCK:
+        if STORE is None:
+            STORE = create_store()
+        return STORE
+
+
+def set_store(store):
+    """Replaces the singleton store, e.g. with a DiskStore of another directory; None reverts to SCHEDULE_CACHE_BACKEND on next use
+    """
+    global STORE
+    with STORE_LOCK:
+        STORE = store
+
+
+def cache_key(authUid, max_tweets):
+    """Returns key of the schedule of authUid computed from max_tweets most recent tweets
+    """
+    return unicode(authUid) + u'-' + unicode(max_tweets or 0)
+
+
+def get_schedule(authUid, max_tweets, watermark):
+    """Returns copy of schedule cached for authUid and max_tweets if it was computed from data with given watermark, else None
+
+        Counts schedule_cache.hits, schedule_cache.misses and schedule_cache.stale (cached, but data changed since) in metrics.REGISTRY
+    """
+    store = get_store()
+    entry = store.get(cache_key(authUid, max_tweets)) if store else None
+    if entry is None:
+        metrics.REGISTRY.increment('schedule_cache.misses')
+        return None
+    if entry['watermark'] != watermark:
+        metrics.REGISTRY.increment('schedule_cache.stale')
+        metrics.REGISTRY.increment('schedule_cache.misses')
+        return None
+    metrics.REGISTRY.increment('schedule_cache.hits')
+    return entry['schedule']
+
+
+def put_schedule(authUid, max_tweets, watermark, schedule):
+    """Caches schedule of authUid and max_tweets computed from data with given watermark
+    """
+    store = get_store()
+    if store:
+        store.set(cache_key(authUid, max_tweets),
+                  {'watermark': watermark, 'schedule': schedule})
+        metrics.REGISTRY.set_gauge('schedule_cache.size', store.size())
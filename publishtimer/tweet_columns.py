@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:14:26 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import array
+from publishtimer import helpers
+
+
+np = helpers.LazyModule('numpy')
+pd = helpers.LazyModule('pandas')
+
+
+def int64_typecode():
+    """Returns a typecode of array.array with items of 8 bytes, to hold int64 values whatever the size of C long of the platform
+
+        'q' where available (Python 3); else 'l' where C long is 8 bytes; else 'd', used only as storage of 8 bytes per item,
+        since values are always written and read through numpy as int64
+    """
+    for code in ['q', 'l', 'd']:
+        try:
+            if array.array(code).itemsize == 8:
+                return code
+        except ValueError:
+            pass
+    raise RuntimeError("No array typecode with items of 8 bytes")
+
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+INT64 = int64_typecode()
+FIELDS = [('id', INT64),
+          ('day', 'b'),
+          ('hour', 'b'),
+          ('minute', 'b'),
+          ('retweet_count', INT64),
+          ('favorite_count', INT64)]
+DTYPES = {INT64: 'int64', 'b': 'int8'}
+assert array.array(INT64).itemsize == 8 and array.array('b').itemsize == 1
+
+
+def parse_times(created_at):
+    """Parses created_at values of many tweets at once into (valid, day, hour, minute) numpy arrays
+
+        Strings are parsed with pd.to_datetime in format TIME_FORMAT, as UTC: ISO 8601 strings from ES and str(datetime)
+        take its fast path, as do datetime objects; numbers are taken as epoch milliseconds.
+        day, hour and minute are then derived arithmetically from minutes since epoch, which began on a Thursday (weekday 3).
+        valid is False for values which could not be parsed, whose day, hour and minute are undefined
+    """
+    if len(created_at) and isinstance(created_at[0], (int, long, float)):
+        times = pd.to_datetime(created_at, unit='ms', utc=True)
+    else:
+        times = pd.to_datetime(created_at, format=TIME_FORMAT, 
+                               errors='coerce', utc=True)
+    nanoseconds = np.asarray(times.asi8)
+    valid = nanoseconds != np.iinfo(np.int64).min
+    minutes = nanoseconds // (60 * 10**9)
+    return valid, (minutes // 1440 + 3) % 7, (minutes // 60) % 24, \
+            minutes % 60
+
+
+def as_columns(data):
+    """Returns given data as TweetColumns: as it is if already, else filled from the list of data_points
+    """
+    if isinstance(data, TweetColumns):
+        return data
+    return TweetColumns.from_data(data)
+
+
+class TweetColumns(object):
+    '''Compact columnar container of tweets of one user for the scheduling path, in order of arrival (most recent first from ES)
+
+        Holds one typed array.array per field of FIELDS - id, day, hour, minute, retweet_count, favorite_count - taking
+        27 bytes per tweet, instead of a dict of Python objects per tweet. Filled page by page from data_points,
+        so that no more than one page of dicts is alive at a time, and read as numpy arrays or a DataFrame for compute_times.
+    '''
+    def __init__(self):
+        self.arrays = dict((name, array.array(code)) for name, code in FIELDS)
+
+
+    @classmethod
+    def from_data(cls, data):
+        """Returns TweetColumns of given data_points - dicts with id, created_at, retweet_count and favorite_count
+        """
+        columns = cls()
+        columns.extend_data(data)
+        return columns
+
+
+    def __len__(self):
+        return len(self.arrays['id'])
+
+
+    def extend(self, **values):
+        """Appends tweets given as one sequence per field of FIELDS, e.g. numpy arrays
+        """
+        for name, code in FIELDS:
+            self.arrays[name].fromstring(
+                np.asarray(values[name], dtype=DTYPES[code]).tostring())
+
+
+    def extend_data(self, data):
+        """Appends given data_points, parsing their created_at at once with parse_times; those without a valid created_at are skipped
+
+            Missing retweet_count and favorite_count are taken as 0
+        """
+        if not data:
+            return
+        valid, day, hour, minute = parse_times([d.get('created_at')
+                                                for d in data])
+        values = {'id': [d['id'] for d in data],
+                  'day': day,
+                  'hour': hour,
+                  'minute': minute,
+                  'retweet_count': [d.get('retweet_count') or 0
+                                    for d in data],
+                  'favorite_count': [d.get('favorite_count') or 0
+                                     for d in data]}
+        if not valid.all():
+            values = dict((name, np.asarray(column)[valid])
+                          for name, column in values.items())
+        self.extend(**values)
+
+
+    def column(self, name):
+        """Returns copy of column of given field as numpy array
+        """
+        code = dict(FIELDS)[name]
+        return np.frombuffer(self.arrays[name], dtype=DTYPES[code]).copy() \
+                if len(self) else np.empty(0, dtype=DTYPES[code])
+
+
+    def newest_id(self):
+        """Returns id of first tweet, the most recent one of columns filled from ES; None if empty
+        """
+        return int(np.frombuffer(self.arrays['id'], dtype='int64')[0]) \
+                if len(self) else None
+
+
+    def merge(self, newer, max_tweets=None):
+        """Returns new TweetColumns of tweets of newer (TweetColumns), most recent first, followed by these; as merge_data of core
+
+            Drops repeated tweet ids and keeps the max_tweets first tweets if max_tweets given
+        """
+        ids = self.column('id')
+        newer_ids = newer.column('id')
+        order = np.argsort(-newer_ids, kind='mergesort')
+        order = order[~np.in1d(newer_ids[order], ids)]
+        if len(order):
+            first = np.r_[True, newer_ids[order][1:] !=
+                                newer_ids[order][:-1]]
+            order = order[first]
+        merged = TweetColumns()
+        merged.extend(**dict((name, newer.column(name)[order])
+                             for name, _ in FIELDS))
+        merged.extend(**dict((name, self.column(name)) for name, _ in FIELDS))
+        if max_tweets and len(merged) > max_tweets:
+            for name, _ in FIELDS:
+                del merged.arrays[name][max_tweets:]
+        return merged
+
+
+    def pack(self):
+        """Returns the arrays as {<field>: <str of their machine values>}, to ship to another process in nbytes bytes plus pickling overhead
+        """
+        return dict((name, a.tostring()) for name, a in self.arrays.items())
+
+
+    @classmethod
+    def unpack(cls, packed):
+        """Returns TweetColumns of arrays packed with pack
+        """
+        columns = cls()
+        for name, _ in FIELDS:
+            columns.arrays[name].fromstring(packed[name])
+        return columns
+
+
+    def nbytes(self):
+        """Returns number of bytes taken by the arrays
+        """
+        return sum(a.itemsize * len(a) for a in self.arrays.values())
+
+
+    def to_data_frame(self):
+        """Returns pandas DataFrame of these tweets in the form of make_data_frame of core: day, engagement, favorite_count, hour, id, minute, retweet_count
+        """
+        if not len(self):
+            return pd.DataFrame([])
+        columns = dict((name, self.column(name)) for name, _ in FIELDS)
+        columns['engagement'] = columns['retweet_count'] + \
+                                    columns['favorite_count'] * 100
+        return pd.DataFrame(columns)
@@ -5,33 +5,64 @@ Created on Tue Mar 29 13:20:37 2016
 @author: Parag Guruji, paragguruji@gmail.com
 """
 
-import requests
 import os
-import logging
+import copy
 import time
-import datetime
-from publishtimer import helpers, elasticsearch_util as es
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+from publishtimer import helpers, http_util, metrics, rate_limit, elasticsearch_util as es
+from requests_oauthlib import OAuth1
 from twython import Twython, TwythonError, TwythonAuthError, TwythonRateLimitError
 
 
-SESSION_DURATION_MINUTES = 15
-SESSION_TIMELINE_REQUEST_LIMIT = 180
-SESSION_FOLLOWER_IDS_REQUEST_LIMIT = 15
 RETRY_LIMIT = 3
+FOLLOWER_CRAWL_WORKERS = int(os.environ.get('FOLLOWER_CRAWL_WORKERS', 4))
+TIMELINE_FETCH_WORKERS = int(os.environ.get('TIMELINE_FETCH_WORKERS', 8))
+TWITTER_API_URL = os.environ.get('TWITTER_API_URL', 
+                                 'https://api.twitter.com/1.1')
+PURGED_KEYS = frozenset(['media', 'urls', 'url'])
+TWEET_PROJECTION = {'id': True, 
+                    'created_at': True, 
+                    'retweet_count': True, 
+                    'favorite_count': True, 
+                    'user': {'id': True}}
 
 
-def get_credentials(authUid):
-    """Returns access_token and access_token_secret for given authUid in JSON format by invoking Crowdfire's internal access_details API
-        Raises ValueError if credentials for given authUid not available with Crowdfire
+CREDENTIALS_CACHE_TTL = int(os.environ.get('CREDENTIALS_CACHE_TTL', 900))
+CREDENTIALS_CACHE_SIZE = int(os.environ.get('CREDENTIALS_CACHE_SIZE', 1024))
+
+CREDENTIALS_CACHE = helpers.TTLCache(maxsize=CREDENTIALS_CACHE_SIZE, 
+                                     ttl=CREDENTIALS_CACHE_TTL)
+TWYTHON_CACHE = helpers.TTLCache(maxsize=CREDENTIALS_CACHE_SIZE, 
+                                 ttl=CREDENTIALS_CACHE_TTL)
+
+
+def credentials_key(authUid):
+    """Returns authUid in the form used by Crowdfire's access_details API: string ending with '-tw'
     """
     if not isinstance(authUid, str):
         authUid = str(authUid)
     if not authUid.endswith('-tw'):
         authUid = authUid+'-tw'
-    response = requests.get(url=os.environ.get('ACCESS_DETAILS_URL', ''), 
-                       params={'api_key': os.environ.get('API_KEY', ''), 
-                               'service': os.environ.get('SERVICE', ''), 
-                               'authUid': authUid})
+    return authUid
+
+
+def get_credentials(authUid, use_cache=True):
+    """Returns access_token and access_token_secret for given authUid in JSON format by invoking Crowdfire's internal access_details API
+        Raises ValueError if credentials for given authUid not available with Crowdfire
+
+        Decrypted credentials are cached in CREDENTIALS_CACHE for CREDENTIALS_CACHE_TTL seconds unless use_cache is False
+    """
+    authUid = credentials_key(authUid)
+    if use_cache:
+        cached = CREDENTIALS_CACHE.get(authUid)
+        if cached is not None:
+            return dict(cached)
+    response = http_util.get(os.environ.get('ACCESS_DETAILS_URL', ''), 
+                             params={'api_key': os.environ.get('API_KEY', ''), 
+                                     'service': os.environ.get('SERVICE', ''), 
+                                     'authUid': authUid})
     json_response = response.json()
     if json_response.get('code', 0) == 604:
         raise ValueError("No credentials retrieved for authUid " + \
@@ -41,23 +72,139 @@ def get_credentials(authUid):
          'oauth_token_secret': helpers.decrypt(json_response.get('access_secret', None)),
          'app_key': os.environ.get('TWITTER_APP_KEY', ''),
          'app_secret': os.environ.get('TWITTER_APP_SECRET', '')}
+    CREDENTIALS_CACHE.set(authUid, dict(d))
     return d
     
     
-def make_twython(authUid):
+def make_twython(authUid, use_cache=True):
     """Makes a twython object with given authUid as authenticating user
         Raises ValueError if credentials for given authUid not available with Crowdfire
+
+        Twython objects are cached in TWYTHON_CACHE like credentials unless use_cache is False
+    """
+    key = credentials_key(authUid)
+    if use_cache:
+        twitter_handle = TWYTHON_CACHE.get(key)
+        if twitter_handle is not None:
+            return twitter_handle
+    twitter_handle = Twython(**get_credentials(authUid, use_cache))
+    TWYTHON_CACHE.set(key, twitter_handle)
+    return twitter_handle
+
+
+def make_oauth(authUid):
+    """Returns OAuth1 signer of requests made on behalf of authUid, from its cached credentials
+        Raises ValueError if credentials for given authUid not available with Crowdfire
+    """
+    credentials = get_credentials(authUid)
+    return OAuth1(credentials['app_key'], 
+                  client_secret=credentials['app_secret'], 
+                  resource_owner_key=credentials['oauth_token'], 
+                  resource_owner_secret=credentials['oauth_token_secret'])
+
+
+def invalidate_credentials(authUid):
+    """Drops cached credentials and Twython object of given authUid, e.g. when Twitter rejects them
+    """
+    key = credentials_key(authUid)
+    CREDENTIALS_CACHE.invalidate(key)
+    TWYTHON_CACHE.invalidate(key)
+
+
+def get_cache_stats():
+    """Returns hit, miss, eviction counts and size of credentials and Twython caches
+    """
+    return {'credentials': CREDENTIALS_CACHE.stats(), 
+            'twython': TWYTHON_CACHE.stats()}
+
+
+def rate_limit_headers(twitter_handle):
+    """Returns x-rate-limit-remaining and x-rate-limit-reset headers of the last call made with twitter_handle, None if unavailable
+    """
+    try:
+        return {header: twitter_handle.get_lastfunction_header(header)
+                for header in ['x-rate-limit-remaining', 
+                               'x-rate-limit-reset']}
+    except (TwythonError, AttributeError):
+        return None
+
+
+def project(a_dict, projection):
+    """Returns new dict of the fields of a_dict named in projection: True keeps a field as it is, a nested projection projects a nested dict
     """
-    return Twython(**get_credentials(authUid))
+    ret = {}
+    for key, spec in projection.items():
+        if key in a_dict:
+            value = a_dict[key]
+            if spec is not True and isinstance(value, dict):
+                value = project(value, spec)
+            ret[key] = value
+    return ret
+
+
+def normalize_tweet(tweet, projection=TWEET_PROJECTION):
+    """Returns tweet object from Twitter API in the form scheduled and saved to ES: created_at parsed once into datetime (None if absent)
+
+        :param projection: [dict] fields kept, as by project :default: TWEET_PROJECTION - id, created_at, retweet_count, favorite_count and user.id;
+            None keeps all fields but PURGED_KEYS, removed from all nested levels in one traversal
+    """
+    if projection is None:
+        tweet = helpers.purge_keys_deep(tweet, PURGED_KEYS)
+    else:
+        tweet = project(tweet, projection)
+    created_at = tweet.get('created_at')
+    if not created_at:
+        tweet['created_at'] = None
+    elif isinstance(created_at, basestring):
+        tweet['created_at'] = helpers.parse_twitter_time(created_at)
+    return tweet
+
+
+def normalize_tweets(tweets, projection=TWEET_PROJECTION):
+    """Generator stage yielding normalize_tweet of each of given tweets as they are consumed
+    """
+    for tweet in tweets:
+        yield normalize_tweet(tweet, projection)
+
+
+def load_checkpoint(path):
+    """Returns set of follower ids recorded as crawled in checkpoint file at path, empty if path is None or absent
+
+        Checkpoint: one follower id per line, appended as each follower's timeline is fetched; an unterminated last line is ignored
+    """
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as fp:
+        lines = fp.read().split('\n')[:-1]
+    return set(long(line) for line in lines if line.strip().isdigit())
+
+
+def open_checkpoint(path):
+    """Opens checkpoint file at path for appending, dropping a last line left unterminated by an interrupted crawl
+    """
+    fp = open(path, 'a+')
+    fp.seek(0)
+    content = fp.read()
+    if content and not content.endswith('\n'):
+        fp.truncate(content.rfind('\n') + 1)
+    fp.seek(0, os.SEEK_END)
+    return fp
 
 
 class TwitterUser:
     '''Class to fetch data of one twitter user
+
+        Requests are paced by rate_limit.LIMITER, shared by all TwitterUser objects, per credential (authUid) and endpoint
     '''
     def __init__(self, logger_name="TwitterUserLogger",
-                 log_filename="TwitterUser.log"):
+                 log_filename="TwitterUser.log", block=True):
         """Create a TwitterHandle for given oauth_token and oauth_token_secret
+
+            :param block: [bool] when True, a request waits for rate limit capacity of its credential and endpoint;
+                when False, rate_limit.RateLimitExceeded is raised with retry_after instead so that the caller can requeue the work
+                :default: True
         """
+        self.block = block
         #Set up logger
         self.log_dir = os.path.join(os.getcwd(), 'logs')
         if not os.path.exists(self.log_dir):
@@ -75,19 +222,9 @@ class TwitterUser:
         # Start logging       
         self.logger.info("\n\nTwitterUser Logs .........\n")
         
-        # Set up timeline request session
-        self.timeline_session_start_time = datetime.datetime.now()
-        self.timeline_session_end_time = self.timeline_session_start_time + \
-            datetime.timedelta(minutes=SESSION_DURATION_MINUTES)
-        self.timeline_request_count = 0
-        
-        # Set up follower_ids request session
-        self.follower_ids_session_start_time = datetime.datetime.now()
-        self.follower_ids_session_end_time = \
-            self.follower_ids_session_start_time + \
-            datetime.timedelta(minutes=SESSION_DURATION_MINUTES)        
-        self.follower_ids_request_count = 0
-        
+        # Set up bulk writer saving fetched tweets to ES
+        self.bulk_writer = es.BulkWriter(callback=self.log_bulk_flush)
+
         # Set up counts for logging purpose       
         self.tweet_per_follower_count = 0
         self.timeline_request_record = 0
@@ -111,10 +248,13 @@ class TwitterUser:
                 :default: False
             :param include_rts: [boolean] Twitter API include_rts option
                 :default: True
-            :param since_id: [long] Twitter API since_id option. give priority to max_id
+            :param since_id: [long] Twitter API since_id option. only tweets newer than it are fetched
                 :default: None
-            :param max_id: [long] Twitter API max_id option. has priority over since_id
+            :param max_id: [long] Twitter API max_id option. only tweets not newer than it are fetched; combines with since_id to page through the tweets newer than since_id
                 :default: None
+
+            Waits for rate limit capacity of authUid, or raises rate_limit.RateLimitExceeded if this TwitterUser does not block.
+            When Twitter rejects the request as rate limited, retries once its window resets.
         """
         twitter_handle  = kwargs.get('twitter_handle', None)
         if not twitter_handle:
@@ -127,79 +267,47 @@ class TwitterUser:
         since_id        = kwargs.get('since_id', None)
         max_id          = kwargs.get('max_id', None)
         
-        if datetime.datetime.now() >= self.timeline_session_end_time:
-                self.timeline_session_start_time  = datetime.datetime.now()
-                self.timeline_session_end_time = \
-                    self.timeline_session_start_time + \
-                    datetime.timedelta(minutes=SESSION_DURATION_MINUTES)
-                self.timeline_request_count = 0
-        elif self.timeline_request_count >= SESSION_TIMELINE_REQUEST_LIMIT:
-            sleep_time = (self.timeline_session_end_time - \
-                            datetime.datetime.now()).total_seconds() + 60                
-            self.logger.info("Sleeping in fetch_timeline for " + \
-                                    str(sleep_time) + " seconds" + \
-                                    "\n\tsession_timeline_reqs: " + \
-                                    str(self.timeline_request_count) + \
-                                    "\n\ttotal_timeline_reqs: " + \
-                                    str(self.timeline_request_record) + \
-                                    "\n\tsession_follower_ids_reqs: " + \
-                                    str(self.follower_ids_request_count) + \
-                                    "\n\ttotal_follower_ids_reqs: " + \
-                                    str(self.follower_ids_request_record) )
-            time.sleep(sleep_time)
-            return self.fetch_timeline(authUid, **kwargs)
-        self.timeline_request_count += 1
+        credential = credentials_key(authUid)
+        rate_limit.LIMITER.acquire(credential, 
+                                   rate_limit.TIMELINE_ENDPOINT, 
+                                   block=self.block)
         self.timeline_request_record += 1
         status_word = 'SUCCESS'
         try:
+            params = {'user_id': user_id,
+                      'count': count,
+                      'trim_user': trim_user,
+                      'exclude_replies': exclude_replies,
+                      'include_rts': include_rts}
             if max_id:
-                tweet_list= twitter_handle.get_user_timeline(
-                                user_id=user_id,
-                                count=count,
-                                trim_user=trim_user,
-                                exclude_replies=exclude_replies,
-                                include_rts=include_rts,
-                                max_id=max_id)
-            elif since_id:
-                tweet_list= twitter_handle.get_user_timeline(
-                                user_id=user_id,
-                                count=count,
-                                trim_user=trim_user,
-                                exclude_replies=exclude_replies,
-                                include_rts=include_rts,
-                                since_id=since_id)
-            else:
-                tweet_list= twitter_handle.get_user_timeline(
-                                user_id=user_id,
-                                count=count,
-                                trim_user=trim_user,
-                                exclude_replies=exclude_replies,
-                                include_rts=include_rts)
+                params['max_id'] = max_id
+            if since_id:
+                params['since_id'] = since_id
+            tweet_list= twitter_handle.get_user_timeline(**params)
+            rate_limit.LIMITER.update(credential, 
+                                      rate_limit.TIMELINE_ENDPOINT, 
+                                      rate_limit_headers(twitter_handle))
         except TwythonAuthError as tae:
             self.logger.warning(tae.message + str(kwargs),
                                 exc_info=True,
                                 extra=kwargs)
+            invalidate_credentials(authUid)
             tweet_list = []
             status_word = 'TwythonAuthError'
         except TwythonRateLimitError as trle:
             self.logger.warning(trle.message + str(kwargs), 
                                   exc_info=True, 
                                   extra=kwargs )
-            sleep_time = SESSION_DURATION_MINUTES * 60
-            self.logger.info("Unexpected Rate Limit Occured. \
-            Sleeping in fetch_timeline for " + \
-                                    str(sleep_time) + " seconds" + \
-                                    "\n\tsession_timeline_reqs: " + \
-                                    str(self.timeline_request_count) + \
-                                    "\n\ttotal_timeline_reqs: " + \
-                                    str(self.timeline_request_record) + \
-                                    "\n\tsession_follower_ids_reqs: " + \
-                                    str(self.follower_ids_request_count) + \
-                                    "\n\ttotal_follower_ids_reqs: " + \
-                                    str(self.follower_ids_request_record) )
-            time.sleep(sleep_time)
-            tweet_list = []
-            status_word = 'TwythonRateLimitError'
+            rate_limit.LIMITER.penalize(credential, 
+                                        rate_limit.TIMELINE_ENDPOINT, 
+                                        trle.retry_after)
+            self.logger.info("Unexpected Rate Limit Occured. " + \
+                             "Retrying fetch_timeline after window reset" + \
+                             "\n\ttotal_timeline_reqs: " + \
+                             str(self.timeline_request_record) + \
+                             "\n\ttotal_follower_ids_reqs: " + \
+                             str(self.follower_ids_request_record) )
+            return self.fetch_timeline(authUid, **kwargs)
         if tweet_list:
             self.logger.info(str(len(tweet_list)) + "Tweets from id:" + \
                             str(tweet_list[-1].get('id')) + " through id:" + \
@@ -207,30 +315,42 @@ class TwitterUser:
         return tweet_list, status_word
 
 
-    def fetching_stint(self, authUid, timeline, save_to_es=True, **kwargs):
-        """Mediator function to fetch max 200 tweets for given **kwargs
-            :Returns:
-            * on success: [long] tweet_id of oldest tweet from tweet_list returned by fetch_timeline.
-            * on failure: [int] -1 when empty list/None is recieved.
+    def iter_pages(self, authUid, **kwargs):
+        """Yields pages of max 200 normalized tweets of the timeline requested with options given in **kwargs, one request per page consumed
+            :param authUid: authUid of user whose timeline is to be fetched
+            :param **kwargs: Same as *def fetch_timeline(self, authUid, **kwargs)*; count is the total number of tweets
 
-            :param authUid: [long] user_id of twitter user whose timeline is to be fetched
-            :param **kwargs: Same as *def fetch_timeline(self, authUid, **kwargs)*
+            Pages are requested one by one with fetch_next_page of a TimelineFetcher, as by request_timelines
         """
-        tweet_list, status_word = self.fetch_timeline(authUid, **kwargs)
-        if tweet_list:
-            for tweet in tweet_list:
-                tweet = helpers.purge_key_deep(tweet, 'media')
-                tweet = helpers.purge_key_deep(tweet, 'urls')
-                tweet = helpers.purge_key_deep(tweet, 'url')
-                timeline.append(tweet)
-                if save_to_es:
-                    self.save_tweet(tweet)
-            return tweet_list[-1].get('id', 0)
-        elif status_word == 'TwythonAuthError':
-            return -2
-        elif status_word == 'TwythonRateLimitError':
-            return -3
-        return -1
+        fetcher = TimelineFetcher(self, workers=1)
+        state = fetcher.timeline_state(dict(kwargs, authUid=authUid))
+        while not state['done']:
+            page = fetcher.fetch_next_page(state)
+            if page:
+                yield page
+
+
+    def iter_timeline(self, authUid, save_to_es=True, prefetch=1, **kwargs):
+        '''Yields pages of the timeline of this user requested with options given in **kwargs, as they arrive
+            :param authUid: authUid of user whose timeline is to be fetched
+            :param save_to_es: Flag when set true, each page is saved in elasticsearch with one bulk request before it is yielded
+            :default: True
+            :param prefetch: [int] number of pages requested ahead in a background thread while the consumer and the ES bulk write
+                handle the current one; 0 requests each page only when the previous one is consumed :default: 1
+            :param **kwargs: Same as *def fetch_timeline(self, authUid, **kwargs)*; count is the total number of tweets
+
+            Memory is bounded by prefetch + 2 pages whatever the count, as long as the consumer does not keep the pages.
+            Raises ValueError if credentials for given authUid not available with Crowdfire
+        '''
+        pages = self.iter_pages(authUid, **kwargs)
+        if prefetch:
+            pages = helpers.prefetch(pages, prefetch)
+        for page in pages:
+            if save_to_es:
+                for tweet in page:
+                    self.buffer_tweet(tweet)
+                self.bulk_writer.flush()
+            yield page
 
 
     def request_timeline(self, authUid, save_to_es=True, **kwargs):
@@ -240,47 +360,58 @@ class TwitterUser:
             :default: True
             :param **kwargs: Same as *def fetch_timeline(self, authUid, **kwargs)*
             
+            Sync wrapper of request_timelines for one timeline, raising the exception its fetch failed with.
             Raises ValueError if credentials for given authUid not available with Crowdfire
         '''
-        kwargs['twitter_handle'] = \
-            kwargs.get('twitter_handle', make_twython(authUid))
-        count = kwargs.get('count', 200)
-        timeline = []
-        while count:
-            if count > 200:
-                kwargs['count'] = 200
-            else:
-                kwargs['count'] = count
-            max_id = self.fetching_stint(authUid, \
-                                         timeline, \
-                                         save_to_es, \
-                                         **kwargs)
-            if max_id == kwargs.get('max_id', 1):
-                return timeline
-            elif max_id == -1:
-                return timeline
-            else:
-                kwargs['max_id'] = max_id
-                if count > 200:                
-                    count -= 200
-                else:
-                    count = 0
-        return timeline
+        kwargs.pop('prefetch', None)
+        fetcher = TimelineFetcher(self, workers=1)
+        user_id = kwargs.get('user_id', authUid)
+        timelines = fetcher.fetch_timelines([dict(kwargs, authUid=authUid)], 
+                                            save_to_es=save_to_es)
+        if user_id in fetcher.failures:
+            raise fetcher.failures[user_id]
+        return timelines[user_id]
 
 
-    def save_tweet(self, tweet_dict):
-        """Saves one tweet object to ES in the index of name tweet-index-<YEAR>-<#WEEK>"""
+    def request_timelines(self, timelines, save_to_es=True, workers=None, 
+                          api_url=None):
+        """Requests timelines of many users concurrently with a TimelineFetcher, waiting for all of them
+            :Returns: [dict] {user_id: [list] tweets of its timeline}
+            :param timelines: [list] of dicts {'authUid', 'user_id' :default: authUid, 'count' :default: 200,
+                'trim_user', 'exclude_replies', 'include_rts', 'since_id', 'max_id', 'twitter_handle'} - same as *def fetch_timeline(self, authUid, **kwargs)*
+            :param save_to_es: Flag when set true, data fetched is saved in elasticsearch for future usage
+            :default: True
+            :param workers: [int] :default: environment variable TIMELINE_FETCH_WORKERS or 8
+            :param api_url: [str] :default: environment variable TWITTER_API_URL or https://api.twitter.com/1.1
+        """
+        fetcher = TimelineFetcher(self, workers=workers, api_url=api_url)
+        return fetcher.fetch_timelines(timelines, save_to_es=save_to_es)
+
+
+    def tweet_document(self, tweet_dict):
+        """Returns es.Tweet document of one tweet object for the index of name tweet-index-<YEAR>-<#WEEK>, routed by id of its user
+
+            created_at is parsed unless normalize_tweet did already
+        """
         INDEX_NAME = es.get_tweet_index()
         time_str = tweet_dict.get('created_at', '')
-        if time_str:
-            tweet_dict['created_at'] = datetime.datetime.strptime(time_str, 
-                                        "%a %b %d %H:%M:%S +0000 %Y")
-        else:
+        if not time_str:
             tweet_dict['created_at'] = None
+        elif isinstance(time_str, basestring):
+            tweet_dict['created_at'] = helpers.parse_twitter_time(time_str)
 
         tweet_dict.update({u'_id': tweet_dict.get(u'id', "00000"), 
-                           u'_index': INDEX_NAME})        
-        tweet = es.Tweet(**tweet_dict)
+                           u'_index': INDEX_NAME})
+        routing = es.get_routing(tweet_dict['user']['id'])
+        if routing is not None:
+            tweet_dict[u'_routing'] = routing
+        return es.Tweet(**tweet_dict)
+
+
+    def save_tweet(self, tweet_dict):
+        """Saves one tweet object to ES in the index of name tweet-index-<YEAR>-<#WEEK>, routed by id of its user"""
+        tweet = self.tweet_document(tweet_dict)
+        INDEX_NAME = tweet_dict[u'_index']
         res = None        
         try:
             res = tweet.save()
@@ -300,6 +431,27 @@ class TwitterUser:
                 " for user_id: " + str(tweet_dict['user']['id']) + \
                 " not saved in index: " + INDEX_NAME + \
                 " tweet_id: " + str(tweet_dict['id']))
+
+
+    def buffer_tweet(self, tweet_dict):
+        """Adds one tweet object to the buffer of self.bulk_writer, to be saved to ES with its next bulk request"""
+        self.bulk_writer.add(self.tweet_document(tweet_dict).to_action())
+
+
+    def log_bulk_flush(self, indexed_count, failures):
+        """Callback of self.bulk_writer: counts and logs the tweets saved by one bulk request and logs each failure"""
+        self.tweet_per_follower_count += indexed_count
+        self.logger.info(" Success: " + str(indexed_count) + \
+                            " tweets saved with bulk request. #tweets: " + \
+                            str(self.tweet_per_follower_count))
+        for failure in failures:
+            self.logger.error(" Failure: tweet_id: " + str(failure['_id']) + \
+                                " not saved. status: " + \
+                                str(failure['status']) + " error: " + \
+                                str(failure['error']))
+        if failures and not indexed_count:
+            print "Elasticsearch bulk request failed. Cannot save", \
+                    len(failures), "tweets"
  
 
     def list_follower_ids(self, authUid, **kwargs):
@@ -310,37 +462,21 @@ class TwitterUser:
            :param user_id: (optional) user_id of target user
            :param screen_name: (optional) screen_name of target user
            :param count: (optional) #followers to fetch ids of.
+
+           Waits for rate limit capacity of authUid between pages, or raises rate_limit.RateLimitExceeded if this TwitterUser does not block
         """
         followers_ids = []
         next_cursor = -1
+        refreshed = False
+        credential = credentials_key(authUid)
         
         while next_cursor:
-            if datetime.datetime.now() >= self.follower_ids_session_end_time:
-                self.follower_ids_session_start_time  = datetime.datetime.now()
-                self.follower_ids_session_end_time = \
-                    self.follower_ids_session_start_time + \
-                    datetime.timedelta(minutes=SESSION_DURATION_MINUTES)
-                self.follower_ids_request_count = 0
-            elif self.follower_ids_request_count >= \
-                    SESSION_FOLLOWER_IDS_REQUEST_LIMIT:
-                sleep_time = (self.follower_ids_session_end_time - \
-                                datetime.datetime.now()).total_seconds() + 60                
-                self.logger.info("Sleeping in def list_follower_ids for " + \
-                                    str(sleep_time) + " seconds" + \
-                                    "\n\tsession_timeline_reqs: " + \
-                                    str(self.timeline_request_count) + \
-                                    "\n\ttotal_timeline_reqs: " + \
-                                    str(self.timeline_request_record) + \
-                                    "\n\tsession_follower_ids_reqs: " + \
-                                    str(self.follower_ids_request_count) + \
-                                    "\n\ttotal_follower_ids_reqs: " + \
-                                    str(self.follower_ids_request_record) )
-                time.sleep(sleep_time)
-                continue
-            self.follower_ids_request_count += 1
+            rate_limit.LIMITER.acquire(credential, 
+                                       rate_limit.FOLLOWER_IDS_ENDPOINT, 
+                                       block=self.block)
             self.follower_ids_request_record += 1
             try:
-                tw  = kwargs.get('twitter_handle', make_twython(authUid))
+                tw  = kwargs.get('twitter_handle') or make_twython(authUid)
                 res_dict = tw.get_followers_ids(
                                         user_id = kwargs.get(
                                             'user_id', authUid),
@@ -349,13 +485,28 @@ class TwitterUser:
                                         stringify_ids = False,
                                         count = kwargs.get('count', 5000),
                                         cursor = next_cursor)
+                rate_limit.LIMITER.update(credential, 
+                                          rate_limit.FOLLOWER_IDS_ENDPOINT, 
+                                          rate_limit_headers(tw))
                 next_cursor = res_dict['next_cursor']
                 followers_ids += res_dict['ids']
             except TwythonRateLimitError as trle:
                 self.logger.error(trle.message + str(kwargs), 
                                   exc_info=True, 
                                   extra=kwargs)
+                rate_limit.LIMITER.penalize(credential, 
+                                            rate_limit.FOLLOWER_IDS_ENDPOINT, 
+                                            trle.retry_after)
                 continue
+            except TwythonAuthError as tae:
+                self.logger.error(tae.message + str(kwargs), 
+                                  exc_info=True, 
+                                  extra=kwargs)
+                invalidate_credentials(authUid)
+                if refreshed:
+                    break
+                refreshed = True
+                kwargs.pop('twitter_handle', None)
             except TwythonError as te:
                 self.logger.error(te.message + str(kwargs), 
                                   exc_info=True, 
@@ -364,30 +515,297 @@ class TwitterUser:
         return followers_ids
         
 
+    def crawler(self):
+        """Returns a shallow copy of this TwitterUser for one crawling thread: it shares the logger and block flag, with own bulk writer and counts
+        """
+        crawler = copy.copy(self)
+        crawler.bulk_writer = es.BulkWriter(callback=crawler.log_bulk_flush)
+        crawler.tweet_per_follower_count = 0
+        crawler.timeline_request_record = 0
+        crawler.follower_ids_request_record = 0
+        return crawler
+
+
     def fetch_follower_timelines(self, 
                                  authUid,
                                  followers_count=5000, 
-                                 tweets_count=3000):
-        """Extracts and saves to ES the tweet objects from timelines of followers of a user
+                                 tweets_count=3000, 
+                                 workers=None, 
+                                 checkpoint=None, 
+                                 save_to_es=True, 
+                                 twitter_handle=None):
+        """Extracts and saves to ES the tweet objects from timelines of followers of a user, crawling followers concurrently
+            :Returns: [dict] {'followers', 'skipped', 'completed', 'failed', 'tweets', 'seconds', 'followers_per_minute'}
             :param authUid: [long] user_id of target user
             :param followers_count: [long] #followers
             :param tweets_count: [long] #tweets to fetch per follower
+            :param workers: [int] number of threads fetching timelines :default: environment variable FOLLOWER_CRAWL_WORKERS or 4
+            :param checkpoint: [str] path of checkpoint file: followers recorded in it are skipped and each follower crawled is appended,
+                so that an interrupted crawl resumes where it stopped :default: None (no checkpoint)
+            :param save_to_es: [bool] save fetched tweets to ES :default: True
+            :param twitter_handle: [Twython] a valid authenticated Twython object :default: create handle for authUid
+            
+            All threads take capacity from rate_limit.LIMITER for the credential of authUid, so concurrency never exceeds its rate budget.
+            Each thread requests with its own shallow copy of twitter_handle, sharing its session, so that the rate limit headers
+            read after a request are those of its own last response.
+            A follower whose timeline fails is logged, counted as failed and left out of the checkpoint to be retried on resume.
         """
-        tw = make_twython(authUid)
+        tw = twitter_handle or make_twython(authUid)
         user_id_list = self.list_follower_ids(  authUid, \
                                                 **{'user_id': authUid, 
                                                    'count': followers_count,
                                                    'twitter_handle': tw})
         self.logger.info("List of " + str(len(user_id_list)) + \
                             " followers fetched for user_id: " + str(authUid))
-        for follower_id in user_id_list:    
-            self.tweet_per_follower_count = 0
-            self.request_timeline(  authUid=authUid, \
-                                    user_id=follower_id, \
-                                    count=tweets_count, \
-                                    twitter_handle=tw )
-            self.logger.info("follower #" +\
-                str(user_id_list.index(follower_id) + 1) + \
-                " timeline fetched. follower_id: " + str(follower_id) + \
-                " #tweets: " + str(self.tweet_per_follower_count))
-                
+        done = load_checkpoint(checkpoint)
+        pending = [f for f in user_id_list if f not in done]
+        progress = {'followers': len(user_id_list), 
+                    'skipped': len(user_id_list) - len(pending), 
+                    'completed': 0, 
+                    'failed': 0, 
+                    'tweets': 0}
+        lock = threading.Lock()
+        local = threading.local()
+        crawlers = []
+        checkpoint_file = open_checkpoint(checkpoint) if checkpoint else None
+        start = time.time()
+
+        def crawl(follower_id):
+            crawler = getattr(local, 'crawler', None)
+            if crawler is None:
+                crawler = local.crawler = self.crawler()
+                local.twitter_handle = copy.copy(tw)
+                with lock:
+                    crawlers.append(crawler)
+            crawler.tweet_per_follower_count = 0
+            tweets = 0
+            try:
+                for page in crawler.iter_timeline(authUid=authUid, \
+                                                  save_to_es=save_to_es, \
+                                                  user_id=follower_id, \
+                                                  count=tweets_count, \
+                                                  twitter_handle=\
+                                                    local.twitter_handle):
+                    tweets += len(page)
+                status = 'completed'
+            except Exception as ex:
+                self.logger.error("follower_id: " + str(follower_id) + \
+                                  " timeline not fetched. " + \
+                                  type(ex).__name__ + ": " + str(ex), 
+                                  exc_info=True)
+                status = 'failed'
+            with lock:
+                progress[status] += 1
+                progress['tweets'] += tweets
+                if checkpoint_file and status == 'completed':
+                    checkpoint_file.write(str(follower_id) + '\n')
+                    checkpoint_file.flush()
+                crawled = progress['completed'] + progress['failed']
+            metrics.REGISTRY.increment('followers.' + status)
+            self.logger.info("follower #" + str(crawled) + "/" + \
+                str(len(pending)) + " timeline " + status + \
+                ". follower_id: " + str(follower_id) + \
+                " #tweets: " + str(tweets))
+
+        pool = ThreadPool(workers or FOLLOWER_CRAWL_WORKERS)
+        try:
+            for _ in pool.imap_unordered(crawl, pending):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+            if checkpoint_file:
+                checkpoint_file.close()
+        for crawler in crawlers:
+            self.timeline_request_record += crawler.timeline_request_record
+        progress['seconds'] = time.time() - start
+        progress['followers_per_minute'] = \
+            60.0 * progress['completed'] / progress['seconds'] \
+            if progress['seconds'] else 0.0
+        metrics.REGISTRY.set_gauge('followers.per_minute', 
+                                   progress['followers_per_minute'])
+        self.logger.info("Follower timelines of user_id: " + str(authUid) + \
+                         " crawled: " + str(progress))
+        return progress
+
+
+
+class TimelineFetcher(object):
+    '''Class to fetch timelines of many users concurrently on behalf of their authUids
+
+        Pages of all timelines are interleaved on one bounded pool of threads: a thread fetches one page and queues the next page
+        of the same timeline behind the pages of others, so that no timeline waits for another to finish.
+        Requests are signed with OAuth1 and sent over the pooled keep-alive session of http_util, and take capacity from
+        rate_limit.LIMITER shared with all TwitterUser objects of the process; timelines given a twitter_handle are fetched with it instead.
+        All timeline fetches of TwitterUser page through fetch_next_page: request_timeline as a sync wrapper of fetch_timelines, iter_pages one page at a time.
+    '''
+    def __init__(self, user, workers=None, api_url=None):
+        """Create a fetcher logging, counting requests and saving tweets through given TwitterUser, and waiting for rate limit capacity if it blocks
+
+            :param workers: [int] number of pages fetched at a time :default: environment variable TIMELINE_FETCH_WORKERS or 8
+            :param api_url: [str] base URL of Twitter REST API :default: environment variable TWITTER_API_URL or https://api.twitter.com/1.1
+        """
+        self.user = user
+        self.logger = user.logger
+        self.workers = workers or TIMELINE_FETCH_WORKERS
+        self.api_url = (api_url or TWITTER_API_URL).rstrip('/')
+        self.lock = threading.Lock()
+        self.failures = {}
+
+
+    def fetch_page(self, authUid, params, twitter_handle=None):
+        """Fetches one page of user_timeline with given Twitter API params on behalf of authUid
+            :Returns: (tweet_list, status_word) as *def fetch_timeline(self, authUid, **kwargs)* of TwitterUser
+            :param twitter_handle: [Twython] when given, the page is fetched with it by fetch_timeline of the TwitterUser :default: None
+
+            Raises TwythonError for responses other than 200, 401 and 429.
+            Waits for rate limit capacity of authUid, or raises rate_limit.RateLimitExceeded if the TwitterUser does not block.
+            When Twitter rejects the request as rate limited, retries once its window resets.
+        """
+        if twitter_handle:
+            return self.user.fetch_timeline(authUid, 
+                                            twitter_handle=twitter_handle, 
+                                            **params)
+        credential = credentials_key(authUid)
+        params = dict((k, str(v).lower() if isinstance(v, bool) else v) 
+                        for k, v in params.items())
+        while True:
+            rate_limit.LIMITER.acquire(credential, 
+                                       rate_limit.TIMELINE_ENDPOINT, 
+                                       block=self.user.block)
+            with self.lock:
+                self.user.timeline_request_record += 1
+            response = http_util.get(self.api_url + 
+                                        '/statuses/user_timeline.json', 
+                                     params=params, 
+                                     auth=make_oauth(authUid))
+            if response.status_code == 429:
+                self.logger.warning("Unexpected Rate Limit Occured. " + \
+                                    "Retrying page after window reset " + \
+                                    str(params))
+                rate_limit.LIMITER.penalize(
+                    credential, rate_limit.TIMELINE_ENDPOINT, 
+                    response.headers.get('x-rate-limit-reset'))
+                continue
+            rate_limit.LIMITER.update(credential, 
+                                      rate_limit.TIMELINE_ENDPOINT, 
+                                      response.headers)
+            if response.status_code == 401:
+                self.logger.warning("Twitter rejected credentials of " + \
+                                    credential + " " + str(params))
+                invalidate_credentials(authUid)
+                return [], 'TwythonAuthError'
+            if response.status_code != 200:
+                raise TwythonError("Twitter API returned " + \
+                                   str(response.status_code) + \
+                                   " for user_timeline " + str(params), 
+                                   error_code=response.status_code)
+            tweet_list = response.json()
+            if tweet_list:
+                self.logger.info(str(len(tweet_list)) + "Tweets from id:" + \
+                                 str(tweet_list[-1].get('id')) + \
+                                 " through id:" + \
+                                 str(tweet_list[0].get('id')) + " fetched.")
+            return tweet_list, 'SUCCESS'
+
+
+    def timeline_state(self, timeline, save_to_es=False):
+        """Returns the state of paging through given timeline, to be passed to fetch_next_page until state['done']
+            :param timeline: [dict] as in *def request_timelines(self, timelines, ...)* of TwitterUser
+            :param save_to_es: [bool] save fetched tweets to ES with bulk requests of fetch_timelines :default: False
+        """
+        params = dict(timeline)
+        authUid = params.pop('authUid')
+        params.setdefault('user_id', authUid)
+        params.setdefault('trim_user', True)
+        params.setdefault('exclude_replies', False)
+        params.setdefault('include_rts', True)
+        if not params.get('since_id'):
+            params.pop('since_id', None)
+        count = params.pop('count', 200)
+        return {'authUid': authUid, 
+                'user_id': params['user_id'], 
+                'count': count, 
+                'max_id': params.pop('max_id', None), 
+                'twitter_handle': params.pop('twitter_handle', None), 
+                'params': params, 
+                'save_to_es': save_to_es, 
+                'timeline': [], 
+                'done': count <= 0}
+
+
+    def fetch_next_page(self, state):
+        """Fetches next page of the timeline described by state given by timeline_state
+            :Returns: [list] normalized tweets of the page, empty if there are no more
+
+            Pages are max 200 tweets each, older than the oldest tweet of the previous page, until count tweets or an empty page,
+            when state['done'] is set
+        """
+        count = min(200, state['count'])
+        params = dict(state['params'], count=count)
+        if state['max_id']:
+            params['max_id'] = state['max_id']
+        tweet_list, status_word = self.fetch_page(state['authUid'], params, 
+                                                  state['twitter_handle'])
+        if not tweet_list:
+            state['done'] = True
+            return []
+        page = list(normalize_tweets(tweet_list))
+        oldest_id = page[-1].get('id', 0)
+        state['done'] = oldest_id == (state['max_id'] or 1) or oldest_id < 1
+        state['max_id'] = oldest_id
+        state['count'] -= count
+        state['done'] = state['done'] or state['count'] <= 0
+        return page
+
+
+    def fetch_timelines(self, timelines, save_to_es=True):
+        """Fetches given timelines concurrently, waiting for all of them
+            :Returns: [dict] {user_id: [list] tweets of its timeline}
+            :param timelines: [list] of dicts as in *def request_timelines(self, timelines, ...)* of TwitterUser
+            :param save_to_es: [bool] save fetched tweets to ES with bulk requests :default: True
+
+            A timeline whose page fails keeps the tweets fetched before; its exception is logged and kept in self.failures by user_id
+        """
+        results = {}
+        remaining = [len(timelines)]
+        done = threading.Condition()
+        pool = ThreadPool(self.workers)
+
+        def step(state):
+            try:
+                for tweet in self.fetch_next_page(state):
+                    state['timeline'].append(tweet)
+                    if state['save_to_es']:
+                        self.user.buffer_tweet(tweet)
+                more = not state['done']
+            except Exception as ex:
+                self.logger.error("Timeline of user_id: " + \
+                                  str(state['user_id']) + " not fetched. " + \
+                                  type(ex).__name__ + ": " + str(ex), 
+                                  exc_info=True)
+                with self.lock:
+                    self.failures[state['user_id']] = ex
+                more = False
+            if more:
+                pool.apply_async(step, (state,))
+                return
+            metrics.REGISTRY.increment('timelines.fetched')
+            with done:
+                remaining[0] -= 1
+                done.notify_all()
+
+        for timeline in timelines:
+            state = self.timeline_state(timeline, save_to_es)
+            results[state['user_id']] = state['timeline']
+            pool.apply_async(step, (state,))
+        try:
+            with done:
+                while remaining[0]:
+                    done.wait(1)
+        finally:
+            pool.close()
+            pool.join()
+            if save_to_es:
+                self.user.bulk_writer.flush()
+        return results
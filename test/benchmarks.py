@@ -0,0 +1,553 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:02:37 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import datetime
+import resource
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import requests
+from test.context import core, helpers, http_util, aggregates, rate_limit, twitter_data, elasticsearch_util, queue_worker, schedule_cache, tweet_columns, compute_pool
+from test.stub_server import StubServer
+
+
+def best_of(function, repeat=3):
+    """:Returns: least wall-clock seconds taken by function() out of repeat runs
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def synthetic_frame(size, seed=0):
+    """:Returns: pandas DataFrame of given number of tweets in the form prepared by core.prepare_data
+    """
+    rng = core.np.random.RandomState(seed)
+    retweet_count = rng.geometric(0.3, size) - 1
+    favorite_count = rng.geometric(0.2, size) - 1
+    return core.pd.DataFrame({'day': rng.randint(0, 7, size),
+                              'hour': rng.randint(0, 24, size),
+                              'minute': rng.randint(0, 60, size),
+                              'id': rng.randint(1, 2**62, size),
+                              'retweet_count': retweet_count,
+                              'favorite_count': favorite_count,
+                              'engagement': retweet_count + 
+                                            favorite_count * 100})
+
+
+def bench_compute_times(sizes=(1000, 10000, 100000)):
+    """Compares core.compute_times against core.compute_times_by_slicing
+    """
+    print "%10s %14s %14s %9s" % ('tweets', 'slicing (ms)', 'single (ms)', 
+                                  'speedup')
+    for size in sizes:
+        df = synthetic_frame(size)
+        slicing = best_of(lambda: core.compute_times_by_slicing(
+                            {'twitter_id': 1, 'data_frame': df.copy()}))
+        single = best_of(lambda: core.compute_times(
+                            {'twitter_id': 1, 'data_frame': df.copy()}))
+        print "%10d %14.2f %14.2f %8.1fx" % (size, slicing * 1000, 
+                                             single * 1000, slicing / single)
+
+
+def bench_aggregates(sizes=(1000, 10000, 100000), new_tweets=20):
+    """Compares a full core.compute_times over the history of a user against folding new_tweets into its aggregate and deriving the schedule
+    """
+    print "%10s %14s %16s %9s" % ('tweets', 'full (ms)', 'aggregate (ms)', 
+                                  'speedup')
+    for size in sizes:
+        df = synthetic_frame(size + new_tweets)
+        df['id'] = core.np.arange(len(df), 0, -1)
+        aggregate = aggregates.new_aggregate(1)
+        core.fold_data_frame(aggregate, df.iloc[new_tweets:])
+        newest = df.iloc[:new_tweets]
+        full = best_of(lambda: core.compute_times(
+                            {'twitter_id': 1, 'data_frame': df}))
+
+        def incremental():
+            step = dict(aggregate, 
+                        slots=dict(aggregate['slots']), 
+                        candidates=dict((d, list(heap)) for d, heap in 
+                                            aggregate['candidates'].items()))
+            core.fold_data_frame(step, newest)
+            aggregates.derive_schedule(step)
+
+        folded = best_of(incremental)
+        print "%10d %14.2f %16.2f %8.1fx" % (size, full * 1000, 
+                                             folded * 1000, full / folded)
+
+
+def bench_startup(repeat=5):
+    """Measures wall-clock time of starting a fresh interpreter and importing the worker (core) and server (api) modules, without ES settings
+    """
+    statements = [('import publishtimer.core', 'worker import'), 
+                  ('import publishtimer.api', 'server import'), 
+                  ('import publishtimer.core as c; c.pd.DataFrame', 
+                   'worker import + pandas')]
+    env = dict((k, v) for k, v in os.environ.items() 
+                if k not in ['ES_HOST', 'ES_TIMEOUT'])
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    baseline = best_of(lambda: subprocess.check_call([sys.executable, '-c', 
+                                                      'pass'], env=env), 
+                       repeat)
+    print "%-26s %10s" % ('startup', 'time (ms)')
+    print "%-26s %10.2f" % ('interpreter', baseline * 1000)
+    for statement, name in statements:
+        timing = best_of(lambda: subprocess.check_call(
+                            [sys.executable, '-c', statement], 
+                            env=env, cwd=root), repeat)
+        print "%-26s %10.2f" % (name, timing * 1000)
+
+
+def bench_http(count=200, repeat=3):
+    """Compares bare requests calls against the pooled session of http_util for count GET + PUT pairs against a local stub server
+    """
+    server = StubServer().start()
+    url = server.url + '/save_schedule/1'
+
+    def bare():
+        for _ in range(count):
+            requests.get(url, params={'authUid': '1-tw'})
+            requests.put(url, json={'authUid': '1'})
+
+    def pooled():
+        for _ in range(count):
+            http_util.get(url, params={'authUid': '1-tw'})
+            http_util.put(url, json={'authUid': '1'})
+
+    try:
+        bare_time = best_of(bare, repeat)
+        bare_connections = len(server.client_ports)
+        server.client_ports.clear()
+        http_util.get_session(enforce_new=True)
+        pooled_time = best_of(pooled, repeat)
+        pooled_connections = len(server.client_ports)
+    finally:
+        http_util.get_session().close()
+        server.stop()
+    print "%-8s %14s %16s %12s" % ('client', 'total (ms)', 'per call (ms)', 
+                                   'connections')
+    for name, timing, connections in [('bare', bare_time, bare_connections), 
+                                      ('pooled', pooled_time, 
+                                       pooled_connections)]:
+        print "%-8s %14.2f %16.3f %12d" % (name, timing * 1000, 
+                                           timing * 1000 / (2 * count), 
+                                           connections)
+    print "speedup: %.1fx" % (bare_time / pooled_time)
+
+
+class StubTwython(object):
+    """Stand-in for an authenticated Twython object answering followers/ids at once and each user_timeline page after latency seconds
+    """
+    def __init__(self, followers, tweets=200, latency=0.02):
+        self.followers = range(1, followers + 1)
+        self.tweets = tweets
+        self.latency = latency
+
+    def get_followers_ids(self, **params):
+        return {'ids': self.followers, 'next_cursor': 0}
+
+    def get_user_timeline(self, **params):
+        time.sleep(self.latency)
+        last = params.get('max_id', self.tweets)
+        return [{'id': i} for i in range(last, max(last - params['count'], 
+                                                   0), -1)]
+
+
+def bench_followers(followers=200, workers=(1, 4, 8, 16)):
+    """Measures followers crawled per minute by TwitterUser.fetch_follower_timelines with given numbers of workers against a StubTwython
+    """
+    limiter = rate_limit.LIMITER
+    rate_limit.LIMITER = rate_limit.RateLimiter(
+                            limits={rate_limit.TIMELINE_ENDPOINT: 10**9, 
+                                    rate_limit.FOLLOWER_IDS_ENDPOINT: 10**9})
+    user = twitter_data.TwitterUser()
+    print "%8s %12s %18s %9s" % ('workers', 'total (s)', 'followers/minute', 
+                                 'speedup')
+    try:
+        baseline = None
+        for count in workers:
+            progress = user.fetch_follower_timelines(
+                            1, tweets_count=400, workers=count, 
+                            save_to_es=False, 
+                            twitter_handle=StubTwython(followers))
+            baseline = baseline or progress['followers_per_minute']
+            print "%8d %12.2f %18.0f %8.1fx" % (
+                    count, progress['seconds'], 
+                    progress['followers_per_minute'], 
+                    progress['followers_per_minute'] / baseline)
+    finally:
+        rate_limit.LIMITER = limiter
+
+
+def realistic_page(size=200, seed=0):
+    """:Returns: JSON of a user_timeline page of given number of tweets with the nesting of Twitter API: entities, extended_entities,
+        a full user object and a retweeted_status on every third tweet
+    """
+    rng = core.np.random.RandomState(seed)
+    start = datetime.datetime(2016, 4, 1)
+    user = {'id': 12345, 'id_str': '12345', 'name': 'Name', 
+            'screen_name': 'screen_name', 'location': 'Pune', 
+            'description': 'description ' * 10, 
+            'url': 'https://t.co/abc', 
+            'entities': {'url': {'urls': [{'url': 'https://t.co/abc', 
+                                           'expanded_url': 'http://a.b'}]}, 
+                         'description': {'urls': []}}, 
+            'followers_count': 1000, 'friends_count': 100, 
+            'created_at': 'Mon Jan 04 08:00:00 +0000 2010', 
+            'profile_image_url': 'http://pbs.twimg.com/a.jpg'}
+    page = []
+    for i in range(size):
+        created_at = start - datetime.timedelta(minutes=int(i * 97))
+        tweet = {'id': 10**17 - i, 'id_str': str(10**17 - i), 
+                 'created_at': created_at.strftime(
+                                    "%a %b %d %H:%M:%S +0000 %Y"), 
+                 'text': 'tweet text ' * 12, 'lang': 'en', 
+                 'retweet_count': int(rng.geometric(0.3)) - 1, 
+                 'favorite_count': int(rng.geometric(0.2)) - 1, 
+                 'entities': {'hashtags': [{'text': 'tag', 
+                                            'indices': [0, 4]}], 
+                              'user_mentions': [], 
+                              'urls': [{'url': 'https://t.co/x', 
+                                        'indices': [5, 28]}], 
+                              'media': [{'id': 1, 'media_url': 'http://m', 
+                                         'sizes': {'large': {'w': 1, 
+                                                             'h': 1}}}]}, 
+                 'extended_entities': {'media': [{'id': 1, 
+                                                  'type': 'photo'}]}, 
+                 'user': user}
+        if i % 3 == 0:
+            tweet['retweeted_status'] = copy.deepcopy(tweet)
+        page.append(tweet)
+    return json.dumps(page)
+
+
+def bench_normalize(pages=50):
+    """Compares purge_key_deep of media, urls and url plus strptime of created_at with twitter_data.normalize_tweets
+        on given number of realistic 200-tweet pages, each freshly decoded as from Twitter API
+    """
+    page = realistic_page()
+
+    def triple_pass(tweets):
+        for tweet in tweets:
+            tweet = helpers.purge_key_deep(tweet, 'media')
+            tweet = helpers.purge_key_deep(tweet, 'urls')
+            tweet = helpers.purge_key_deep(tweet, 'url')
+            tweet['created_at'] = datetime.datetime.strptime(
+                                    tweet['created_at'], 
+                                    "%a %b %d %H:%M:%S +0000 %Y")
+
+    def purged(tweets):
+        for tweet in twitter_data.normalize_tweets(tweets, None):
+            pass
+
+    def projected(tweets):
+        for tweet in twitter_data.normalize_tweets(tweets):
+            pass
+
+    print "%-22s %14s %16s %9s" % ('normalizer', 'total (ms)', 
+                                   'per tweet (us)', 'speedup')
+    baseline = None
+    for name, function in [('triple purge+strptime', triple_pass), 
+                           ('single purge', purged), 
+                           ('projection', projected)]:
+        timings = []
+        for _ in range(3):
+            decoded = [json.loads(page) for _ in range(pages)]
+            start = time.time()
+            for tweets in decoded:
+                function(tweets)
+            timings.append(time.time() - start)
+        timing = min(timings)
+        baseline = baseline or timing
+        print "%-22s %14.2f %16.2f %8.1fx" % (name, timing * 1000, 
+                                              timing * 10**6 / (pages * 200), 
+                                              baseline / timing)
+
+
+def bench_make_data_frame(sizes=(10000, 100000)):
+    """Compares per-tweet dateutil parsing into a list of dicts, as make_data_frame did, against core.make_data_frame on data_dicts
+        of given sizes with created_at in the formats of ES and get_data_on_fly
+    """
+    from dateutil import parser
+
+    def per_tweet(data_dict):
+        for data_point in data_dict['data']:
+            d = parser.parse(data_point.pop('created_at'))
+            data_point['day'] = d.weekday()
+            data_point['hour'] = d.hour
+            data_point['minute'] = d.minute
+            data_point['engagement'] = data_point.get('retweet_count', 0) + \
+                                        data_point.get('favorite_count', 0) * 100
+        return core.pd.DataFrame(data_dict['data'])
+
+    print "%10s %14s %16s %9s" % ('tweets', 'per tweet (ms)', 'columnar (ms)', 
+                                  'speedup')
+    for size in sizes:
+        start = datetime.datetime(2016, 4, 1)
+        data = [{'id': 10**17 - i, 
+                 'created_at': (start - datetime.timedelta(minutes=i * 7)
+                                ).isoformat(' ' if i % 2 else 'T'), 
+                 'retweet_count': i % 5, 
+                 'favorite_count': i % 3} for i in range(size)]
+        slow = best_of(lambda: per_tweet({'twitter_id': 1, 
+                                          'data': [dict(d) for d in data]}))
+        fast = best_of(lambda: core.make_data_frame(
+                            {'twitter_id': 1, 
+                             'data': [dict(d) for d in data]}))
+        print "%10d %14.2f %16.2f %8.1fx" % (size, slow * 1000, fast * 1000, 
+                                             slow / fast)
+
+
+class PagingES(object):
+    """Stand-in for the ES client serving search pages of size tweets of one user as tweet_search_body asks, generating hits per request
+    """
+    def __init__(self, size):
+        self.size = size
+
+    def search(self, body, **params):
+        search_filter = body['filter']
+        id_range = search_filter['bool']['must'][1]['range']['id'] \
+                    if 'bool' in search_filter else {}
+        newest = min(self.size, id_range.get('lt', self.size + 1) - 1)
+        oldest = id_range.get('gt', 0) + 1
+        start = datetime.datetime(2016, 4, 1)
+        hits = [{'fields': {'id': [i], 
+                            'created_at': [(start + datetime.timedelta(
+                                                minutes=i * 7)).isoformat()], 
+                            'retweet_count': [i % 5], 
+                            'favorite_count': [i % 3]}, 
+                 'sort': [i]} 
+                for i in range(newest, max(newest - body['size'], 
+                                           oldest - 1), -1)]
+        return {'hits': {'hits': hits, 'total': newest - oldest + 1}}
+
+
+def memory_child(mode, size):
+    """Prints peak RSS growth in MB and seconds taken by computing a schedule from size tweets served by PagingES,
+        through list of data_points (mode 'dicts') or TweetColumns (mode 'columns'); run in a fresh interpreter by bench_memory
+    """
+    elasticsearch_util.get_es_client = lambda *args, **kwargs: PagingES(size)
+    core.compute_times(core.make_data_frame(core.get_columns_from_es(1, 10)))
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if mode == 'dicts':
+        data_dict = core.get_data_from_es(1)
+    else:
+        data_dict = core.get_columns_from_es(1)
+    core.compute_times(core.make_data_frame(data_dict))
+    print (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) \
+            / 1024.0, time.time() - start
+
+
+def bench_memory(size=100000):
+    """Compares peak memory of preparing and computing the schedule of a user with size tweets in ES,
+        holding them as a list of data_points against TweetColumns, each in a fresh interpreter
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    print "%-10s %10s %16s %10s" % ('data', 'tweets', 'peak RSS (MB)', 
+                                    'time (s)')
+    for mode in ['dicts', 'columns']:
+        output = subprocess.check_output(
+                    [sys.executable, '-c', 
+                     'from test.benchmarks import memory_child; '
+                     'memory_child(%r, %d)' % (mode, size)], cwd=root)
+        peak, seconds = [float(v) for v in output.split()[-2:]]
+        print "%-10s %10d %16.1f %10.2f" % (mode, size, peak, seconds)
+
+
+class SlowPagingES(PagingES):
+    """PagingES answering each search after latency seconds, as a remote ES cluster
+    """
+    def __init__(self, size, latency=0.02):
+        super(SlowPagingES, self).__init__(size)
+        self.latency = latency
+
+    def search(self, body, **params):
+        time.sleep(self.latency)
+        return super(SlowPagingES, self).search(body, **params)
+
+
+def bench_pipeline(users=200, tweets=500, latency=0.05):
+    """Compares QueueConsumer processing messages of users with tweets in ES one thread per message, as process_message,
+        against the fetch/compute/write pipeline of queue_worker.create_pipeline, with ES and save_schedule API answering after latency seconds;
+        prints users per second and state of each stage of the pipeline
+    """
+    def respond(method, path, body):
+        time.sleep(latency)
+        return 200, {'code': 200}
+
+    server = StubServer(respond=respond).start()
+    os.environ['SAVE_SCHEDULE_URL'] = server.url + '/save_schedule/'
+    get_es_client = elasticsearch_util.get_es_client
+    elasticsearch_util.get_es_client = lambda *args, **kwargs: \
+                                            SlowPagingES(tweets, latency)
+
+    def consume(threads=None, stages=None):
+        aggregates.set_store(aggregates.create_store('memory'))
+        schedule_cache.set_store(schedule_cache.create_store('memory'))
+        queue = queue_worker.LocalQueue()
+        for i in range(1, users + 1):
+            queue.write(queue.new_message(json.dumps({'authUid': i})))
+        consumer = queue_worker.QueueConsumer(queue, 
+                                              concurrency=threads, 
+                                              wait_time_seconds=0, 
+                                              pipeline=stages)
+        start = time.time()
+        while consumer.processed_count + consumer.failed_count < users:
+            consumer.poll_once()
+        consumer.stop()
+        return users / (time.time() - start)
+
+    try:
+        print "%-26s %8s %12s" % ('consumer', 'threads', 'users/s')
+        for threads in [4, 10]:
+            print "%-26s %8d %12.1f" % ('thread per message', threads, 
+                                        consume(threads=threads))
+        for fetch, compute, write in [(4, 2, 4), (6, 1, 3)]:
+            stages = queue_worker.create_pipeline(fetch, compute, write)
+            rate = consume(stages=stages)
+            snapshot = stages.close()
+            print "%-26s %8d %12.1f" % ('pipeline %d/%d/%d' % (fetch, compute, 
+                                                              write), 
+                                        fetch + compute + write, rate)
+            for name in ['fetch', 'compute', 'write']:
+                state = snapshot[name]
+                print "    %-8s %6d done %8.1f/s %6.0f%% busy %4d/%d queued" % \
+                        (name, state['processed'], state['throughput'], 
+                         state['utilization'] * 100, state['queued'], 
+                         state['queue_size'])
+    finally:
+        elasticsearch_util.get_es_client = get_es_client
+        aggregates.set_store(None)
+        schedule_cache.set_store(None)
+        http_util.get_session().close()
+        server.stop()
+
+
+def bench_compute_scaling(users=48, tweets=20000, workers=None):
+    """Compares computing schedules of users with tweets each by core.compute_columns from as many threads as workers,
+        in the calling threads against compute_pool of workers processes, for 1 to the number of cores workers
+    """
+    rng = core.np.random.RandomState(0)
+    data_dicts = []
+    for twitter_id in range(users):
+        columns = tweet_columns.TweetColumns()
+        columns.extend(id=core.np.arange(tweets), 
+                       day=rng.randint(0, 7, tweets), 
+                       hour=rng.randint(0, 24, tweets), 
+                       minute=rng.randint(0, 60, tweets), 
+                       retweet_count=rng.randint(0, 5, tweets), 
+                       favorite_count=rng.randint(0, 3, tweets))
+        data_dicts.append({'twitter_id': twitter_id, 'data': columns})
+
+    def run(n):
+        pool = ThreadPool(n)
+        start = time.time()
+        pool.map(core.compute_columns, data_dicts)
+        seconds = time.time() - start
+        pool.close()
+        pool.join()
+        return users / seconds
+
+    print "%d cores, %d users of %d tweets (%.0f KB shipped per user)" % \
+            (multiprocessing.cpu_count(), users, tweets, 
+             data_dicts[0]['data'].nbytes() / 1024.0)
+    print "%8s %16s %16s %9s" % ('workers', 'threads (u/s)', 
+                                 'processes (u/s)', 'speedup')
+    single = None
+    for n in workers or range(1, multiprocessing.cpu_count() + 1):
+        threaded = run(n)
+        compute_pool.start(n)
+        try:
+            pooled = run(n)
+        finally:
+            compute_pool.stop()
+        single = single or threaded
+        print "%8d %16.1f %16.1f %8.1fx" % (n, threaded, pooled, 
+                                            pooled / single)
+
+
+def fill_by_lists(schedule):
+    """Fills schedule as fill_incomplete_schedule did: list of days rebuilt per weekday and list membership tests per default time
+    """
+    for day in core.DAY_MAP.values():
+        if day not in [item['day'] for item in schedule['completeSchedule']]:
+            schedule['completeSchedule'].append(
+                {'day': day, 'times': list(core.DEFAULT_SCHEDULE)})
+    for item in schedule['completeSchedule']:
+        available_len = len(item['times'])
+        if available_len < 50:
+            item['times'] += [t for t in core.DEFAULT_SCHEDULE 
+                                if t not in item['times']][:50 - available_len]
+    return schedule
+
+
+def bench_fill_schedule(chunks=10, repeat=3):
+    """Compares list-based filling against core.fill_incomplete_schedule on the schedules of chunks of BATCH_CHUNK_SIZE users
+        computed by compute_times_batch, as in the batch path, users having 0 to 400 tweets; prints time per user and per chunk
+        against compute_times_batch of the chunk
+    """
+    users = core.BATCH_CHUNK_SIZE
+    data_dicts = [{'twitter_id': i, 
+                   'data_frame': synthetic_frame((i * 37) % 400, seed=i)} 
+                  for i in range(users)]
+    compute = best_of(lambda: core.compute_times_batch(data_dicts), repeat)
+    schedules = core.compute_times_batch(data_dicts)
+    assert all(fill_by_lists(copy.deepcopy(schedule)) == 
+               core.fill_incomplete_schedule(copy.deepcopy(schedule)) 
+               for schedule in schedules)
+
+    def fill(function):
+        timings = []
+        for _ in range(repeat):
+            copies = [copy.deepcopy(schedule) 
+                      for _ in range(chunks) for schedule in schedules]
+            start = time.time()
+            for schedule in copies:
+                function(schedule)
+            timings.append(time.time() - start)
+        return min(timings) / chunks
+
+    print "%d users per chunk; compute_times_batch: %.2f ms per chunk" % \
+            (users, compute * 1000)
+    print "%-10s %16s %16s %14s" % ('fill', 'per user (us)', 'per chunk (ms)', 
+                                    '% of compute')
+    timings = [('lists', fill(fill_by_lists)), 
+               ('sets', fill(core.fill_incomplete_schedule))]
+    for name, timing in timings:
+        print "%-10s %16.1f %16.2f %13.1f%%" % (name, timing * 1e6 / users, 
+                                                timing * 1000, 
+                                                timing * 100 / compute)
+    print "speedup: %.1fx" % (timings[0][1] / timings[1][1])
+
+
+BENCHMARKS = {'compute_times': bench_compute_times, 
+              'startup': bench_startup, 
+              'http': bench_http, 
+              'aggregates': bench_aggregates, 
+              'followers': bench_followers, 
+              'normalize': bench_normalize, 
+              'make_data_frame': bench_make_data_frame, 
+              'memory': bench_memory, 
+              'pipeline': bench_pipeline, 
+              'compute_scaling': bench_compute_scaling, 
+              'fill_schedule': bench_fill_schedule}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or sorted(BENCHMARKS):
+        print "\n", name
+        BENCHMARKS[name]()
@@ -1,3 +1,3 @@
 # -*- coding: utf-8 -*-
 
-from publishtimer import api, core, elasticsearch_util, twitter_data, helpers
\ No newline at end of file
+from publishtimer import api, core, elasticsearch_util, twitter_data, helpers, queue_worker, metrics, http_util, schedule_cache, aggregates, jobs, rate_limit, tweet_columns, pipeline, compute_pool
\ No newline at end of file
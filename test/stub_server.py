@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:24:40 2026
+
+@author: Parag Guruji, paragguruji@gmail.com
+"""
+
+import json
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''Request handler answering every request with the (status, body) returned by respond of its server
+    '''
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def handle_request(self):
+        """Records the request, its headers and client port and writes the stubbed response with keep-alive
+
+            respond is called outside the lock of the server, so that slow stubbed responses are served concurrently
+        """
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else ''
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path, body))
+            self.server.request_headers.append(dict(self.headers))
+            self.server.client_ports.add(self.client_address[1])
+        response = self.server.respond(self.command, self.path, body)
+        status, payload = response[:2]
+        headers = response[2] if len(response) > 2 else {}
+        data = json.dumps(payload)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = handle_request
+
+    def log_message(self, format, *args):
+        """Silences the access log
+        """
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    '''Local HTTP server standing in for Crowdfire and Twitter APIs in tests and benchmarks
+    '''
+    daemon_threads = True
+
+    def __init__(self, respond=None, port=0):
+        """Binds to localhost on given port (any free port by default)
+
+            :param respond: [callable] (method, path, body) -> (status, JSON-serializable payload[, headers dict]) :default: always (200, {'code': 200})
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', port), StubHandler)
+        self.respond = respond or (lambda method, path, body:
+                                        (200, {'code': 200}))
+        self.lock = threading.Lock()
+        self.requests = []
+        self.request_headers = []
+        self.client_ports = set()
+        self.url = 'http://127.0.0.1:' + str(self.server_address[1])
+
+    def start(self):
+        """Serves in a background thread and returns self
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the socket
+        """
+        self.shutdown()
+        self.server_close()
@@ -6,15 +6,145 @@ Created on Sat Apr  2 09:31:14 2016
 """
 
 from multiprocessing import Process
-from test.context import api, core, elasticsearch_util
+from test.context import api, core, elasticsearch_util, queue_worker, metrics, http_util, helpers, twitter_data, schedule_cache, aggregates, jobs, rate_limit, tweet_columns, pipeline, compute_pool
+from twython import TwythonError, TwythonRateLimitError
+from test.stub_server import StubServer
 import requests
 import unittest
 import os
 import json
+import copy
+import sys
 import time
+import datetime
+import threading
+import tempfile
+import urlparse
+import shutil
+import subprocess
 from elasticsearch.exceptions import ConnectionError
 
 
+class FakeTimelineHandle(object):
+    """Stand-in for an authenticated Twython object serving user_timeline from given tweet ids"""
+
+    def __init__(self, ids, page_size=200):
+        self.ids = sorted(ids, reverse=True)
+        self.page_size = page_size
+        self.calls = []
+
+    def get_user_timeline(self, **params):
+        self.calls.append(params)
+        ids = [i for i in self.ids 
+                if i > params.get('since_id', 0) and 
+                    i <= params.get('max_id', self.ids[0])]
+        return [{'id': i, 
+                 'created_at': 'Fri Apr 01 10:%02d:00 +0000 2016' % (i % 60), 
+                 'retweet_count': i, 
+                 'favorite_count': 1, 
+                 'user': {'id': params['user_id']}} 
+                for i in ids[:min(self.page_size, params['count'])]]
+
+
+class FakeFollowerHandle(FakeTimelineHandle):
+    """Stand-in for an authenticated Twython object serving followers/ids and, after given delay, the same timeline for every follower"""
+
+    def __init__(self, followers, ids, delay=0, failing=()):
+        FakeTimelineHandle.__init__(self, ids)
+        self.followers = list(followers)
+        self.delay = delay
+        self.failing = set(failing)
+        self.handles = []
+
+    def get_followers_ids(self, **params):
+        return {'ids': self.followers, 'next_cursor': 0}
+
+    def get_user_timeline(self, **params):
+        self.handles.append(id(self))
+        time.sleep(self.delay)
+        if params['user_id'] in self.failing:
+            raise TwythonError("Stubbed failure")
+        return FakeTimelineHandle.get_user_timeline(self, **params)
+
+
+
+class FakeES(object):
+    """Stand-in for the ES client answering search and msearch bodies of tweet_search_body from given data_points per user id, recording each query,
+        and indexing tweets of bulk requests except those of ids in rejected, searchable only after refresh as in ES"""
+
+    transport = type('FakeTransport', (object,), 
+                     {'serializer': elasticsearch_util.SERIALIZER})
+
+    def __init__(self, tweets, rejected=()):
+        self.tweets = dict((str(user_id), sorted(data, key=lambda d: -d['id'])) 
+                           for user_id, data in tweets.items())
+        self.rejected = set(rejected)
+        self.searches = []
+        self.bulks = []
+        self.indexed = []
+
+    def answer(self, body):
+        search_filter = body['filter']
+        id_range = {}
+        if 'bool' in search_filter:
+            search_filter, id_range = search_filter['bool']['must'][0], \
+                search_filter['bool']['must'][1]['range']['id']
+        matched = [d for d in self.tweets.get(
+                                str(search_filter['term']['user.id']), [])
+                    if d['id'] < id_range.get('lt', float('inf')) and 
+                        d['id'] > id_range.get('gt', float('-inf'))]
+        return {'hits': {'total': len(matched), 
+                         'hits': [{'fields': dict((k, [v]) for k, v in d.items()), 
+                                   'sort': [d['id']]} 
+                                  for d in matched[:body['size']]]}}
+
+    def search(self, body, **params):
+        self.searches.append((body, params))
+        return self.answer(body)
+
+    def msearch(self, body):
+        self.searches.extend(zip(body[1::2], body[0::2]))
+        return {'responses': [self.answer(query) for query in body[1::2]]}
+
+    def bulk(self, body, **params):
+        lines = [json.loads(line) for line in body.splitlines() if line]
+        self.bulks.append(lines[0::2])
+        items = []
+        for action, source in zip(lines[0::2], lines[1::2]):
+            item = dict(action['index'])
+            if source['id'] in self.rejected:
+                item.update(status=400, error='MapperParsingException')
+            else:
+                item['status'] = 201
+                self.indexed.append(source)
+            items.append({'index': item})
+        return {'errors': any(item['index']['status'] >= 300 
+                              for item in items), 
+                'items': items}
+
+    def refresh(self):
+        for source in self.indexed:
+            data = self.tweets.setdefault(str(source['user']['id']), [])
+            data[:] = sorted([d for d in data if d['id'] != source['id']] + 
+                             [dict((k, source[k]) for k in 
+                                   ['id', 'created_at', 'retweet_count', 
+                                    'favorite_count'])], 
+                             key=lambda d: -d['id'])
+        del self.indexed[:]
+
+
+def fake_tweets(ids, seed=0):
+    """Returns data_points of given tweet ids as stored in ES, with random created_at in the week of 2016-04-04 and engagement counts
+    """
+    rng = core.np.random.RandomState(seed)
+    return [{'id': i, 
+             'created_at': '2016-04-%02dT%02d:%02d:00' % (4 + rng.randint(0, 7), 
+                                                          rng.randint(0, 24), 
+                                                          rng.randint(0, 60)), 
+             'retweet_count': rng.randint(0, 5), 
+             'favorite_count': rng.randint(0, 3)} for i in ids]
+
+
 class ApiUnitTests(unittest.TestCase):
     """Test cases for module publishtimer.api"""
         
@@ -73,6 +203,22 @@ class ApiUnitTests(unittest.TestCase):
 class CoreUnitTests(unittest.TestCase):
     """Test cases for module publishtimer.core"""
         
+    def test_import_is_lazy(self):
+        """tests that importing core needs no ES settings and defers import of pandas and boto
+        
+            :Data: fresh interpreter without environment variables ES_HOST and ES_TIMEOUT
+            
+        """
+        env = dict((k, v) for k, v in os.environ.items() 
+                    if k not in ['ES_HOST', 'ES_TIMEOUT'])
+        statement = "import sys, publishtimer.core; " + \
+                    "print sorted(m for m in ['pandas', 'boto'] " + \
+                    "if m in sys.modules), publishtimer.core.es.CLIENT"
+        output = subprocess.check_output([sys.executable, '-c', statement], 
+                                         env=env)
+        self.assertEqual("[] None", output.strip())
+        
+        
     def test_get_data_on_fly(self):
         """tests function get_data_on_fly
         
@@ -114,6 +260,68 @@ class CoreUnitTests(unittest.TestCase):
             self.assertIsInstance(ex, ConnectionError)
     
     
+    def test_iter_data_from_es(self):
+        """tests that iter_data_from_es pages on tweet id below the last tweet of each page, up to the cap, over routed searches
+        
+            :Signature: iter_data_from_es(authUid, max_tweets=None, page_size=None)
+            :Data: authUid = u'19900726' with tweets 1 to 7 in a fake ES, max_tweets = 5 and None, page_size = 2, ES_USER_ROUTING on
+            
+        """
+        authUid = u'19900726'
+        fake_es = FakeES({authUid: fake_tweets(range(1, 8))})
+        saved = elasticsearch_util.get_es_client, \
+                    elasticsearch_util.ES_USER_ROUTING, \
+                    elasticsearch_util.ES_ROUTING_SINCE
+        before_id = lambda body: body['filter']['bool']['must'][1][
+                                    'range']['id']['lt'] \
+                                    if 'bool' in body['filter'] else None
+        try:
+            elasticsearch_util.get_es_client = lambda *a, **k: fake_es
+            elasticsearch_util.ES_USER_ROUTING = True
+            elasticsearch_util.ES_ROUTING_SINCE = ''
+            result = list(core.iter_data_from_es(authUid, 
+                                                 max_tweets=5, 
+                                                 page_size=2))
+            self.assertEqual([7, 6, 5, 4, 3], 
+                             [data_point['id'] for data_point in result])
+            self.assertEqual([None, 6, 4], 
+                             [before_id(body) for body, _ in fake_es.searches])
+            self.assertEqual([2, 2, 1], 
+                             [body['size'] for body, _ in fake_es.searches])
+            for _, params in fake_es.searches:
+                self.assertEqual(authUid, params['routing'])
+            del fake_es.searches[:]
+            result = list(core.iter_data_from_es(authUid, page_size=2))
+            self.assertEqual(range(7, 0, -1), 
+                             [data_point['id'] for data_point in result])
+            self.assertEqual([None, 6, 4, 2], 
+                             [before_id(body) for body, _ in fake_es.searches])
+        finally:
+            elasticsearch_util.get_es_client, \
+                elasticsearch_util.ES_USER_ROUTING, \
+                elasticsearch_util.ES_ROUTING_SINCE = saved
+    
+    
+    def test_tweet_search_body(self):
+        """tests function tweet_search_body with and without before_id
+        
+            :Signature: tweet_search_body(authUid, size=1, before_id=None)
+            :Data: authUid = 19900726, size = 100, before_id = 715256330974531584
+            
+        """
+        body = core.tweet_search_body(19900726, size=100)
+        self.assertEqual({'term': {'user.id': 19900726}}, body['filter'])
+        self.assertEqual(100, body['size'])
+        self.assertEqual([{'id': 'desc'}], body['sort'])
+        body = core.tweet_search_body(19900726, 
+                                      size=100, 
+                                      before_id=715256330974531584)
+        self.assertEqual({'bool': {'must': [
+                            {'term': {'user.id': 19900726}}, 
+                            {'range': {'id': {'lt': 715256330974531584}}}]}}, 
+                         body['filter'])
+    
+    
     def test_prepare_data(self):
         """tests function prepare_data
         
@@ -181,6 +389,291 @@ class CoreUnitTests(unittest.TestCase):
         self.assertDictEqual(expected_result, computed_result)
         
         
+    def test_compute_times_equivalence(self):
+        """tests that compute_times gives the same schedule as compute_times_by_slicing
+        
+            :Signature: compute_times(data_dict)
+            :Data: test_data_file, random frames with many ties and edge cases (all-zero, all-equal and single-day engagement)
+            :test_data_file = test/data/test_data_timeline_authUid19900726.list
+            
+        """
+        test_data_file = "test/data/test_data_timeline_authUid19900726.list"
+        frames = [core.pd.DataFrame(json.load(open(test_data_file)))]
+        rng = core.np.random.RandomState(7)
+        for n in [1, 49, 50, 51, 700, 5000]:
+            frames.append(core.pd.DataFrame({
+                            'day': rng.randint(0, 7, n), 
+                            'hour': rng.randint(0, 24, n), 
+                            'minute': rng.randint(0, 60, n), 
+                            'engagement': rng.randint(0, 5, n) * 100}))
+        frames.append(core.pd.DataFrame({'day': [0, 1, 1], 'hour': [1, 2, 3], 
+                                         'minute': [4, 5, 6], 
+                                         'engagement': [0, 0, 0]}))
+        frames.append(core.pd.DataFrame({'day': [2] * 60, 
+                                         'hour': range(60), 
+                                         'minute': range(60), 
+                                         'engagement': [300] * 60}))
+        for df in frames:
+            expected = core.compute_times_by_slicing(
+                            {'twitter_id': u'19900726', 
+                             'data_frame': df.copy()})
+            computed = core.compute_times({'twitter_id': u'19900726', 
+                                           'data_frame': df.copy()})
+            self.assertDictEqual(expected, computed)
+        
+        
+    def test_compute_times_batch(self):
+        """tests that compute_times_batch gives the same schedules as compute_times called per user
+        
+            :Signature: compute_times_batch(data_dicts)
+            :Data: data_dicts of test_data_file, random frames and an empty frame
+            :test_data_file = test/data/test_data_timeline_authUid19900726.list
+            
+        """
+        test_data_file = "test/data/test_data_timeline_authUid19900726.list"
+        rng = core.np.random.RandomState(11)
+        data_dicts = [{'twitter_id': u'19900726', 
+                       'data_frame': core.pd.DataFrame(
+                                        json.load(open(test_data_file)))}, 
+                      {'twitter_id': 1L, 'data_frame': core.pd.DataFrame()}]
+        for n in [3, 80, 2000]:
+            data_dicts.append({'twitter_id': long(n), 
+                               'data_frame': core.pd.DataFrame({
+                                    'day': rng.randint(0, 7, n), 
+                                    'hour': rng.randint(0, 24, n), 
+                                    'minute': rng.randint(0, 60, n), 
+                                    'engagement': rng.randint(0, 3, n)})})
+        expected = [core.compute_times(d) for d in data_dicts]
+        self.assertEqual(expected, core.compute_times_batch(data_dicts))
+        
+        
+    def test_work_batch_with_invalid_authUid(self):
+        """tests that work_batch reports failure per authUid instead of failing the batch
+        
+            :Signature: work_batch(authUids, use_es=True, use_tw=True, save_on_fly=True, chunk_size=None, max_workers=None, **kwargs)
+            :Data: authUids = [u'abc-tw', u'-tw'], use_es = False, use_tw = False
+            
+        """
+        results = core.work_batch([u'abc-tw', u'-tw'], 
+                                  use_es=False, 
+                                  use_tw=False)
+        self.assertEqual([u'abc-tw', u'-tw'], 
+                         [result['authUid'] for result in results])
+        for result in results:
+            self.assertEqual('failure', result['status'])
+            self.assertIn('error', result)
+        
+        
+    def test_get_data_from_es_batch_pages_past_window(self):
+        """tests that users with more tweets than the result window get as many tweets from the batch as from the single-user path
+        
+            :Signature: get_data_from_es_batch(authUids)
+            :Data: users 1, 2, 3 with 25, 10 and 3 tweets in a fake ES, ES_MAX_RESULT_WINDOW = 10, ES_PAGE_SIZE = 4,
+                ES_MAX_TWEETS = 0 (all) and 18
+            
+        """
+        fake_es = FakeES({1: fake_tweets(range(1, 26)), 
+                          2: fake_tweets(range(1, 11)), 
+                          3: fake_tweets(range(1, 4))})
+        saved = elasticsearch_util.get_es_client, core.ES_MAX_RESULT_WINDOW, \
+                    core.ES_PAGE_SIZE, core.ES_MAX_TWEETS
+        try:
+            elasticsearch_util.get_es_client = lambda *a, **k: fake_es
+            core.ES_MAX_RESULT_WINDOW, core.ES_PAGE_SIZE = 10, 4
+            for max_tweets in [0, 18]:
+                core.ES_MAX_TWEETS = max_tweets
+                batch = core.get_data_from_es_batch([1, 2, 3])
+                for authUid, data_dict in zip([1, 2, 3], batch):
+                    single = core.get_columns_from_es(authUid)
+                    self.assertEqual(list(single['data'].column('id')), 
+                                     list(data_dict['data'].column('id')))
+                self.assertEqual(max_tweets or 25, len(batch[0]['data']))
+                self.assertEqual(10, len(batch[1]['data']))
+        finally:
+            elasticsearch_util.get_es_client, core.ES_MAX_RESULT_WINDOW, \
+                core.ES_PAGE_SIZE, core.ES_MAX_TWEETS = saved
+        
+        
+    def test_work_batch_with_failing_chunk(self):
+        """tests that a stage failing for a whole chunk fails only the authUids of that chunk, with its error
+        
+            :Signature: work_batch(authUids, use_es=True, use_tw=True, save_on_fly=True, chunk_size=None, max_workers=None, **kwargs)
+            :Data: authUids = [u'1-tw', u'2-tw', u'3-tw'] with tweets in a fake ES, chunk_size = 1, use_tw = False,
+                compute stage raising for the chunk of u'2-tw', write_schedule stubbed to succeed
+            
+        """
+        class Response(object):
+            status_code = 200
+        fake_es = FakeES(dict((i, fake_tweets(range(1, 50), seed=i)) 
+                              for i in [1, 2, 3]))
+        saved = elasticsearch_util.get_es_client, core.compute_chunk, \
+                    core.write_schedule
+        compute_chunk = core.compute_chunk
+        def failing_compute_chunk(prepared):
+            if prepared[0][0]['authUid'] == u'2-tw':
+                raise KeyError('stubbed')
+            return compute_chunk(prepared)
+        try:
+            elasticsearch_util.get_es_client = lambda *a, **k: fake_es
+            core.compute_chunk = failing_compute_chunk
+            core.write_schedule = lambda schedule: (schedule, Response())
+            results = core.work_batch([u'1-tw', u'2-tw', u'3-tw'], 
+                                      use_tw=False, 
+                                      chunk_size=1)
+        finally:
+            elasticsearch_util.get_es_client, core.compute_chunk, \
+                core.write_schedule = saved
+        self.assertEqual(['success', 'failure', 'success'], 
+                         [result['status'] for result in results])
+        self.assertEqual("KeyError: 'stubbed'", results[1]['error'])
+        self.assertEqual(u'1-tw', results[0]['schedule_prepared']['authUid'])
+        
+        
+    def test_compute_columns_in_pool(self):
+        """tests that schedules computed in worker processes of compute_pool equal those computed in the calling thread
+        
+            :Signature: compute_columns(data_dict), compute_chunk(prepared)
+            :Data: 3 users with 500, 0 and 2000 random tweets, compute_pool of 2 worker processes
+            
+        """
+        rng = core.np.random.RandomState(3)
+        data_dicts = []
+        for twitter_id, n in [(1, 500), (2, 0), (3, 2000)]:
+            columns = tweet_columns.TweetColumns()
+            columns.extend(id=core.np.arange(n), 
+                           day=rng.randint(0, 7, n), 
+                           hour=rng.randint(0, 24, n), 
+                           minute=rng.randint(0, 60, n), 
+                           retweet_count=rng.randint(0, 5, n), 
+                           favorite_count=rng.randint(0, 3, n))
+            data_dicts.append({'twitter_id': twitter_id, 'data': columns})
+        expected = [core.compute_times(core.make_data_frame(d)) 
+                    for d in data_dicts]
+        self.assertEqual(expected, [core.compute_columns(d) for d in data_dicts])
+        prepared = [({}, d) for d in data_dicts]
+        self.assertEqual(expected, [schedule for _, schedule in 
+                                        core.compute_chunk(prepared)])
+        compute_pool.start(2)
+        try:
+            self.assertTrue(compute_pool.started())
+            self.assertEqual(expected, 
+                             [core.compute_columns(d) for d in data_dicts])
+            self.assertEqual(expected, [schedule for _, schedule in 
+                                            core.compute_chunk(prepared)])
+        finally:
+            compute_pool.stop()
+        self.assertFalse(compute_pool.started())
+
+
+    def test_make_data_frame(self):
+        """tests that day, hour, minute and engagement are derived from created_at in the formats of ES and get_data_on_fly, leaving data_dict unchanged
+        
+            :Signature: make_data_frame(data_dict)
+            :Data: created_at '2016-04-01T10:05:00' (Friday), '2016-04-03 23:59:00' (Sunday) and 'None'
+            
+        """
+        data_dict = {'twitter_id': 1, 
+                     'data': [{'id': 3, 'created_at': '2016-04-01T10:05:00', 
+                               'retweet_count': 2, 'favorite_count': 1}, 
+                              {'id': 2, 'created_at': '2016-04-03 23:59:00', 
+                               'retweet_count': 0, 'favorite_count': 0}, 
+                              {'id': 1, 'created_at': 'None', 
+                               'retweet_count': 5, 'favorite_count': 5}]}
+        df = core.make_data_frame(data_dict)['data_frame']
+        self.assertEqual(['day', 'engagement', 'favorite_count', 'hour', 'id', 
+                          'minute', 'retweet_count'], list(df.columns))
+        self.assertEqual([[4, 102, 1, 10, 3, 5, 2], [6, 0, 0, 23, 2, 59, 0]], 
+                         df.values.tolist())
+        self.assertIn('created_at', data_dict['data'][0])
+        self.assertTrue(core.make_data_frame({'twitter_id': 1, 'data': []})
+                            ['data_frame'].empty)
+
+
+    def test_get_columns_on_fly(self):
+        """tests that pages of the timeline are appended to TweetColumns as they arrive
+        
+            :Signature: get_columns_on_fly(authUid, save=True, **kwargs)
+            :Data: timeline of tweet ids 1 to 500 served 200 per page, count = 450
+            
+        """
+        handle = FakeTimelineHandle(range(1, 501))
+        data = core.get_columns_on_fly(19900726, save=False, count=450, 
+                                       twitter_handle=handle)['data']
+        self.assertEqual(450, len(data))
+        self.assertEqual(500, data.newest_id())
+        self.assertEqual(3, len(handle.calls))
+
+
+    def test_merge_data(self):
+        """tests function merge_data with repeated tweets and a cap
+        
+            :Signature: merge_data(newer, older, max_tweets=None)
+            :Data: newer ids [7, 9, 8, 7], older ids [6, 5, 4], max_tweets = 5
+            
+        """
+        newer = [{'id': i} for i in [7, 9, 8, 7]]
+        older = [{'id': i} for i in [6, 5, 4]]
+        self.assertEqual([9, 8, 7, 6, 5, 4], 
+                         [d['id'] for d in core.merge_data(newer, older)])
+        self.assertEqual([9, 8, 7, 6, 5], 
+                         [d['id'] for d in core.merge_data(newer, older, 5)])
+        
+        
+    def test_get_newer_data(self):
+        """tests that get_newer_data requests only tweets newer than since_id
+        
+            :Signature: get_newer_data(authUid, since_id, save=True, **kwargs)
+            :Data: timeline of tweet ids 1 to 10 served 3 per page, since_id = 6
+            
+        """
+        handle = FakeTimelineHandle(range(1, 11), page_size=3)
+        data = core.get_newer_data(19900726, 6, save=False, 
+                                   twitter_handle=handle)
+        self.assertEqual([7, 8, 9, 10], sorted(set(d['id'] for d in data)))
+        self.assertTrue(all(call['since_id'] == 6 for call in handle.calls))
+        
+        
+    def test_prepare_schedule_with_refresh(self):
+        """tests that a refresh merges tweets newer than the ES watermark from Twitter API into the tweets from ES, bypassing the schedule cache
+        
+            :Signature: prepare_schedule(authUid, use_es=True, use_tw=True, save_on_fly=True, max_tweets=None, use_cache=True, refresh=True, **kwargs)
+            :Data: FakeES with tweet ids 101 to 400, Twitter timeline with ids 101 to 420, schedule cached before the refresh
+            
+        """
+        fake_es = FakeES({7: fake_tweets(range(101, 401))})
+        handle = FakeTimelineHandle(range(101, 421))
+        store = schedule_cache.MemoryStore()
+        get_es_client = elasticsearch_util.get_es_client
+        counters = lambda: metrics.REGISTRY.snapshot()['counters']
+        try:
+            elasticsearch_util.get_es_client = lambda *a, **k: fake_es
+            schedule_cache.set_store(store)
+            cached = core.prepare_schedule(7, use_tw=False, 
+                                           use_aggregates=False)
+            entry = store.get(schedule_cache.cache_key(7, 0))
+            hits, misses = counters().get('schedule_cache.hits', 0), \
+                                counters().get('schedule_cache.misses', 0)
+            refreshed = core.prepare_schedule(7, refresh=True, 
+                                              use_aggregates=False, 
+                                              twitter_handle=handle)
+            self.assertTrue(all(call['since_id'] == 400 
+                                for call in handle.calls))
+            self.assertEqual(hits, counters().get('schedule_cache.hits', 0))
+            self.assertEqual(misses, 
+                             counters().get('schedule_cache.misses', 0))
+            self.assertEqual(entry, store.get(schedule_cache.cache_key(7, 0)))
+            fake_es.refresh()
+            self.assertEqual(320, len(fake_es.tweets['7']))
+            self.assertEqual(core.prepare_schedule(7, use_tw=False, 
+                                                   use_cache=False, 
+                                                   use_aggregates=False), 
+                             refreshed)
+            self.assertNotEqual(cached, refreshed)
+        finally:
+            elasticsearch_util.get_es_client = get_es_client
+            schedule_cache.set_store(None)
+        
+        
     def test_fill_incomplete_schedule(self):
         """tests function fill_incomplete_schedule
         
@@ -197,6 +690,31 @@ class CoreUnitTests(unittest.TestCase):
         self.assertDictEqual(completed_schedule, 
                              core.fill_incomplete_schedule(\
                                  incompplete_schedule))
+
+    
+    def test_fill_incomplete_schedule_copies_defaults(self):
+        """tests that filled days get lists of their own, leaving DEFAULT_SCHEDULE unchanged, and that repeated times count once
+        
+            :Signature: fill_incomplete_schedule(incomplete_schedule)
+            :Data: schedule of 'mon' with '18:00' twice and '10:45', filled twice
+            
+        """
+        default = list(core.DEFAULT_SCHEDULE)
+        incomplete = {'authUid': u'1-tw', 
+                      'completeSchedule': [{'day': 'mon', 
+                                            'times': ['18:00', '18:00', 
+                                                      '10:45']}]}
+        first = core.fill_incomplete_schedule(copy.deepcopy(incomplete))
+        second = core.fill_incomplete_schedule(copy.deepcopy(incomplete))
+        monday = first['completeSchedule'][0]['times']
+        self.assertEqual(['18:00', '18:00', '10:45'] + default[2:49], monday)
+        self.assertEqual(['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'], 
+                         [item['day'] for item in first['completeSchedule']])
+        for item in first['completeSchedule'][1:]:
+            self.assertEqual(default, item['times'])
+            item['times'].append('00:00')
+        self.assertEqual(default, list(core.DEFAULT_SCHEDULE))
+        self.assertEqual(default, second['completeSchedule'][1]['times'])
     
     
     def test_write_schedule(self):
@@ -234,6 +752,1367 @@ class ElasticsearchUnitTests(unittest.TestCase):
         self.assertTrue(flag, msg=msg)
         
 
+
+    def test_get_es_client_health(self):
+        """tests that get_es_client reuses the singleton client and get_es_health reports its state
+                    
+        """
+        cli = elasticsearch_util.get_es_client()
+        self.assertIs(cli, elasticsearch_util.get_es_client())
+        health = elasticsearch_util.get_es_health()
+        for key in ['alive', 'checked_at', 'live_connections', 
+                    'dead_connections']:
+            self.assertIn(key, health)
+        
+
+    def test_get_tweet_search_params_routing(self):
+        """tests that searches are routed only when routing is enabled and covers all indices searched
+        
+            :Signature: get_tweet_search_params(user_id, weeks=None)
+            :Data: user_id = 7, ES_USER_ROUTING off and on, ES_ROUTING_SINCE unset, last week and next week
+            
+        """
+        enabled = elasticsearch_util.ES_USER_ROUTING
+        since = elasticsearch_util.ES_ROUTING_SINCE
+        now = datetime.datetime.now()
+        week = lambda date: '-'.join(str(v) for v in date.isocalendar()[:2])
+        try:
+            elasticsearch_util.ES_USER_ROUTING = False
+            self.assertNotIn('routing', 
+                             elasticsearch_util.get_tweet_search_params(7))
+            self.assertIsNone(elasticsearch_util.get_routing(7))
+            elasticsearch_util.ES_USER_ROUTING = True
+            elasticsearch_util.ES_ROUTING_SINCE = ''
+            self.assertEqual('7', elasticsearch_util.get_tweet_search_params(
+                                    7)['routing'])
+            elasticsearch_util.ES_ROUTING_SINCE = week(
+                                    now - datetime.timedelta(weeks=1))
+            self.assertNotIn('routing', 
+                             elasticsearch_util.get_tweet_search_params(7))
+            self.assertEqual('7', elasticsearch_util.get_tweet_search_params(
+                                    7, weeks=2)['routing'])
+            self.assertNotIn('routing', 
+                             elasticsearch_util.get_tweet_search_params(
+                                7, weeks=3))
+            elasticsearch_util.ES_ROUTING_SINCE = week(
+                                    now + datetime.timedelta(weeks=1))
+            self.assertNotIn('routing', 
+                             elasticsearch_util.get_tweet_search_params(
+                                7, weeks=1))
+            self.assertEqual('7', elasticsearch_util.get_routing(7))
+        finally:
+            elasticsearch_util.ES_USER_ROUTING = enabled
+            elasticsearch_util.ES_ROUTING_SINCE = since
+
+
+    def test_get_tweet_indices(self):
+        """tests function get_tweet_indices with and without limit on weeks
+        
+            :Signature: get_tweet_indices(weeks=None)
+            :Data: weeks = 3
+            
+        """
+        self.assertEqual('tweets-index-*', 
+                         elasticsearch_util.get_tweet_indices())
+        indices = elasticsearch_util.get_tweet_indices(3).split(',')
+        self.assertEqual(3, len(set(indices)))
+        self.assertEqual(elasticsearch_util.get_tweet_index(), indices[0])
+        for index in indices:
+            self.assertRegexpMatches(index, r'^tweets-index-\d{4}-\d{1,2}$')
+        
+
+    def test_bulk_writer(self):
+        """tests that BulkWriter flushes on max_docs and on explicit flush, reporting documents indexed and each one rejected
+        
+            :Signature: BulkWriter(max_docs=None, max_bytes=None, max_seconds=None, callback=None)
+            :Data: fake ES client rejecting tweet 1, max_docs = 2, tweets 0, 1 and 2 of user 7 routed by user
+            
+        """
+        fake_es = FakeES({}, rejected=[1])
+        get_es_client = elasticsearch_util.get_es_client
+        flushes = []
+        try:
+            elasticsearch_util.get_es_client = lambda *a, **k: fake_es
+            writer = elasticsearch_util.BulkWriter(
+                        max_docs=2, 
+                        callback=lambda n, failures: flushes.append(
+                                                        (n, failures)))
+            for data_point in fake_tweets(range(3)):
+                writer.add({'_index': 'tweets-index-2016-13', 
+                            '_type': 'tweet', 
+                            '_id': data_point['id'], 
+                            '_routing': '7', 
+                            '_source': dict(data_point, user={'id': 7})})
+            self.assertEqual([(1, [{'_id': 1, 'status': 400, 
+                                    'error': 'MapperParsingException'}])], 
+                             flushes)
+            self.assertEqual((1, []), writer.flush())
+            self.assertEqual((0, []), writer.flush())
+        finally:
+            elasticsearch_util.get_es_client = get_es_client
+        self.assertEqual(2, len(flushes))
+        self.assertEqual(2, writer.indexed_count)
+        self.assertEqual(1, writer.failed_count)
+        self.assertEqual([[0, 1], [2]], [[action['index']['_id'] 
+                                           for action in actions] 
+                                          for actions in fake_es.bulks])
+        self.assertEqual('7', fake_es.bulks[0][0]['index']['_routing'])
+        fake_es.refresh()
+        self.assertEqual([2, 0], [d['id'] for d in fake_es.tweets['7']])
+
+
+class QueueWorkerUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.queue_worker against its in-memory LocalQueue"""
+
+    def make_queue(self, bodies, visibility_timeout=30):
+        """:Returns: LocalQueue with one message for each of given bodies
+        """
+        queue = queue_worker.LocalQueue(visibility_timeout=visibility_timeout)
+        for body in bodies:
+            queue.write(queue.new_message(body))
+        return queue
+
+
+    def test_consumer_deletes_processed_messages_in_batches(self):
+        """tests that processed messages are deleted in batches and failed ones are left for redelivery
+        
+            :Data: 25 messages with authUids 0 to 24, handler failing for multiples of 10, 1 malformed message
+            
+        """
+        queue = self.make_queue([json.dumps({'authUid': i}) 
+                                    for i in range(25)] + ['not json'])
+        seen = []
+
+        def handler(params):
+            seen.append(params['authUid'])
+            if params['authUid'] % 10 == 0:
+                raise ValueError("failing authUid")
+
+        consumer = queue_worker.QueueConsumer(queue, 
+                                              handler=handler, 
+                                              concurrency=10, 
+                                              wait_time_seconds=0)
+        while consumer.poll_once():
+            pass
+        consumer.stop()
+        self.assertEqual(range(25), sorted(seen))
+        self.assertEqual(23, consumer.processed_count)
+        self.assertEqual(3, consumer.failed_count)
+        self.assertEqual(3, len(queue.messages))
+        self.assertLessEqual(queue.delete_requests, 5)
+        self.assertEqual(0, queue.count())
+
+
+    def test_consumer_bounds_concurrency_and_extends_visibility(self):
+        """tests that no more than concurrency messages are in process and slow ones stay hidden
+        
+            :Data: 6 messages, concurrency 2, visibility_timeout 0.2 seconds, handler taking 0.3 seconds
+            
+        """
+        queue = self.make_queue([json.dumps({'authUid': i}) 
+                                    for i in range(6)])
+        active = []
+        peak = []
+
+        def handler(params):
+            active.append(params)
+            peak.append(len(active))
+            time.sleep(0.3)
+            active.remove(params)
+
+        consumer = queue_worker.QueueConsumer(queue, 
+                                              handler=handler, 
+                                              concurrency=2, 
+                                              visibility_timeout=0.2, 
+                                              wait_time_seconds=0)
+        received = 0
+        while received < 6:
+            received += consumer.poll_once()
+        consumer.stop()
+        self.assertLessEqual(max(peak), 2)
+        self.assertEqual(6, consumer.processed_count)
+        self.assertGreater(queue.visibility_requests, 0)
+        self.assertEqual(0, len(queue.messages))
+
+
+    def test_consumer_backs_off_while_queue_is_empty(self):
+        """tests that polls of an empty queue are spaced out exponentially up to max_backoff
+        
+            :Data: empty queue, min_backoff 0.05, max_backoff 0.2, consumer run for 1 second
+            
+        """
+        queue = self.make_queue([])
+        consumer = queue_worker.QueueConsumer(queue, 
+                                              handler=lambda params: None, 
+                                              wait_time_seconds=0, 
+                                              min_backoff=0.05, 
+                                              max_backoff=0.2)
+        runner = threading.Thread(target=consumer.run)
+        runner.start()
+        time.sleep(1)
+        consumer.stop()
+        runner.join()
+        self.assertLessEqual(queue.receive_requests, 8)
+        self.assertGreaterEqual(queue.receive_requests, 4)
+        self.assertEqual(0.2, metrics.REGISTRY.snapshot()['gauges']['worker.backoff'])
+
+
+    def test_consumer_applies_backpressure(self):
+        """tests that capacity halves while a downstream stage is slow and recovers after
+        
+            :Data: concurrency 8, max_stage_latency 0.05, handler recording stage.write of 0.1 seconds for the first 8 messages (the first batch received), then 0
+            
+        """
+        metrics.REGISTRY.reset()
+        queue = self.make_queue([json.dumps({'authUid': i}) 
+                                    for i in range(40)])
+        capacities = []
+
+        def handler(params):
+            metrics.REGISTRY.observe('stage.write', 
+                                     0.1 if params['authUid'] < 8 else 0)
+            capacities.append(consumer.capacity)
+
+        consumer = queue_worker.QueueConsumer(queue, 
+                                              handler=handler, 
+                                              concurrency=8, 
+                                              wait_time_seconds=0, 
+                                              max_stage_latency=0.05)
+        while consumer.poll_once():
+            pass
+        consumer.stop()
+        self.assertEqual(40, consumer.processed_count)
+        self.assertLess(min(capacities), 8)
+        self.assertEqual(8, consumer.capacity)
+        self.assertEqual(0, len(queue.messages))
+
+
+    def test_consumer_with_pipeline(self):
+        """tests that messages handed to a pipeline are deleted when they leave it and left for redelivery or deferred when a stage raises
+        
+            :Data: 20 messages, pipeline of 3 stages failing in compute for multiples of 7 and rate limited in fetch for authUid 19
+            
+        """
+        queue = self.make_queue([json.dumps({'authUid': i}) 
+                                    for i in range(20)])
+        written = []
+
+        def fetch(params):
+            if params['authUid'] == 19:
+                raise rate_limit.RateLimitExceeded(('19-tw', 'e'), 50)
+            return params['authUid']
+
+        def compute(authUid):
+            if authUid % 7 == 0:
+                raise ValueError("failing authUid")
+            return authUid
+
+        stages = pipeline.Pipeline([('fetch', fetch, 2), 
+                                    ('compute', compute, 1), 
+                                    ('write', written.append, 2)], 
+                                   queue_size=2)
+        consumer = queue_worker.QueueConsumer(queue, 
+                                              wait_time_seconds=0, 
+                                              pipeline=stages)
+        self.assertEqual(stages.capacity(), consumer.concurrency)
+        while consumer.poll_once():
+            pass
+        consumer.stop()
+        stages.close()
+        self.assertEqual([i for i in range(19) if i % 7], sorted(written))
+        self.assertEqual(16, consumer.processed_count)
+        self.assertEqual(4, consumer.failed_count)
+        self.assertEqual([0, 7, 14, 19], sorted(json.loads(message.get_body())['authUid'] 
+                                                for message in queue.messages.values()))
+        self.assertEqual(0, queue.count())
+
+
+
+class PipelineUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.pipeline"""
+
+    def test_pipeline_overlaps_stages(self):
+        """tests that stages of different items run at once, keeping order with one worker per stage, and are reported per stage
+        
+            :Signature: Pipeline(stages, queue_size=None, name='pipeline', logger_name="PipelineLogger")
+            :Data: 6 items through 3 stages of 1 worker taking 0.1 seconds each, queue_size 1
+            
+        """
+        def stage(step):
+            def function(item):
+                time.sleep(0.1)
+                return item + [step]
+            return function
+
+        results = []
+        stages = pipeline.Pipeline([('fetch', stage('f'), 1), 
+                                    ('compute', stage('c'), 1), 
+                                    ('write', stage('w'), 1)], 
+                                   queue_size=1, 
+                                   name='test_pipeline')
+        start = time.time()
+        for i in range(6):
+            stages.submit([i], lambda result, error: results.append(result))
+        snapshot = stages.close()
+        self.assertLess(time.time() - start, 1.4)
+        self.assertEqual([[i, 'f', 'c', 'w'] for i in range(6)], results)
+        self.assertEqual(['compute', 'fetch', 'write'], sorted(snapshot))
+        for state in snapshot.values():
+            self.assertEqual(6, state['processed'])
+            self.assertEqual(0, state['queued'])
+            self.assertEqual(1, state['queue_size'])
+            self.assertGreater(state['throughput'], 0)
+            self.assertGreater(state['utilization'], 0.3)
+        gauges = metrics.REGISTRY.snapshot()['gauges']
+        self.assertEqual(snapshot['write']['throughput'], 
+                         gauges['test_pipeline.write.throughput'])
+
+
+    def test_pipeline_ends_failed_items(self):
+        """tests that an item whose stage raises skips the later stages and reaches its callback with the error
+        
+            :Data: items 0 to 9 through 2 stages, the first raising for odd items
+            
+        """
+        def first(item):
+            if item % 2:
+                raise ValueError(item)
+            return item
+
+        second = []
+        outcomes = []
+        lock = threading.Lock()
+
+        def callback(result, error):
+            with lock:
+                outcomes.append((result, error))
+
+        stages = pipeline.Pipeline([('first', first, 3), 
+                                    ('second', lambda item: second.append(item) or item, 2)])
+        for i in range(10):
+            stages.submit(i, callback)
+        snapshot = stages.close()
+        self.assertEqual([0, 2, 4, 6, 8], sorted(second))
+        self.assertEqual([0, 2, 4, 6, 8], 
+                         sorted(result for result, error in outcomes 
+                                    if error is None))
+        self.assertEqual([1, 3, 5, 7, 9], 
+                         sorted(error.args[0] for result, error in outcomes 
+                                    if error is not None))
+        self.assertEqual(5, snapshot['first']['failed'])
+        self.assertEqual(5, snapshot['second']['processed'])
+
+
+class HttpUtilUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.http_util against a local StubServer"""
+
+    def setUp(self):
+        self.backoff_factor = http_util.HTTP_BACKOFF_FACTOR
+        http_util.HTTP_BACKOFF_FACTOR = 0.01
+        http_util.get_session(enforce_new=True)
+
+
+    def tearDown(self):
+        http_util.HTTP_BACKOFF_FACTOR = self.backoff_factor
+        http_util.get_session().close()
+        self.server.stop()
+
+
+    def test_request_retries_server_errors(self):
+        """tests that 5xx responses are retried over one kept-alive connection
+        
+            :Signature: get(url)
+            :Data: stub server answering 503 twice, then 200
+            
+        """
+        statuses = [503, 503, 200]
+        self.server = StubServer(lambda method, path, body: 
+                                    (statuses.pop(0), {})).start()
+        response = http_util.get(self.server.url + '/access_details')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, len(self.server.requests))
+        self.assertEqual(1, len(self.server.client_ports))
+
+
+    def test_request_returns_last_server_error(self):
+        """tests that the last 5xx response is returned after HTTP_MAX_RETRIES retries
+        
+            :Signature: put(url, json)
+            :Data: stub server always answering 500
+            
+        """
+        self.server = StubServer(lambda method, path, body: 
+                                    (500, {})).start()
+        response = http_util.put(self.server.url + '/1', json={})
+        self.assertEqual(500, response.status_code)
+        self.assertEqual(http_util.HTTP_MAX_RETRIES + 1, 
+                         len(self.server.requests))
+
+
+    def test_write_schedule_uses_session(self):
+        """tests that write_schedule PUTs the completed schedule to SAVE_SCHEDULE_URL
+        
+            :Signature: write_schedule(schedule)
+            :Data: schedule: <JSON loaded from test/data/test_completed_schedule.dict>, stub save_schedule API
+            
+        """
+        self.server = StubServer().start()
+        schedule = json.load(open("test/data/test_completed_schedule.dict"))
+        url = os.environ.get('SAVE_SCHEDULE_URL')
+        os.environ['SAVE_SCHEDULE_URL'] = self.server.url + '/schedule/'
+        try:
+            complete_schedule, response = core.write_schedule(schedule)
+        finally:
+            if url is None:
+                del os.environ['SAVE_SCHEDULE_URL']
+            else:
+                os.environ['SAVE_SCHEDULE_URL'] = url
+        self.assertEqual(200, response.status_code)
+        method, path, body = self.server.requests[0]
+        self.assertEqual('PUT', method)
+        self.assertEqual('/schedule/' + complete_schedule['authUid'], path)
+        self.assertDictEqual(complete_schedule, json.loads(body))
+
+
+
+class HelpersUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.helpers"""
+
+    def test_ttl_cache(self):
+        """tests expiry, LRU eviction, invalidation and counters of TTLCache
+        
+            :Signature: TTLCache(maxsize, ttl)
+            :Data: maxsize 2, ttl 0.2 seconds; keys a, b, c
+            
+        """
+        cache = helpers.TTLCache(maxsize=2, ttl=0.2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertTrue(cache.invalidate('c'))
+        self.assertFalse(cache.invalidate('c'))
+        self.assertEqual('default', cache.get('c', 'default'))
+        time.sleep(0.25)
+        self.assertIsNone(cache.get('a'))
+        self.assertDictEqual({'hits': 2, 'misses': 3, 'evictions': 1, 
+                              'size': 0}, cache.stats())
+
+
+    def test_prefetch(self):
+        """tests that items are produced ahead in order, that errors reach the consumer and that closing stops the producer
+        
+            :Signature: prefetch(iterable, size=1)
+            :Data: generator of 0 to 9, raising ValueError after 5 in one case
+            
+        """
+        produced = []
+        def produce(fail=False):
+            for i in range(10):
+                if fail and i == 5:
+                    raise ValueError("failed at 5")
+                produced.append(i)
+                yield i
+        self.assertEqual(range(10), list(helpers.prefetch(produce(), 2)))
+        consumed = []
+        with self.assertRaises(ValueError):
+            for i in helpers.prefetch(produce(True)):
+                consumed.append(i)
+        self.assertEqual(range(5), consumed)
+        del produced[:]
+        items = helpers.prefetch(produce(), 1)
+        self.assertEqual(0, next(items))
+        time.sleep(0.05)
+        self.assertLessEqual(len(produced), 3)
+        items.close()
+        time.sleep(0.25)
+        self.assertLessEqual(len(produced), 3)
+
+
+    def test_purge_keys_deep(self):
+        """tests that all given keys are removed from all nested levels of a dict in place
+        
+            :Signature: purge_keys_deep(a_dict, keys)
+            :Data: tweet-like dict with media, urls and url at several levels
+            
+        """
+        tweet = {'id': 1, 'url': 'u', 
+                 'entities': {'urls': [], 'media': [], 'hashtags': []}, 
+                 'user': {'id': 2, 'url': 'u', 
+                          'entities': {'url': {'urls': []}}}}
+        self.assertIs(tweet, helpers.purge_keys_deep(tweet, 
+                                                     ['media', 'urls', 'url']))
+        self.assertDictEqual({'id': 1, 'entities': {'hashtags': []}, 
+                              'user': {'id': 2, 'entities': {}}}, tweet)
+
+
+    def test_parse_twitter_time(self):
+        """tests that created_at of Twitter API is parsed as by strptime with its format, and that other strings raise ValueError
+        
+            :Signature: parse_twitter_time(time_str)
+            :Data: one timestamp per month; malformed timestamps
+            
+        """
+        for month in range(1, 13):
+            time_str = datetime.datetime(2016, month, 9, 7, 5, 3).strftime(
+                            "%a %b %d %H:%M:%S +0000 %Y")
+            self.assertEqual(datetime.datetime.strptime(time_str, 
+                                "%a %b %d %H:%M:%S +0000 %Y"), 
+                             helpers.parse_twitter_time(time_str))
+        for time_str in ['Fri Xyz 01 10:05:00 +0000 2016', 
+                         'Fri Apr 01 10:05:00 +0530 2016', '']:
+            self.assertRaises(ValueError, helpers.parse_twitter_time, 
+                              time_str)
+
+
+
+class TwitterDataUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.twitter_data against a local StubServer for access_details API"""
+
+    def setUp(self):
+        self.server = StubServer(lambda method, path, body: 
+                                    (200, {'code': 200})).start()
+        self.url = os.environ.get('ACCESS_DETAILS_URL')
+        os.environ['ACCESS_DETAILS_URL'] = self.server.url + '/access_details'
+        twitter_data.CREDENTIALS_CACHE.clear()
+        twitter_data.TWYTHON_CACHE.clear()
+
+
+    def tearDown(self):
+        if self.url is None:
+            del os.environ['ACCESS_DETAILS_URL']
+        else:
+            os.environ['ACCESS_DETAILS_URL'] = self.url
+        http_util.get_session().close()
+        self.server.stop()
+
+
+    def test_credentials_are_cached(self):
+        """tests that credentials and Twython objects are fetched once per authUid until invalidated
+        
+            :Signature: make_twython(authUid), get_credentials(authUid), invalidate_credentials(authUid)
+            :Data: authUids 1 and '1-tw' naming the same user
+            
+        """
+        before = twitter_data.get_cache_stats()
+        handle = twitter_data.make_twython(1)
+        self.assertIs(handle, twitter_data.make_twython('1-tw'))
+        self.assertDictEqual(twitter_data.get_credentials(1), 
+                             twitter_data.get_credentials(u'1'))
+        self.assertEqual(1, len(self.server.requests))
+        twitter_data.invalidate_credentials(1)
+        self.assertIsNot(handle, twitter_data.make_twython(1))
+        self.assertEqual(2, len(self.server.requests))
+        stats = twitter_data.get_cache_stats()
+        self.assertEqual(1, stats['twython']['hits'] - 
+                            before['twython']['hits'])
+        self.assertEqual(2, stats['credentials']['misses'] - 
+                            before['credentials']['misses'])
+
+
+    def test_missing_credentials_are_not_cached(self):
+        """tests that ValueError for credentials unavailable with Crowdfire is raised on every call
+        
+            :Signature: get_credentials(authUid)
+            :Data: access_details API answering code 604
+            
+        """
+        self.server.respond = lambda method, path, body: (200, {'code': 604})
+        for _ in range(2):
+            self.assertRaises(ValueError, twitter_data.get_credentials, 1)
+        self.assertEqual(2, len(self.server.requests))
+
+
+    def test_fetch_follower_timelines(self):
+        """tests that followers are crawled concurrently and that a crawl resumes from its checkpoint, retrying only failed followers
+        
+            :Signature: fetch_follower_timelines(authUid, followers_count, tweets_count, workers, checkpoint, save_to_es, twitter_handle)
+            :Data: 20 followers with 5 tweets each, served after 50 ms; follower 7 failing on first crawl. Each thread requests with own copy of the handle
+            
+        """
+        directory = tempfile.mkdtemp()
+        checkpoint = os.path.join(directory, 'followers.checkpoint')
+        try:
+            handle = FakeFollowerHandle(range(1, 21), range(1, 6), 
+                                        delay=0.05, failing=[7])
+            user = twitter_data.TwitterUser()
+            start = time.time()
+            progress = user.fetch_follower_timelines(
+                            773, tweets_count=10, workers=5, 
+                            checkpoint=checkpoint, save_to_es=False, 
+                            twitter_handle=handle)
+            self.assertLess(time.time() - start, 20 * 0.05)
+            self.assertEqual(20, progress['followers'])
+            self.assertEqual(19, progress['completed'])
+            self.assertEqual(1, progress['failed'])
+            self.assertEqual(19 * 5, progress['tweets'])
+            self.assertGreater(progress['followers_per_minute'], 0)
+            handles = set(handle.handles)
+            self.assertNotIn(id(handle), handles)
+            self.assertGreater(len(handles), 1)
+            self.assertLessEqual(len(handles), 5)
+            self.assertEqual(set(range(1, 21)) - set([7]), 
+                             twitter_data.load_checkpoint(checkpoint))
+            handle.failing.clear()
+            del handle.calls[:]
+            progress = user.fetch_follower_timelines(
+                            773, tweets_count=10, workers=5, 
+                            checkpoint=checkpoint, save_to_es=False, 
+                            twitter_handle=handle)
+            self.assertEqual(19, progress['skipped'])
+            self.assertEqual(1, progress['completed'])
+            self.assertEqual(set([7]), 
+                             set(c['user_id'] for c in handle.calls))
+            self.assertEqual(set(range(1, 21)), 
+                             twitter_data.load_checkpoint(checkpoint))
+        finally:
+            shutil.rmtree(directory)
+
+
+    def fake_twitter(self, method, path, body, delay=0, statuses=None):
+        """respond of the stub server standing in for access_details API and Twitter user_timeline API
+
+            User u has 450 tweets of ids u * 1000 + 1 through u * 1000 + 450; statuses maps user_id to statuses of its first responses
+        """
+        url = urlparse.urlparse(path)
+        if not url.path.endswith('/statuses/user_timeline.json'):
+            return 200, {'code': 200}
+        time.sleep(delay)
+        params = dict(urlparse.parse_qsl(url.query))
+        user_id = int(params['user_id'])
+        queued = (statuses or {}).get(user_id)
+        if queued:
+            status = queued.pop(0)
+            return status, {}, {'x-rate-limit-remaining': 0, 
+                                'x-rate-limit-reset': time.time() + 0.2}
+        max_id = int(params.get('max_id', user_id * 1000 + 450))
+        ids = range(max_id, user_id * 1000, -1)[:int(params['count'])]
+        return 200, [{'id': i, 'user': {'id': user_id}} for i in ids], \
+                    {'x-rate-limit-remaining': 100, 
+                     'x-rate-limit-reset': int(time.time()) + 900}
+
+
+    def test_request_timelines(self):
+        """tests that timelines of many users are fetched concurrently from Twitter API with OAuth1 signed requests, page by page
+        
+            :Signature: request_timelines(timelines, save_to_es, workers, api_url)
+            :Data: fake Twitter API answering after 50 ms; 4 users with 450 tweets each, 400 requested in 2 pages
+            
+        """
+        self.server.respond = lambda method, path, body: \
+                                self.fake_twitter(method, path, body, 
+                                                  delay=0.05)
+        user = twitter_data.TwitterUser()
+        start = time.time()
+        timelines = user.request_timelines(
+                        [{'authUid': 781, 'user_id': u, 'count': 400} 
+                            for u in range(1, 5)], 
+                        save_to_es=False, workers=4, 
+                        api_url=self.server.url + '/1.1')
+        self.assertLess(time.time() - start, 8 * 0.05)
+        self.assertEqual(range(1, 5), sorted(timelines))
+        for u, timeline in timelines.items():
+            self.assertEqual(400, len(timeline))
+            self.assertEqual(u * 1000 + 450, timeline[0]['id'])
+        self.assertEqual(8, user.timeline_request_record)
+        timeline_requests = [(path, headers) for 
+                                (method, path, body), headers in 
+                                zip(self.server.requests, 
+                                    self.server.request_headers)
+                                if 'user_timeline' in path]
+        self.assertEqual(8, len(timeline_requests))
+        for path, headers in timeline_requests:
+            self.assertIn('trim_user=true', path)
+            self.assertTrue(headers['authorization'].startswith('OAuth '))
+
+
+    def test_request_timeline_uses_fetcher(self):
+        """tests that request_timeline and iter_timeline page through the timeline with OAuth1 signed requests of TimelineFetcher
+        
+            :Signature: request_timeline(authUid, save_to_es=True, **kwargs), iter_timeline(authUid, save_to_es=True, prefetch=1, **kwargs)
+            :Data: fake Twitter API as TWITTER_API_URL; user 1 with 450 tweets, 400 requested; user 3 answered 404
+            
+        """
+        self.server.respond = lambda method, path, body: \
+                                self.fake_twitter(method, path, body, 
+                                                  statuses={3: [404]})
+        api_url = twitter_data.TWITTER_API_URL
+        try:
+            twitter_data.TWITTER_API_URL = self.server.url
+            user = twitter_data.TwitterUser()
+            timeline = user.request_timeline(781, save_to_es=False, 
+                                             user_id=1, count=400)
+            self.assertEqual(400, len(timeline))
+            self.assertEqual(1450, timeline[0]['id'])
+            self.assertEqual([200, 200], 
+                             [len(page) for page in user.iter_timeline(
+                                781, save_to_es=False, user_id=1, 
+                                count=400)])
+            self.assertEqual(4, user.timeline_request_record)
+            with self.assertRaises(TwythonError):
+                user.request_timeline(781, save_to_es=False, user_id=3)
+        finally:
+            twitter_data.TWITTER_API_URL = api_url
+
+
+    def test_request_timelines_handles_errors(self):
+        """tests that a rate limited page is retried after the window resets and that rejected timelines do not stop the others
+        
+            :Signature: request_timelines(timelines, save_to_es, workers, api_url)
+            :Data: fake Twitter API answering 429 then 200 for user 1, 401 for user 2 and 404 for user 3
+            
+        """
+        statuses = {1: [429], 2: [401], 3: [404]}
+        self.server.respond = lambda method, path, body: \
+                                self.fake_twitter(method, path, body, 
+                                                  statuses=statuses)
+        user = twitter_data.TwitterUser()
+        fetcher = twitter_data.TimelineFetcher(user, workers=2, 
+                                               api_url=self.server.url)
+        start = time.time()
+        timelines = fetcher.fetch_timelines(
+                        [{'authUid': 780 + u, 'user_id': u} 
+                            for u in range(1, 4)], 
+                        save_to_es=False)
+        self.assertGreater(time.time() - start, 0.15)
+        self.assertEqual(200, len(timelines[1]))
+        self.assertEqual([], timelines[2])
+        self.assertEqual([], timelines[3])
+        self.assertEqual([3], fetcher.failures.keys())
+        self.assertEqual(404, fetcher.failures[3].error_code)
+
+
+    def test_normalize_tweets(self):
+        """tests that tweets are projected to the fields scheduled and saved, with created_at parsed, or only purged without projection
+        
+            :Signature: normalize_tweets(tweets, projection)
+            :Data: tweet with entities, user object and created_at; tweet without created_at
+            
+        """
+        tweets = [{'id': 5, 'created_at': 'Fri Apr 01 10:05:00 +0000 2016', 
+                   'retweet_count': 1, 'favorite_count': 2, 'text': 't', 
+                   'entities': {'urls': [], 'hashtags': []}, 
+                   'user': {'id': 7, 'url': 'u', 'name': 'n'}}, 
+                  {'id': 4}]
+        normalized = twitter_data.normalize_tweets(tweets)
+        self.assertNotIsInstance(normalized, list)
+        self.assertEqual([{'id': 5, 
+                           'created_at': datetime.datetime(2016, 4, 1, 10, 5), 
+                           'retweet_count': 1, 'favorite_count': 2, 
+                           'user': {'id': 7}}, 
+                          {'id': 4, 'created_at': None}], list(normalized))
+        tweet = list(twitter_data.normalize_tweets(tweets[:1], None))[0]
+        self.assertDictEqual({'hashtags': []}, tweet['entities'])
+        self.assertDictEqual({'id': 7, 'name': 'n'}, tweet['user'])
+        self.assertEqual(datetime.datetime(2016, 4, 1, 10, 5), 
+                         tweet['created_at'])
+
+
+    def test_iter_timeline(self):
+        """tests that pages are yielded as they arrive, requested at most prefetch pages ahead, and collected by request_timeline
+        
+            :Signature: iter_timeline(authUid, save_to_es=True, prefetch=1, **kwargs)
+            :Data: timeline of tweet ids 1 to 1000 served 200 per page, count = 900
+            
+        """
+        handle = FakeTimelineHandle(range(1, 1001))
+        user = twitter_data.TwitterUser()
+        sizes = []
+        for page in user.iter_timeline(782, save_to_es=False, count=900, 
+                                       twitter_handle=handle):
+            time.sleep(0.02)
+            self.assertLessEqual(len(handle.calls), len(sizes) + 3)
+            sizes.append(len(page))
+        self.assertEqual([200, 200, 200, 200, 100], sizes)
+        for prefetch in [0, 1]:
+            del handle.calls[:]
+            timeline = user.request_timeline(782, save_to_es=False, 
+                                             count=900, prefetch=prefetch, 
+                                             twitter_handle=handle)
+            self.assertEqual(900, len(timeline))
+            self.assertEqual(1000, timeline[0]['id'])
+            self.assertIsInstance(timeline[0]['created_at'], 
+                                  datetime.datetime)
+            self.assertEqual(5, len(handle.calls))
+        handle = FakeFollowerHandle([], range(1, 1001), failing=[783])
+        with self.assertRaises(TwythonError):
+            user.request_timeline(783, save_to_es=False, count=900, 
+                                  twitter_handle=handle)
+
+
+    def test_load_checkpoint_ignores_unterminated_line(self):
+        """tests that an id left unterminated by an interrupted crawl is ignored and not joined with the next id appended
+        
+            :Signature: load_checkpoint(path), open_checkpoint(path)
+            :Data: checkpoint '1\\n2\\n3'
+            
+        """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'followers.checkpoint')
+        try:
+            self.assertEqual(set(), twitter_data.load_checkpoint(path))
+            with open(path, 'w') as fp:
+                fp.write('1\n2\n3')
+            self.assertEqual(set([1, 2]), twitter_data.load_checkpoint(path))
+            fp = twitter_data.open_checkpoint(path)
+            fp.write('4\n')
+            fp.close()
+            self.assertEqual(set([1, 2, 4]), 
+                             twitter_data.load_checkpoint(path))
+        finally:
+            shutil.rmtree(directory)
+
+
+
+class ScheduleCacheUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.schedule_cache"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        schedule_cache.set_store(None)
+
+
+    def check_store(self, store):
+        """Checks get, set, delete and LRU eviction of given store of maxsize 2
+        """
+        evictions = metrics.REGISTRY.snapshot()['counters'].get(
+                        'schedule_cache.evictions', 0)
+        entry = {'watermark': {'newest_id': 2, 'count': 2}, 
+                 'schedule': {'authUid': u'1-tw', 'completeSchedule': []}}
+        self.assertIsNone(store.get(u'1-0'))
+        store.set(u'1-0', entry)
+        store.set(u'2-0', entry)
+        self.assertEqual(entry, store.get(u'1-0'))
+        time.sleep(0.01)
+        store.set(u'3-0', entry)
+        self.assertIsNone(store.get(u'2-0'))
+        self.assertEqual(entry, store.get(u'1-0'))
+        self.assertEqual(2, store.size())
+        store.delete(u'3-0')
+        self.assertIsNone(store.get(u'3-0'))
+        self.assertEqual(evictions + 1, metrics.REGISTRY.snapshot()[
+                            'counters']['schedule_cache.evictions'])
+
+
+    def test_memory_store(self):
+        """tests MemoryStore and that it returns copies of entries
+        
+            :Signature: MemoryStore(maxsize)
+            :Data: maxsize = 2
+            
+        """
+        store = schedule_cache.MemoryStore(maxsize=2)
+        self.check_store(store)
+        store.get(u'1-0')['schedule']['completeSchedule'].append({})
+        self.assertEqual([], store.get(u'1-0')['schedule']['completeSchedule'])
+
+
+    def test_disk_store(self):
+        """tests DiskStore and that its entries outlive the instance
+        
+            :Signature: DiskStore(directory, maxsize)
+            :Data: temporary directory, maxsize = 2
+            
+        """
+        self.check_store(schedule_cache.DiskStore(self.directory, maxsize=2))
+        self.assertIsNotNone(schedule_cache.DiskStore(self.directory).get(
+                                u'1-0'))
+
+
+    def test_get_schedule_checks_watermark(self):
+        """tests that a cached schedule is returned only for the watermark it was computed with
+        
+            :Signature: get_schedule(authUid, max_tweets, watermark), put_schedule(authUid, max_tweets, watermark, schedule)
+            :Data: authUid = 1, watermarks with newest_id 5 and 6
+            
+        """
+        schedule_cache.set_store(schedule_cache.MemoryStore())
+        schedule = {'authUid': u'1-tw', 'completeSchedule': [], 
+                    'source': 'internal'}
+        watermark = {'newest_id': 5, 'newest_created_at': u'2016-04-01', 
+                     'count': 3}
+        schedule_cache.put_schedule(1, 0, watermark, schedule)
+        self.assertEqual(schedule, 
+                         schedule_cache.get_schedule(1, 0, dict(watermark)))
+        self.assertIsNone(schedule_cache.get_schedule(1, 100, watermark))
+        watermark['newest_id'] = 6
+        self.assertIsNone(schedule_cache.get_schedule(1, 0, watermark))
+
+
+    def test_prepare_schedule_reuses_cache(self):
+        """tests that prepare_schedule returns the cached schedule on a repeat call, and computes it anew once ES has a newer tweet
+        
+            :Signature: prepare_schedule(authUid, use_es=True, use_tw=True, save_on_fly=True, max_tweets=None, use_cache=True, **kwargs)
+            :Data: authUid = u'19900726' with 300 tweets in a fake ES, then tweet 301 added, use_tw = False
+            
+        """
+        authUid = u'19900726'
+        fake_es = FakeES({authUid: fake_tweets(range(1, 301))})
+        saved = elasticsearch_util.get_es_client
+        schedule_cache.set_store(schedule_cache.MemoryStore())
+        hits = lambda: metrics.REGISTRY.snapshot()['counters'].get(
+                            'schedule_cache.hits', 0)
+        try:
+            elasticsearch_util.get_es_client = lambda *a, **k: fake_es
+            first = core.prepare_schedule(authUid, use_tw=False)
+            searches, before = len(fake_es.searches), hits()
+            self.assertEqual(first, core.prepare_schedule(authUid, 
+                                                          use_tw=False))
+            self.assertEqual(before + 1, hits())
+            self.assertEqual(searches + 1, len(fake_es.searches))
+            fake_es.tweets[authUid].insert(0, fake_tweets([301], seed=1)[0])
+            self.assertEqual(core.compute_times(core.make_data_frame(
+                                core.get_data_from_es(authUid))), 
+                             core.prepare_schedule(authUid, use_tw=False))
+            self.assertEqual(before + 1, hits())
+        finally:
+            elasticsearch_util.get_es_client = saved
+
+
+
+class TweetColumnsUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.tweet_columns"""
+
+    def data(self, ids):
+        """Returns data_points of given tweet ids as from ES, tweet i created at minute i of 2016-04-01 10:00 (Friday)
+        """
+        return [{'id': i, 'created_at': '2016-04-01T10:%02d:00' % i, 
+                 'retweet_count': i, 'favorite_count': 1} for i in ids]
+
+
+    def test_from_data(self):
+        """tests that data_points are stored in typed arrays of 27 bytes per tweet and read back as the DataFrame of make_data_frame
+        
+            :Signature: TweetColumns.from_data(data), to_data_frame()
+            :Data: tweets 3, 2, 1 and one without created_at
+            
+        """
+        data = self.data([3, 2, 1]) + [{'id': 0, 'retweet_count': 1}]
+        columns = tweet_columns.TweetColumns.from_data(data)
+        self.assertEqual(3, len(columns))
+        self.assertEqual(3 * 27, columns.nbytes())
+        self.assertEqual(3, columns.newest_id())
+        self.assertEqual([4, 4, 4], columns.column('day').tolist())
+        df = columns.to_data_frame()
+        self.assertEqual([103, 102, 101], df['engagement'].tolist())
+        self.assertEqual(core.make_data_frame({'twitter_id': 1, 'data': data})
+                            ['data_frame'].values.tolist(), 
+                         df.values.tolist())
+        self.assertTrue(tweet_columns.TweetColumns().to_data_frame().empty)
+        self.assertIsNone(tweet_columns.TweetColumns().newest_id())
+
+
+    def test_merge(self):
+        """tests that merge keeps tweets in the order and with the cap of core.merge_data
+        
+            :Signature: merge(newer, max_tweets=None)
+            :Data: newer ids [7, 9, 8, 7], older ids [6, 5, 4], max_tweets = 5
+            
+        """
+        older = tweet_columns.TweetColumns.from_data(self.data([6, 5, 4]))
+        newer = tweet_columns.TweetColumns.from_data(self.data([7, 9, 8, 7]))
+        self.assertEqual([9, 8, 7, 6, 5, 4], 
+                         older.merge(newer).column('id').tolist())
+        merged = older.merge(newer, 5)
+        self.assertEqual([9, 8, 7, 6, 5], merged.column('id').tolist())
+        self.assertEqual([9, 8, 7, 6, 5], 
+                         merged.column('retweet_count').tolist())
+        self.assertEqual([6, 5, 4], older.column('id').tolist())
+        self.assertEqual([6, 5, 4], 
+                         older.merge(tweet_columns.TweetColumns())
+                            .column('id').tolist())
+
+
+    def test_pack(self):
+        """tests that packed arrays take nbytes and unpack to equal columns
+        
+            :Signature: pack(), TweetColumns.unpack(packed)
+            :Data: tweets 0 to 59
+            
+        """
+        columns = tweet_columns.TweetColumns.from_data(self.data(range(60)))
+        packed = columns.pack()
+        self.assertEqual(columns.nbytes(), sum(len(v) for v in packed.values()))
+        unpacked = tweet_columns.TweetColumns.unpack(packed)
+        for name, _ in tweet_columns.FIELDS:
+            self.assertEqual(columns.column(name).tolist(), 
+                             unpacked.column(name).tolist())
+
+
+    def test_int64_storage(self):
+        """tests that ids beyond 32 bits are kept in 8 bytes per item, also where the only 8-byte typecode is 'd' as on platforms with 4-byte C long
+        
+            :Signature: int64_typecode(), TweetColumns.from_data(data), pack(), TweetColumns.unpack(packed), newest_id(), merge(newer, max_tweets=None)
+            :Data: tweet ids 2 ** 62 + 2, 2 ** 62 + 1 and 1, typecodes of int64_typecode and 'd'
+            
+        """
+        self.assertEqual(8, tweet_columns.array.array(
+                                tweet_columns.int64_typecode()).itemsize)
+        fields, dtypes = tweet_columns.FIELDS, tweet_columns.DTYPES
+        ids = [2 ** 62 + 2, 2 ** 62 + 1]
+        try:
+            for code in [tweet_columns.INT64, 'd']:
+                tweet_columns.FIELDS = [(name, code if c == 
+                                            tweet_columns.INT64 else c) 
+                                        for name, c in fields]
+                tweet_columns.DTYPES = {code: 'int64', 'b': 'int8'}
+                columns = tweet_columns.TweetColumns.from_data(
+                                [dict(d, id=i) for d, i in 
+                                 zip(self.data([2, 1]), ids)] + 
+                                self.data([1]))
+                columns = tweet_columns.TweetColumns.unpack(columns.pack())
+                self.assertEqual(3 * 27, columns.nbytes())
+                self.assertEqual(ids + [1], columns.column('id').tolist())
+                self.assertEqual(ids[0], columns.newest_id())
+                self.assertEqual(ids[:1], tweet_columns.TweetColumns().merge(
+                                    columns, 1).column('id').tolist())
+        finally:
+            tweet_columns.FIELDS, tweet_columns.DTYPES = fields, dtypes
+
+
+
+class AggregatesUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.aggregates"""
+
+    def make_data(self, n, engagement, seed=0):
+        """Returns data_dict of n tweets, most recent first, with day, hour, minute and given engagement column as from make_data_frame
+        """
+        rng = core.np.random.RandomState(seed)
+        return {'twitter_id': 19900726L, 
+                'data_frame': core.pd.DataFrame({
+                    'id': core.np.arange(n, 0, -1) * 1000, 
+                    'day': rng.randint(0, 7, n), 
+                    'hour': rng.randint(0, 24, n), 
+                    'minute': rng.randint(0, 60, n), 
+                    'engagement': engagement})}
+
+
+    def test_prepare_schedule_rebuilds_after_backfill(self):
+        """tests that the aggregate used by prepare_schedule folds new tweets in and is rebuilt when ES gains tweets older than its newest one
+        
+            :Signature: prepare_schedule(authUid, use_tw=False, use_cache=False, use_aggregates=True)
+            :Data: FakeES with even tweet ids 2 to 600, then 20 newer ones, then odd ids 1 to 599 backfilled with high engagement
+            
+        """
+        tweets = {7: fake_tweets(range(2, 601, 2))}
+        get_es_client = elasticsearch_util.get_es_client
+        elasticsearch_util.get_es_client = lambda *args, **kwargs: \
+                                                FakeES(tweets)
+        aggregates.set_store(aggregates.create_store('memory'))
+        metrics.REGISTRY.reset()
+        expected = lambda: core.prepare_schedule(7, use_tw=False, 
+                                                 use_cache=False, 
+                                                 use_aggregates=False)
+        schedule = lambda: core.prepare_schedule(7, use_tw=False, 
+                                                 use_cache=False, 
+                                                 use_aggregates=True)
+        try:
+            self.assertEqual(expected(), schedule())
+            tweets[7] += fake_tweets(range(601, 621), seed=1)
+            self.assertEqual(expected(), schedule())
+            self.assertEqual(320, aggregates.get_aggregate(7)['es_count'])
+            self.assertNotIn('aggregates.rebuilds', 
+                             metrics.REGISTRY.snapshot()['counters'])
+            backfill = fake_tweets(range(1, 600, 2), seed=2)
+            for data_point in backfill:
+                data_point['favorite_count'] = 50
+            tweets[7] += backfill
+            self.assertEqual(expected(), schedule())
+            self.assertEqual(1, metrics.REGISTRY.snapshot()['counters']
+                                    ['aggregates.rebuilds'])
+            self.assertEqual(620, aggregates.get_aggregate(7)['count'])
+        finally:
+            elasticsearch_util.get_es_client = get_es_client
+            aggregates.set_store(None)
+
+
+    def test_refresh_does_not_rebuild_aggregate(self):
+        """tests that tweets fetched from Twitter API by a refresh and saved to ES do not make the next call rebuild the aggregate
+        
+            :Signature: prepare_schedule(authUid, refresh=True, use_aggregates=True, twitter_handle=<handle>)
+            :Data: FakeES with tweet ids 101 to 400, Twitter timeline with ids 101 to 420, searchable in ES after the refresh call;
+                plain call, then a backfill of tweets 1 to 5
+            
+        """
+        fake_es = FakeES({7: fake_tweets(range(101, 401))})
+        get_es_client = elasticsearch_util.get_es_client
+        elasticsearch_util.get_es_client = lambda *args, **kwargs: fake_es
+        aggregates.set_store(aggregates.create_store('memory'))
+        metrics.REGISTRY.reset()
+        schedule = lambda **kwargs: core.prepare_schedule(7, 
+                                                          use_cache=False, 
+                                                          use_aggregates=True, 
+                                                          **kwargs)
+        expected = lambda: core.prepare_schedule(7, use_tw=False, 
+                                                 use_cache=False, 
+                                                 use_aggregates=False)
+        try:
+            schedule(use_tw=False)
+            schedule(refresh=True, 
+                     twitter_handle=FakeTimelineHandle(range(101, 421)))
+            self.assertEqual(300, len(fake_es.tweets['7']))
+            fake_es.refresh()
+            self.assertEqual(320, len(fake_es.tweets['7']))
+            self.assertEqual(320, aggregates.get_aggregate(7)['es_count'])
+            self.assertEqual(expected(), schedule(use_tw=False))
+            self.assertNotIn('aggregates.rebuilds', 
+                             metrics.REGISTRY.snapshot()['counters'])
+            fake_es.tweets['7'] += fake_tweets(range(5, 0, -1), seed=3)
+            self.assertEqual(expected(), schedule(use_tw=False))
+            self.assertEqual(1, metrics.REGISTRY.snapshot()['counters']
+                                    ['aggregates.rebuilds'])
+        finally:
+            elasticsearch_util.get_es_client = get_es_client
+            aggregates.set_store(None)
+
+
+    def test_fold_matches_compute_times(self):
+        """tests that schedules derived from aggregates folded in steps equal compute_times from all tweets
+        
+            :Signature: fold(aggregate, ids, day, hour, minute, engagement), derive_schedule(aggregate)
+            :Data: 3000 tweets with engagement in [0, 3) (many ties), all 0 and all 5, folded oldest first in steps of 400 with repeats
+            
+        """
+        rng = core.np.random.RandomState(1)
+        for engagement in [rng.randint(0, 3, 3000), 
+                           core.np.zeros(3000, dtype=int), 
+                           core.np.repeat(5, 3000)]:
+            data = self.make_data(3000, engagement)
+            df = data['data_frame']
+            aggregate = aggregates.new_aggregate(data['twitter_id'])
+            for stop in range(3000, 0, -400):
+                chunk = df.iloc[max(stop - 500, 0):stop]
+                aggregates.fold(aggregate, chunk['id'].values, 
+                                chunk['day'].values, chunk['hour'].values, 
+                                chunk['minute'].values, 
+                                chunk['engagement'].values)
+            self.assertEqual(3000, aggregate['count'])
+            self.assertEqual(core.compute_times(data), 
+                             aggregates.derive_schedule(aggregate))
+            stats = aggregates.slot_statistics(aggregate)
+            self.assertEqual(3000, sum(v['tweets'] for v in stats.values()))
+
+
+    def test_disk_store_round_trip(self):
+        """tests that an aggregate read back from a DiskStore keeps folding to the same schedule
+        
+            :Signature: put_aggregate(aggregate), get_aggregate(twitter_id)
+            :Data: 1000 tweets with engagement in [0, 50), folded 600 oldest, stored, read back, then 400 newest
+            
+        """
+        directory = tempfile.mkdtemp()
+        aggregates.set_store(schedule_cache.DiskStore(directory))
+        try:
+            rng = core.np.random.RandomState(2)
+            data = self.make_data(1000, rng.randint(0, 50, 1000))
+            df = data['data_frame']
+            aggregate = aggregates.new_aggregate(data['twitter_id'])
+            core.fold_data_frame(aggregate, df.iloc[400:])
+            aggregates.put_aggregate(aggregate)
+            aggregate = aggregates.get_aggregate(data['twitter_id'])
+            core.fold_data_frame(aggregate, df)
+            self.assertEqual(1000, aggregate['count'])
+            self.assertEqual(core.compute_times(data), 
+                             aggregates.derive_schedule(aggregate))
+        finally:
+            aggregates.set_store(None)
+            shutil.rmtree(directory)
+
+
+
+class JobsUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.jobs and async mode of publish_schedule API"""
+
+    def test_job_manager(self):
+        """tests status and result of succeeding and failing jobs and expiry of finished ones
+        
+            :Signature: JobManager(workers, ttl)
+            :Data: workers = 2, ttl = 0.2 seconds; jobs returning x * 2 and raising ValueError
+            
+        """
+        manager = jobs.JobManager(workers=2, ttl=0.2)
+        def double(x):
+            time.sleep(0.05)
+            return x * 2
+        def fail():
+            raise ValueError("bad job")
+        succeeding = manager.submit(double, 21)
+        failing = manager.submit(fail)
+        self.assertIn(manager.get(succeeding)['status'], 
+                      ['queued', 'running'])
+        manager.close()
+        self.assertEqual('succeeded', manager.get(succeeding)['status'])
+        self.assertEqual(42, manager.get(succeeding)['result'])
+        self.assertEqual('failed', manager.get(failing)['status'])
+        self.assertEqual('ValueError: bad job', manager.get(failing)['error'])
+        self.assertIsNone(manager.get('unknown'))
+        time.sleep(0.25)
+        with manager.lock:
+            manager.purge()
+        self.assertIsNone(manager.get(succeeding))
+
+
+    def test_publish_schedule_async(self):
+        """tests that publish_schedule in async mode responds 202 with a job whose status URL serves the schedule
+        
+            :URL: '/api/v1.0/publishschedule', '/api/v1.0/publishschedule/jobs/<job_id>'
+            :Data: {'authUid': u'19900726-tw', 'use_es': False, 'use_tw': False, 'async': True}, stub save_schedule API
+            
+        """
+        server = StubServer().start()
+        url = os.environ.get('SAVE_SCHEDULE_URL')
+        os.environ['SAVE_SCHEDULE_URL'] = server.url + '/schedule/'
+        try:
+            client = api.app.test_client()
+            response = client.post('/api/v1.0/publishschedule', 
+                                   data=json.dumps({'authUid': u'19900726-tw', 
+                                                    'use_es': False, 
+                                                    'use_tw': False, 
+                                                    'async': True}), 
+                                   content_type='application/json')
+            self.assertEqual(202, response.status_code)
+            body = json.loads(response.data)
+            self.assertTrue(response.headers['Location'].endswith(
+                                body['status_url']))
+            for _ in range(100):
+                job = json.loads(client.get(body['status_url']).data)
+                if job['status'] in ['succeeded', 'failed']:
+                    break
+                time.sleep(0.05)
+            self.assertEqual('succeeded', job['status'])
+            self.assertEqual(u'19900726-tw', job['result']['authUid'])
+            self.assertEqual(404, client.get(
+                '/api/v1.0/publishschedule/jobs/unknown').status_code)
+        finally:
+            if url is None:
+                del os.environ['SAVE_SCHEDULE_URL']
+            else:
+                os.environ['SAVE_SCHEDULE_URL'] = url
+            http_util.get_session().close()
+            server.stop()
+
+
+
+class RateLimitUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.rate_limit"""
+
+    def test_rate_limiter(self):
+        """tests waiting for and rejecting requests beyond capacity, syncing with Twitter headers and the snapshot
+        
+            :Signature: RateLimiter(limits, window)
+            :Data: 2 requests per 0.4 seconds for endpoint e
+            
+        """
+        limiter = rate_limit.RateLimiter(limits={'e': 2}, window=0.4)
+        limiter.acquire('1-tw', 'e')
+        limiter.acquire('1-tw', 'e')
+        with self.assertRaises(rate_limit.RateLimitExceeded) as context:
+            limiter.acquire('1-tw', 'e', block=False)
+        self.assertGreater(context.exception.retry_after, 0.1)
+        limiter.acquire('2-tw', 'e', block=False)
+        start = time.time()
+        limiter.acquire('1-tw', 'e')
+        self.assertGreater(time.time() - start, 0.1)
+        with self.assertRaises(rate_limit.RateLimitExceeded):
+            limiter.acquire('1-tw', 'e', max_wait=0.01)
+        limiter.update('2-tw', 'e', {'x-rate-limit-remaining': '0', 
+                                     'x-rate-limit-reset': 
+                                        str(time.time() + 0.3)})
+        snapshot = limiter.snapshot()
+        self.assertEqual(0, snapshot['2-tw e']['tokens'])
+        self.assertGreater(snapshot['2-tw e']['retry_after'], 0.2)
+        limiter.penalize('2-tw', 'e')
+        self.assertGreater(limiter.snapshot()['2-tw e']['retry_after'], 0.3)
+
+
+    def test_fetch_timeline_retries_after_rate_limit(self):
+        """tests that fetch_timeline retries after the window reported by a rate limited response, or raises if not blocking
+        
+            :Signature: fetch_timeline(authUid, **kwargs)
+            :Data: handle answering first request with TwythonRateLimitError resetting in 0.2 seconds
+            
+        """
+        class LimitedHandle(FakeTimelineHandle):
+            def get_user_timeline(self, **params):
+                if not self.calls:
+                    self.calls.append(params)
+                    raise TwythonRateLimitError("Rate limited", 429, 
+                                                str(time.time() + 0.2))
+                return FakeTimelineHandle.get_user_timeline(self, **params)
+
+        handle = LimitedHandle(range(1, 11))
+        start = time.time()
+        tweets, status = twitter_data.TwitterUser().fetch_timeline(
+                            771, twitter_handle=handle)
+        self.assertGreater(time.time() - start, 0.15)
+        self.assertEqual(10, len(tweets))
+        handle = LimitedHandle(range(1, 11))
+        with self.assertRaises(rate_limit.RateLimitExceeded):
+            twitter_data.TwitterUser(block=False).fetch_timeline(
+                772, twitter_handle=handle)
+
+
+    def test_consumer_defers_rate_limited_messages(self):
+        """tests that a message whose handler hits the rate limit is hidden for retry_after instead of being retried at once
+        
+            :Data: 1 message, handler raising RateLimitExceeded with retry_after 100 seconds
+            
+        """
+        queue = queue_worker.LocalQueue()
+        queue.write(queue.new_message(json.dumps({'authUid': 1})))
+        def handler(params):
+            raise rate_limit.RateLimitExceeded(('1-tw', 'e'), 99.2)
+        consumer = queue_worker.QueueConsumer(queue, 
+                                              handler=handler, 
+                                              wait_time_seconds=0)
+        consumer.poll_once()
+        consumer.stop()
+        self.assertEqual(1, len(queue.messages))
+        self.assertEqual(0, queue.count())
+        hidden_for = queue.hidden_until.values()[0] - time.time()
+        self.assertGreater(hidden_for, 95)
+        self.assertLessEqual(hidden_for, 100)
+
+
+
+class MetricsUnitTests(unittest.TestCase):
+    """Test cases for module publishtimer.metrics"""
+
+    def test_metrics(self):
+        """tests counters, gauges, timers and their moving average
+        
+            :Data: counter incremented 3 times, gauge set twice, timer observed 1.0 and 2.0 seconds and timed block raising
+            
+        """
+        registry = metrics.Metrics()
+        for i in range(3):
+            registry.increment('received')
+        registry.set_gauge('depth', 5)
+        registry.set_gauge('depth', 2)
+        registry.observe('stage', 1.0)
+        registry.observe('stage', 2.0)
+        self.assertEqual(1.0 + metrics.EWMA_WEIGHT, registry.ewma('stage'))
+        self.assertEqual(0.0, registry.ewma('missing'))
+        with self.assertRaises(ValueError):
+            with registry.timed('block'):
+                raise ValueError()
+        snapshot = registry.snapshot()
+        self.assertEqual({'received': 3}, snapshot['counters'])
+        self.assertEqual({'depth': 2}, snapshot['gauges'])
+        self.assertEqual(2, snapshot['timers']['stage']['count'])
+        self.assertEqual(3.0, snapshot['timers']['stage']['total'])
+        self.assertEqual(2.0, snapshot['timers']['stage']['max'])
+        self.assertEqual(1, snapshot['timers']['block']['count'])
+        registry.reset()
+        self.assertEqual({}, registry.snapshot()['counters'])
+
+
         
 if __name__ == '__main__':    
     unittest.main()
\ No newline at end of file